@@ -0,0 +1,271 @@
+'''
+Copyright (C) 2021-2022 Orange Turbine
+https://orangeturbine.com
+orangeturbine@cgcookie.com
+
+Created by Jason van Gumster
+
+    This file is part of Swiffle.
+
+    Swiffle is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+# Headless batch conversion of SWF files to .blend files.
+#
+#   blender -b --python batch_import.py -- INPUT [INPUT ...] -o OUTPUT_DIR [-j JOBS] [--summary summary.json]
+#
+# Each INPUT can be a .swf file, a directory (searched recursively for .swf files), or a manifest
+# (a text file with one .swf path per line). The coordinator hands files to a pool of Blender worker
+# processes. Each worker keeps its interpreter (and the add-on) loaded between files and just resets to
+# the factory startup scene. A JSON summary with per-file timings and errors is written at the end;
+# each worker's stderr goes to batch_workerN.log in OUTPUT_DIR, which the summary points to.
+
+import argparse
+import importlib
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+import bpy
+
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_PREFIX = "SWF_BATCH_RESULT " # Blender chats on stdout too, so worker results are tagged
+
+
+def parse_args(argv):
+    # Blender keeps its own arguments; ours come after the "--"
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(prog = "blender -b --python batch_import.py --",
+                                     description = "Import SWF files to .blend files in parallel")
+    parser.add_argument("inputs", nargs = "*", help = ".swf files, directories or manifest files")
+    parser.add_argument("-o", "--output-dir", help = "Where the .blend files go")
+    parser.add_argument("-j", "--jobs", type = int, default = os.cpu_count() or 1, help = "Number of Blender worker processes")
+    parser.add_argument("--summary", help = "Write the JSON summary here instead of stdout")
+    parser.add_argument("--instance-shapes", action = "store_true", help = "Share one Grease Pencil datablock per shape")
+    parser.add_argument("--no-world", action = "store_true", help = "Don't apply the SWF's world settings")
+    parser.add_argument("--frame-start", type = int, default = 1)
+    parser.add_argument("--frame-end", type = int, default = 0)
+    parser.add_argument("--worker", action = "store_true", help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if not args.worker and (len(args.inputs) == 0 or args.output_dir is None):
+        parser.error("at least one INPUT and --output-dir are required")
+    return args
+
+
+def collect_inputs(inputs):
+    # Returns (swf path, .blend name) pairs; directories and manifests keep their layout so names don't collide
+    jobs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    if filename.lower().endswith(".swf"):
+                        swf_path = os.path.join(root, filename)
+                        jobs.append((swf_path, os.path.splitext(os.path.relpath(swf_path, path))[0] + ".blend"))
+        elif path.lower().endswith(".swf"):
+            jobs.append((path, os.path.splitext(os.path.basename(path))[0] + ".blend"))
+        else:
+            manifest_dir = os.path.dirname(os.path.abspath(path))
+            with open(path) as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if len(line) == 0 or line.startswith("#"):
+                        continue
+                    swf_path = os.path.join(manifest_dir, line)
+                    blend_name = os.path.relpath(swf_path, manifest_dir)
+                    if os.path.isabs(blend_name) or blend_name.split(os.sep)[0] == os.pardir:
+                        blend_name = os.path.basename(swf_path) # outside the manifest's directory
+                    jobs.append((swf_path, os.path.splitext(blend_name)[0] + ".blend"))
+
+    # Two inputs with the same .blend name would silently overwrite each other
+    seen = {}
+    unique_jobs = []
+    for swf_path, blend_name in jobs:
+        key = os.path.normcase(os.path.normpath(blend_name))
+        if key in seen:
+            if os.path.abspath(seen[key]) != os.path.abspath(swf_path):
+                raise ValueError("{0} and {1} would both be saved as {2}".format(seen[key], swf_path, blend_name))
+            continue # the same file given twice
+        seen[key] = swf_path
+        unique_jobs.append((swf_path, blend_name))
+    return unique_jobs
+
+
+def import_options(args):
+    return {
+        "use_modal": False,
+        "instance_shapes": args.instance_shapes,
+        "import_world": not args.no_world,
+        "frame_start": args.frame_start,
+        "frame_end": args.frame_end,
+    }
+
+
+def worker_args(args):
+    # The command line the coordinator hands to each worker process
+    cmd = [bpy.app.binary_path, "-b", "--factory-startup", "--python", os.path.abspath(__file__), "--", "--worker",
+           "--frame-start", str(args.frame_start), "--frame-end", str(args.frame_end)]
+    if args.instance_shapes:
+        cmd.append("--instance-shapes")
+    if args.no_world:
+        cmd.append("--no-world")
+    return cmd
+
+
+# Worker side
+
+def load_addon():
+    # The add-on is this script's package, so import it the way Blender would and register it
+    sys.path.insert(0, os.path.dirname(ADDON_DIR))
+    addon = importlib.import_module(os.path.basename(ADDON_DIR))
+    addon.register()
+    # Operators register under a name made from their bl_idname ("swf.import_swf"), not their class name
+    if not hasattr(bpy.types, "SWF_OT_import_swf"):
+        raise RuntimeError("SWF importer didn't register; are the add-on's dependencies installed?")
+    return addon
+
+
+def import_one(job, options):
+    result = {"input": job["input"], "output": job["output"], "ok": False}
+    start = time.perf_counter()
+    try:
+        bpy.ops.wm.read_homefile(use_empty = False)
+        op_result = bpy.ops.swf.import_swf(filepath = job["input"], **options)
+        result["import_seconds"] = time.perf_counter() - start
+        if "FINISHED" not in op_result:
+            raise RuntimeError("import returned {0}".format(", ".join(sorted(op_result))))
+        os.makedirs(os.path.dirname(job["output"]), exist_ok = True)
+        bpy.ops.wm.save_as_mainfile(filepath = job["output"])
+        result["objects"] = len(bpy.data.objects)
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = "{0}: {1}".format(type(e).__name__, e)
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_worker(args):
+    options = import_options(args)
+    try:
+        load_addon()
+        startup_error = None
+    except Exception as e:
+        startup_error = "{0}: {1}".format(type(e).__name__, e)
+    for line in sys.stdin:
+        job = json.loads(line)
+        if startup_error is None:
+            result = import_one(job, options)
+        else:
+            result = {"input": job["input"], "output": job["output"], "ok": False, "seconds": 0.0, "error": startup_error}
+        sys.stdout.write(RESULT_PREFIX + json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+
+# Coordinator side
+
+def start_worker(cmd, log_path):
+    # Blender's stderr goes to a log, so a crash leaves its traceback behind; restarted workers append to it
+    with open(log_path, "a") as log:
+        return subprocess.Popen(cmd, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = log,
+                                universal_newlines = True, bufsize = 1)
+
+
+def read_result(worker):
+    for line in worker.stdout:
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return None # Worker died
+
+
+def feed_worker(cmd, jobs, results, log_path):
+    worker = start_worker(cmd, log_path)
+    while True:
+        try:
+            job = jobs.get_nowait()
+        except queue.Empty:
+            break
+        worker.stdin.write(json.dumps(job) + "\n")
+        worker.stdin.flush()
+        result = read_result(worker)
+        if result is None:
+            # Blender crashed on this file; note it and carry on with a fresh worker
+            result = {"input": job["input"], "output": job["output"], "ok": False, "seconds": None,
+                      "error": "worker exited with code {0}".format(worker.wait())}
+            worker = start_worker(cmd, log_path)
+        result["log"] = log_path
+        results.append(result)
+    worker.stdin.close()
+    worker.wait()
+
+
+def run_coordinator(args):
+    start = time.perf_counter()
+    jobs = queue.Queue()
+    num_jobs = 0
+    try:
+        inputs = collect_inputs(args.inputs)
+    except ValueError as e:
+        sys.exit("Can't start the batch: {0}".format(e))
+    os.makedirs(args.output_dir, exist_ok = True)
+    for swf_path, blend_name in inputs:
+        jobs.put({"input": os.path.abspath(swf_path), "output": os.path.abspath(os.path.join(args.output_dir, blend_name))})
+        num_jobs += 1
+
+    results = []
+    cmd = worker_args(args)
+    threads = [threading.Thread(target = feed_worker, args = (cmd, jobs, results,
+                                os.path.abspath(os.path.join(args.output_dir, "batch_worker{0}.log".format(i)))))
+               for i in range(max(1, min(args.jobs, num_jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results.sort(key = lambda result: result["input"])
+    failed = [result for result in results if not result["ok"]]
+    summary = {
+        "inputs": num_jobs,
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "jobs": len(threads),
+        "seconds": time.perf_counter() - start,
+        "results": results,
+    }
+    if args.summary is not None:
+        with open(args.summary, "w") as summary_file:
+            json.dump(summary, summary_file, indent = 2)
+    else:
+        print(json.dumps(summary, indent = 2))
+    return 1 if len(failed) > 0 else 0
+
+
+def main():
+    args = parse_args(sys.argv)
+    if args.worker:
+        run_worker(args)
+    else:
+        sys.exit(run_coordinator(args))
+
+
+if __name__ == "__main__":
+    main()
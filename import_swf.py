@@ -26,11 +26,14 @@ Created by Jason van Gumster
 import bpy
 import aud
 import os
+import tempfile
 import mathutils
 from bpy_extras.io_utils import ImportHelper
-from bpy.props import StringProperty, BoolProperty
+from bpy.props import StringProperty, BoolProperty, IntProperty
 from math import isclose, radians
 import numpy as np
+import threading
+import time
 try:
     import Image
 except ImportError:
@@ -42,8 +45,20 @@ from . import global_vars
 from .lib.globals import *
 from .lib.world_env import build_world, rgb_gamma, hex_to_rgba
 from .lib.swf.movie import SWF
+from .lib.swf import sound as swf_sound
+from .lib.swf.consts import AudioCodec
+from .lib.swf.mixdown import Mixdown, extract_mixdown
+from .lib.swf.morph import MorphCache
+from .lib.swf.glyphs import GlyphCache, EM_SQUARE_LENGTH
+from .lib.swf.text import layout_text
+from .lib.swf.reachability import find_live_characters
 from .lib.swf.utils import ColorUtils
-from .lib.swf.data import SWFCurvedEdge, SWFStraightEdge
+from .lib.swf.data import SWFCurvedEdge, SWFStraightEdge, SWFMatrix, SWFFillStyle
+from .lib.swf.tag import TagDefineShape
+from .lib.swf.timeline import DisplayList
+
+
+MODAL_TIME_BUDGET = 0.1 # Seconds of scene building per modal timer event
 
 
 def close_points(p1, p2):
@@ -61,6 +76,64 @@ def load_swf(filepath):
     return swf
 
 
+def load_swf_in_background(filepath, result):
+    # Runs in a worker thread, so no bpy in here. Everything pure Python that the import needs up front gets done now
+    try:
+        swf = load_swf(filepath)
+        reachability = find_live_characters(swf)
+        for tag in swf.all_tags_of_type(TagDefineShape):
+            if reachability.is_live(tag):
+                tag.shapes._create_edge_maps()
+        result["reachability"] = reachability
+        result["swf"] = swf
+    except Exception as e:
+        result["error"] = e
+
+
+def frame_range_tags(tags, frame_start, frame_end = 0):
+    """
+    Return the root timeline tags needed to build frames frame_start through frame_end (0 is the last frame).
+    Frames before the range are fast-forwarded in pure Python; the display list they leave behind is
+    handed back as PlaceObject tags at the start of frame_start.
+    """
+    display_list = DisplayList()
+    range_tags = []
+    frame = 1
+    for tag in tags:
+        if tag.name == "End":
+            break
+        if frame < frame_start:
+            if tag.name.startswith("PlaceObject") or tag.name.startswith("RemoveObject"):
+                display_list.apply(tag)
+            elif tag.name == "ShowFrame":
+                frame += 1
+                if frame == frame_start:
+                    range_tags.extend(display_list.get_display_tags())
+            elif tag.name != "TagSoundStreamBlock":
+                # Definitions only get registered, so they're cheap to keep
+                range_tags.append(tag)
+        elif frame_end == 0 or frame <= frame_end:
+            range_tags.append(tag)
+            if tag.name == "ShowFrame":
+                frame += 1
+    range_tags.append(tags[-1])
+    return range_tags
+
+
+def decode_mp3_sound(sound_tag):
+    """
+    Decode an MP3 DefineSound for the event sound mixdown.
+    aud only reads MP3 from files, so the sound goes through a temporary one.
+    """
+    fd, sound_path = tempfile.mkstemp(suffix = ".mp3", prefix = "swf_sound_")
+    try:
+        with os.fdopen(fd, "wb") as sound_file:
+            swf_sound.write_sound_to_file(sound_tag, sound_file)
+        return aud.Sound(sound_path).data()
+    finally:
+        os.remove(sound_path)
+
+
 def pil_to_image(pil_image, name = "New Image"):
     """
     Borrowing from StackExchange (https://blender.stackexchange.com/questions/173206/how-to-efficiently-convert-a-pil-image-to-bpy-types-image)
@@ -110,17 +183,118 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
         default = True, # True for debugging; False in production
     )
 
+    instance_shapes: BoolProperty(
+        name = "Instance Shapes",
+        description = "Keep one Grease Pencil datablock per shape and place it with linked objects instead of copying its strokes for every placement",
+        default = False,
+    )
+
+    use_modal: BoolProperty(
+        name = "Keep Working While Importing",
+        description = "Read the SWF in the background and build the scene a little at a time (Esc cancels). Imports from background mode are always synchronous",
+        default = True,
+    )
+
+    frame_start: IntProperty(
+        name = "Start Frame",
+        description = "First SWF frame to import. Earlier frames are only read to work out what's on stage",
+        default = 1,
+        min = 1,
+    )
+
+    frame_end: IntProperty(
+        name = "End Frame",
+        description = "Last SWF frame to import (0 imports through the end of the SWF)",
+        default = 0,
+        min = 0,
+    )
+
     swf_data = {}
     swf_style_map = []
     swf_layer_matrices = {}
     swf_collection = None
+    swf_reachability = None
+    swf_mixdown = None
+    swf_morphs = None
+    swf_fonts = {}
+    swf_glyphs = None
+    swf_frame = 1 # The timeline frame being built; kept apart from the scene so artists can scrub during a modal import
+    _worker = None
+    _steps = None
+    _timer = None
+    _num_tags = 0 # Tags the modal import expects to parse, sprites included
+    _num_parsed_tags = 0
 
     def _find_material(self, style_combo):
         for mapping in self.swf_style_map:
             if mapping["line_style"] == style_combo["line_style"] and mapping["fill_style"] == style_combo["fill_style"]:
                 return mapping["material"]
-        print("No matching material")
-        return None
+        # First time we've seen this combination of styles, so make a material for it
+        style_combo["material"] = self._create_material(style_combo)
+        self.swf_style_map.append(style_combo)
+        return style_combo["material"]
+
+    def _create_material(self, style_combo):
+        mat_name = "SWF Material.000"
+        gp_mat = bpy.data.materials.new(mat_name)
+        bpy.data.materials.create_gpencil_data(gp_mat)
+        # Do the line style first
+        if style_combo["line_style"] is not None:
+            line_style = style_combo["line_style"]
+            gp_mat.grease_pencil.color  = hex_to_rgba(hex(ColorUtils.rgb(line_style.color)))
+            gp_mat["swf_linewidth"] = line_style.width
+            gp_mat["swf_no_close"] = line_style.no_close
+            if line_style.start_caps_style == 0:
+                gp_mat["swf_start_cap_style"] = "round"
+            elif line_style.start_caps_style == 1:
+                gp_mat["swf_start_cap_style"] = "none"
+            elif line_style.start_caps_style == 2:
+                gp_mat["swf_start_cap_style"] = "square"
+            if line_style.end_caps_style == 0:
+                gp_mat["swf_end_cap_style"] = "round"
+            elif line_style.end_caps_style == 1:
+                gp_mat["swf_end_cap_style"] = "none"
+            elif line_style.end_caps_style == 2:
+                gp_mat["swf_end_cap_style"] = "square"
+            if line_style.has_fill_flag:
+                #XXX TODO: set up texture or gradient fill for line style
+                pass
+            # GP doesn't support mitering or different caps, but may as well record that data somewhere
+            gp_mat["swf_line_miter"] = line_style.miter_limit_factor
+            if line_style.joint_style == 0:
+                gp_mat["swf_joint_style"] = "round"
+            elif line_style.joint_style == 1:
+                gp_mat["swf_joint_style"] = "bevel"
+            elif line_style.joint_style == 2:
+                gp_mat["swf_joint_style"] = "miter"
+            gp_mat.grease_pencil.show_stroke = True
+        else:
+            gp_mat.grease_pencil.show_stroke = False
+        # Now the fill style
+        if style_combo["fill_style"] is not None:
+            fill_style = style_combo["fill_style"]
+            if fill_style.type == 0: # Solid fill
+                gp_mat.grease_pencil.fill_style = "SOLID"
+                gp_mat.grease_pencil.fill_color = hex_to_rgba(hex(ColorUtils.rgb(fill_style.rgb)))
+            elif fill_style.type in [16, 18, 19]: # Linear or Radial gradient
+                #XXX Only support for two-color gradients in GP fill style gradients; only using first and last gradient record
+                gp_mat.grease_pencil.fill_style = "GRADIENT"
+                if fill_style.type == 16:
+                    gp_mat.grease_pencil.gradient_type = "LINEAR"
+                elif fill_style.type in [18, 19]:
+                    gp_mat.grease_pencil.gradient_type = "RADIAL"
+                gp_mat.grease_pencil.fill_color = hex_to_rgba(hex(ColorUtils.rgb(fill_style.gradient.records[0].color)))
+                gp_mat.grease_pencil.mix_color = hex_to_rgba(hex(ColorUtils.rgb(fill_style.gradient.records[-1].color)))
+                self.set_material_transforms(gp_mat, fill_style.gradient_matrix)
+            elif fill_style.type in [64, 65, 66, 67]: # Bitmap fill
+                gp_mat.grease_pencil.fill_style = "TEXTURE"
+                image = self._get_character(fill_style.bitmap_id)["data"]
+                gp_mat.grease_pencil.fill_image = image
+                self.set_material_transforms(gp_mat, fill_style.bitmap_matrix)
+            gp_mat.grease_pencil.show_fill = True
+        else:
+            gp_mat.grease_pencil.show_fill = False
+        return gp_mat
 
     def _setup_material(self, ob_data, shapes, edge_map, edge):
         style_combo = {
@@ -152,14 +326,110 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
             for point in stroke.points:
                 point.co = transform_matrix @ point.co
 
-    def _key_transforms(self, object, matrix, depth = 0):
+    def _key_transforms(self, object, matrix, depth = 0, frame = None):
         #XXX Blender doesn't support shearing at the object level, so the rotateSkew0 and rotateSkew1 values can only be used for rotation
-        m = swf_matrix_to_blender_matrix(matrix)
-        object.matrix_world = m
-        object.location[2] = depth / 100 # Hacky attempt to get at least some kind of z-order at the object level
-        object.keyframe_insert(data_path = "location")
-        object.keyframe_insert(data_path = "rotation_euler")
-        object.keyframe_insert(data_path = "scale")
+        # A matrix of None keys the object where it already is
+        if frame is None:
+            frame = self.swf_frame
+        if matrix is not None:
+            m = swf_matrix_to_blender_matrix(matrix)
+            object.matrix_world = m
+            object.location[2] = depth / 100 # Hacky attempt to get at least some kind of z-order at the object level
+        object.keyframe_insert(data_path = "location", frame = frame)
+        object.keyframe_insert(data_path = "rotation_euler", frame = frame)
+        object.keyframe_insert(data_path = "scale", frame = frame)
+
+    def _key_visibility(self, object, visible, frame):
+        object.hide_viewport = not visible
+        object.hide_render = not visible
+        object.keyframe_insert(data_path = "hide_viewport", frame = frame)
+        object.keyframe_insert(data_path = "hide_render", frame = frame)
+
+    def _key_color_transform(self, object, color_transform, frame):
+        # Instances share their datablock (and materials), so the color transform has to live on the object
+        tint = object.grease_pencil_modifiers.get("SWF Color Transform")
+        if tint is None:
+            tint = object.grease_pencil_modifiers.new("SWF Color Transform", "GP_TINT")
+        tint.color = rgb_gamma([color_transform.rAdd, color_transform.gAdd, color_transform.bAdd], 2.2)
+        tint.factor = 1.0 - (color_transform.rMult / 255) #XXX Assumes uniform mixing for R, G, and B
+        object.keyframe_insert(data_path = 'grease_pencil_modifiers["SWF Color Transform"].color', frame = frame)
+        object.keyframe_insert(data_path = 'grease_pencil_modifiers["SWF Color Transform"].factor', frame = frame)
+        if hasattr(color_transform, "aMult"):
+            opacity = object.grease_pencil_modifiers.get("SWF Opacity")
+            if opacity is None:
+                opacity = object.grease_pencil_modifiers.new("SWF Opacity", "GP_OPACITY")
+            opacity.factor = min(max(color_transform.aMult / 256 + color_transform.aAdd / 255, 0.0), 1.0)
+            object.keyframe_insert(data_path = 'grease_pencil_modifiers["SWF Opacity"].factor', frame = frame)
+
+    def place_instance(self, tag, instances, collection):
+        # Instancing mode: every placement is its own object, but all of them link the same character data
+        frame = self.swf_frame
+        if tag.hasCharacter:
+            if tag.depth in instances:
+                # Character at given depth is removed. New character is added at given depth
+                self._key_visibility(instances.pop(tag.depth), False, frame)
+            character = self._get_character(tag.characterId, ratio = tag.ratio if tag.hasRatio else 0)
+            if character["type"] in ["shape", "text"]:
+                ob = bpy.data.objects.new("SWF Shape.{0:03}".format(tag.characterId), character["data"])
+            else:
+                ob = bpy.data.objects.new("SWF Sprite.{0:03}".format(tag.characterId), None)
+                ob.instance_type = "COLLECTION"
+                ob.instance_collection = character["data"]
+            ob["swf_characterId"] = tag.characterId
+            ob["swf_depth"] = tag.depth
+            if self.swf_data[tag.characterId]["type"] == "morph":
+                ob["swf_ratio"] = tag.ratio if tag.hasRatio else 0
+            if hasattr(tag, "instanceName") and tag.instanceName is not None:
+                ob.name = tag.instanceName
+            collection.objects.link(ob)
+            instances[tag.depth] = ob
+            self._key_appearance(ob, tag.matrix if tag.hasMatrix else SWFMatrix(None), tag.depth, frame)
+        elif tag.hasMove and tag.depth in instances:
+            # Character at given depth has been modified
+            ob = instances[tag.depth]
+            if tag.hasRatio and ob.get("swf_ratio", tag.ratio) != tag.ratio:
+                # Shape tween: object data can't be keyed, so a copy of the instance that links
+                # the morph shape at the new ratio takes over from here
+                character = self._get_character(ob["swf_characterId"], ratio = tag.ratio)
+                self._key_visibility(ob, False, frame)
+                ob = ob.copy()
+                ob.animation_data_clear()
+                ob.data = character["data"]
+                ob["swf_ratio"] = tag.ratio
+                collection.objects.link(ob)
+                instances[tag.depth] = ob
+                self._key_appearance(ob, None, tag.depth, frame)
+            if tag.hasMatrix:
+                self._key_transforms(ob, tag.matrix, depth = tag.depth, frame = frame)
+        else:
+            return
+
+        if tag.hasColorTransform and ob.type == "GPENCIL":
+            self._key_color_transform(ob, tag.colorTransform, frame)
+
+    def _key_appearance(self, ob, matrix, depth, frame):
+        # Show a new instance from frame on, at matrix (None: where it is)
+        if frame > 1:
+            # Hold the initial placement from the start of the timeline so looping sprites cycle cleanly
+            self._key_transforms(ob, matrix, depth = depth, frame = 1)
+            self._key_visibility(ob, False, frame - 1)
+        self._key_transforms(ob, matrix, depth = depth, frame = frame)
+        self._key_visibility(ob, True, frame)
+
+    def remove_instance(self, tag, instances):
+        if tag.depth in instances:
+            self._key_visibility(instances.pop(tag.depth), False, self.swf_frame)
+
+    def loop_instances(self, collection, frame_end):
+        # Sprites loop in SWF, so hold each instance's last state and cycle every animation curve
+        for ob in collection.objects:
+            for data_path in ["location", "rotation_euler", "scale", "hide_viewport", "hide_render"]:
+                ob.keyframe_insert(data_path = data_path, frame = frame_end)
+            if ob.animation_data is None or ob.animation_data.action is None:
+                continue
+            for fcurve in ob.animation_data.action.fcurves:
+                if len(fcurve.modifiers) == 0:
+                    fcurve.modifiers.new("CYCLES")
 
     def create_stroke_from_edge_map(self, shapes, edge_map, gp_data, gp_frame, stroke_type):
         # Look for holes, but handle them later
@@ -325,144 +595,142 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
         gp_mat.grease_pencil.texture_offset[1] = -gp_matrix.decompose()[0][1] - 0.5
         gp_mat.grease_pencil.texture_angle = gp_matrix.decompose()[1].to_euler()[2]
 
-    def pre_process_tags(self, tags):
-        # Pull in re-sharable data (images, materials, sound)
-
-        fill_styles = []
-        line_styles = []
-        sound_head = None
-        mpeg_frames = b""
-
-        for tag in tags:
-            if tag.name == "End":
-                if len(mpeg_frames) > 0: # There is sound
-                    sound_file = open("/tmp/swf_sound.mp3", "wb") #XXX Path should probably be customizable
-                    sound_file.write(mpeg_frames)
-                    sound_file.close()
-                    if not bpy.context.scene.sequence_editor:
-                        bpy.context.scene.sequence_editor_create()
-                    sound_strip = bpy.context.scene.sequence_editor.sequences.new_sound("swf_sound", "/tmp/swf_sound.mp3", 0, 1)
-
-            elif tag.name.startswith("TagSoundStreamHead"):
-                sound_head = tag
-
-            elif tag.name == "TagSoundStreamBlock":
-                if sound_head.soundFormat == 2: # MP3
-                    #XXX Currently only supporting embedded MP3
-                    #XXX Also assumes a single embedded sound
-                    tag.complete_parse_with_header(sound_head)
-                    mpeg_frames += tag.mpegFrames
-
-            if tag.name == "DefineBitsJPEG2":
+    def create_shape(self, tag):
+        # Make a new Grease Pencil object to hold our shapes
+        gp_data = bpy.data.grease_pencils.new(tag.name + ".{0:03}".format(tag.characterId))
+        gp_data["swf_characterId"] = tag.characterId
+        # Build fill and line maps with absolute coordinates and correct style indices
+        tag.shapes._create_edge_maps()
+        # We need some basic layer stuff in our Grease Pencil object for drawing
+        gp_layer = gp_data.layers.new("Layer", set_active = True)
+        if self.instance_shapes:
+            # Shared datablocks have to be visible from the start of any timeline that places them
+            gp_frame = gp_layer.frames.new(1)
+        else:
+            gp_frame = gp_layer.frames.new(self.swf_frame) #XXX This is only the first frame... not all of them
+
+        # Start creating shapes
+        for em_group in range(0, len(tag.shapes.fill_edge_maps)):
+            #XXX Assumes fill_edge_maps and line_edge_maps are of equal length
+            # Start with fills
+            edge_map = tag.shapes.fill_edge_maps[em_group]
+            self.create_stroke_from_edge_map(tag.shapes, edge_map, gp_data, gp_frame, "fill")
+            # Now the lines
+            edge_map = tag.shapes.line_edge_maps[em_group]
+            self.create_stroke_from_edge_map(tag.shapes, edge_map, gp_data, gp_frame, "line")
+        return gp_data
+
+    def create_text(self, tag):
+        # Static text is drawn with fill strokes of its glyphs' outlines, which the glyph cache flattens once per glyph
+        gp_data = bpy.data.grease_pencils.new(tag.name + ".{0:03}".format(tag.characterId))
+        gp_data["swf_characterId"] = tag.characterId
+        gp_layer = gp_data.layers.new("Layer", set_active = True)
+        if self.instance_shapes:
+            gp_frame = gp_layer.frames.new(1)
+        else:
+            gp_frame = gp_layer.frames.new(self.swf_frame)
+        hole_mat = self._find_material({"line_style": None, "fill_style": None})
+        fill_mats = {}
+        layout = layout_text(tag)
+        # Glyphs scale by their text height, then the text matrix ([a b], [c d], [tx ty]) takes text space to character space
+        text_matrix = np.array(tag.textMatrix.to_array()).reshape(3, 2)
+        scales = layout.heights / EM_SQUARE_LENGTH
+        for font_id, index, x, y, scale, color in zip(layout.font_ids.tolist(), layout.glyph_indices.tolist(),
+                                                      layout.x.tolist(), layout.y.tolist(), scales.tolist(), layout.colors.tolist()):
+            font = self.swf_fonts.get(font_id)
+            if font is None:
+                continue
+            if color not in fill_mats:
+                fill_style = SWFFillStyle()
+                fill_style.type = 0
+                fill_style.rgb = color
+                fill_mats[color] = self._find_material({"line_style": None, "fill_style": fill_style})
+            outline = self.swf_glyphs.get_outline(font, index)
+            for contour, is_hole in zip(outline.contours, outline.holes):
+                gp_mat = hole_mat if is_hole else fill_mats[color]
+                if gp_mat.name not in gp_data.materials:
+                    gp_data.materials.append(gp_mat)
+                points = (np.array(contour) * scale + (x, y)) @ text_matrix[:2] + text_matrix[2]
+                gp_stroke = self._new_gp_stroke(gp_data, gp_frame, gp_mat)
+                self._finalize_stroke(gp_data, gp_stroke, points.tolist(), "hole" if is_hole else "fill")
+        return gp_data
+
+    def _get_character(self, character_id, ratio = 0):
+        # Characters are built the first time they're referenced, so anything the SWF never uses is never processed
+        return self._run_steps(self.iter_get_character(character_id, ratio = ratio))
+
+    def iter_get_character(self, character_id, ratio = 0):
+        # Generator version of _get_character() that returns the character. Sprites are built with iter_parse_tags(), so their tags are spread out like the root timeline's
+        character = self.swf_data[character_id]
+        if character["type"] == "morph":
+            # Morph shapes are built once per ratio they're shown at, then placed like any other shape
+            shapes = character["data"]
+            if ratio not in shapes:
+                morph_frame = self.swf_morphs.get_frame(character["tag"], ratio)
+                shapes[ratio] = {"tag": morph_frame, "data": self.create_shape(morph_frame), "type": "shape"}
+            return shapes[ratio]
+        if character["data"] is None:
+            tag = character["tag"]
+            if character["type"] == "shape":
+                character["data"] = self.create_shape(tag)
+            elif character["type"] == "text":
+                character["data"] = self.create_text(tag)
+            elif character["type"] == "image":
                 image = Image.open(tag.bitmapData)
                 img_datablock = pil_to_image(image, name = tag.name)
                 img_datablock["swf_characterId"] = tag.characterId
-                self.swf_data[tag.characterId] = {"data": img_datablock, "type": "image"}
-        
-            # Right now this doesn't account for morphing styles... ideally that could be done with a modifier
-            elif tag.name.startswith("DefineShape"):
-                tag.shapes._create_edge_maps()
-                edge_fills = tag.shapes._fillStyles
-                edge_lines = tag.shapes._lineStyles
-
-                # Populate arrays of global fill/line styles
-                for fs in edge_fills:
-                    if fs not in fill_styles:
-                        fill_styles.append(fs)
-                for ls in edge_lines:
-                    if ls not in line_styles:
-                        line_styles.append(ls)
-
-                # Populate global style combos list
-                for edge_map in tag.shapes.line_edge_maps:
-                    for edges in edge_map.values():
-                        for edge in edges:
-                            style_combo = {
-                                "line_style": edge_lines[edge.line_style_idx - 1] if edge.line_style_idx > 0 else None,
-                                "fill_style": edge_fills[edge.fill_style_idx - 1] if edge.fill_style_idx > 0 else None
-                            }
-                            if style_combo not in self.swf_style_map:
-                                self.swf_style_map.append(style_combo)
-                for edge_map in tag.shapes.fill_edge_maps: #XXX Partial copy pasta from above... assumes line edge maps is the same length as fill edge maps
-                    for edges in edge_map.values():
-                        for edge in edges:
-                            style_combo = {
-                                "line_style": edge_lines[edge.line_style_idx - 1] if edge.line_style_idx > 0 else None,
-                                "fill_style": edge_fills[edge.fill_style_idx - 1] if edge.fill_style_idx > 0 else None
-                            }
-                            if style_combo not in self.swf_style_map:
-                                self.swf_style_map.append(style_combo)
-
-        # Now we create our materials
-        for style_combo in self.swf_style_map:
-            mat_name = "SWF Material.000"
-            gp_mat = bpy.data.materials.new(mat_name)
-            bpy.data.materials.create_gpencil_data(gp_mat)
-            # Do the line style first
-            if style_combo["line_style"] is not None:
-                line_style = style_combo["line_style"]
-                gp_mat.grease_pencil.color  = hex_to_rgba(hex(ColorUtils.rgb(line_style.color)))
-                gp_mat["swf_linewidth"] = line_style.width
-                gp_mat["swf_no_close"] = line_style.no_close
-                if line_style.start_caps_style == 0:
-                    gp_mat["swf_start_cap_style"] = "round"
-                elif line_style.start_caps_style == 1:
-                    gp_mat["swf_start_cap_style"] = "none"
-                elif line_style.start_caps_style == 2:
-                    gp_mat["swf_start_cap_style"] = "square"
-                if line_style.end_caps_style == 0:
-                    gp_mat["swf_end_cap_style"] = "round"
-                elif line_style.end_caps_style == 1:
-                    gp_mat["swf_end_cap_style"] = "none"
-                elif line_style.end_caps_style == 2:
-                    gp_mat["swf_end_cap_style"] = "square"
-                if line_style.has_fill_flag:
-                    #XXX TODO: set up texture or gradient fill for line style
-                    pass
-                # GP doesn't support mitering or different caps, but may as well record that data somewhere
-                gp_mat["swf_line_miter"] = line_style.miter_limit_factor
-                if line_style.joint_style == 0:
-                    gp_mat["swf_joint_style"] = "round"
-                elif line_style.joint_style == 1:
-                    gp_mat["swf_joint_style"] = "bevel"
-                elif line_style.joint_style == 2:
-                    gp_mat["swf_joint_style"] = "miter"
-                gp_mat.grease_pencil.show_stroke = True
-            else:
-                gp_mat.grease_pencil.show_stroke = False
-            # Now the fill style
-            if style_combo["fill_style"] is not None:
-                fill_style = style_combo["fill_style"]
-                if fill_style.type == 0: # Solid fill
-                    gp_mat.grease_pencil.fill_style = "SOLID"
-                    gp_mat.grease_pencil.fill_color = hex_to_rgba(hex(ColorUtils.rgb(fill_style.rgb)))
-                elif fill_style.type in [16, 18, 19]: # Linear or Radial gradient
-                    #XXX Only support for two-color gradients in GP fill style gradients; only using first and last gradient record
-                    gp_mat.grease_pencil.fill_style = "GRADIENT"
-                    if fill_style.type == 16:
-                        gp_mat.grease_pencil.gradient_type = "LINEAR"
-                    elif fill_style.type in [18, 19]:
-                        gp_mat.grease_pencil.gradient_type = "RADIAL"
-                    gp_mat.grease_pencil.fill_color = hex_to_rgba(hex(ColorUtils.rgb(fill_style.gradient.records[0].color)))
-                    gp_mat.grease_pencil.mix_color = hex_to_rgba(hex(ColorUtils.rgb(fill_style.gradient.records[-1].color)))
-                    self.set_material_transforms(gp_mat, fill_style.gradient_matrix)
-                elif fill_style.type in [64, 65, 66, 67]: # Bitmap fill
-                    gp_mat.grease_pencil.fill_style = "TEXTURE"
-                    image = self.swf_data[fill_style.bitmap_id]["data"]
-                    gp_mat.grease_pencil.fill_image = image
-                    self.set_material_transforms(gp_mat, fill_style.bitmap_matrix)
-                gp_mat.grease_pencil.show_fill = True
-            else:
-                gp_mat.grease_pencil.show_fill = False
-            # Add the material to the style map
-            style_combo["material"] = gp_mat
+                character["data"] = img_datablock
+            elif character["type"] == "sprite":
+                sprite_object = yield from self.iter_parse_tags(tag.tags, is_sprite = True)
+                if sprite_object is not None:
+                    sprite_object["swf_characterId"] = tag.characterId
+                    sprite_object["swf_sprite"] = True
+                character["data"] = sprite_object
+        return character
 
-    def parse_tags(self, tags, is_sprite = False):
+    def _link_materials(self, gp_data, character_data, strokes):
+        # Strokes copied over from a character's datablock still index the character's materials
+        for stroke in strokes:
+            stroke_mat = character_data.materials[stroke.material_index]
+            if stroke_mat.name not in gp_data.materials:
+                gp_data.materials.append(stroke_mat)
+            # Remap index to match updated material list
+            stroke.material_index = {stroke_mat.name: i for i, stroke_mat in enumerate(gp_data.materials)}[stroke_mat.name]
+
+    def add_sound_strip(self, sound_stream, frame_start = 1):
+        # Each stream gets its own file, so imports running side by side don't overwrite each other's sound
+        sound_path = swf_sound.extract_stream(sound_stream)
+        if not bpy.context.scene.sequence_editor:
+            bpy.context.scene.sequence_editor_create()
+        sound_strip = bpy.context.scene.sequence_editor.sequences.new_sound("swf_sound", sound_path, 0, frame_start)
+
+    def add_mixdown_strip(self, frame_start = 1):
+        # All the event sounds (StartSound tags) go in one strip, mixed down to a WAV file
+        sound_path = extract_mixdown(self.swf_mixdown)
+        if not bpy.context.scene.sequence_editor:
+            bpy.context.scene.sequence_editor_create()
+        sound_strip = bpy.context.scene.sequence_editor.sequences.new_sound("swf_event_sounds", sound_path, 1, frame_start)
+
+    def parse_tags(self, tags, is_sprite = False, first_frame = 1):
+        # Run the whole timeline in one go
+        return self._run_steps(self.iter_parse_tags(tags, is_sprite = is_sprite, first_frame = first_frame))
+
+    def _run_steps(self, steps):
+        # Run a generator of iter_parse_tags() or iter_get_character() to the end and return its result
+        while True:
+            try:
+                next(steps)
+            except StopIteration as result:
+                return result.value
+
+    def iter_parse_tags(self, tags, is_sprite = False, first_frame = 1):
+            # Generator that yields before processing every tag, those of the sprites it builds included, so the modal import can spread the work out
             # Parsing should basically look like this:
             #  * Iterate through all tags in order.
             #    * For every ShowFrame tag (type TagShowFrame, or 1), increment the current frame after processing.
             #    * All tags preceding the ShowFrame tag are potential candidates for being displayed on that previous frame.
             #    * Look for Define[Shape4,Sprite,etc] tags to dictate the actual objects added to the scene
+            #      * Definitions are only registered as they go by; _get_character() builds them (and their materials and images) the first time a PlaceObject tag uses them
             #      * DefineShape is another loop
             #        * In the the DefineShape4 is a property called shapes that has all the shapes
             #        * After running shapes._create_edge_maps(), there are properties, fillStyles and lineStyles that are arrays of material definitions for strokes
@@ -471,17 +739,36 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
             #    * The PlaceObject and PlaceObject2 tags (types 4 and 26, respectively) tell how and where assets are moved, based on their characterId (defined in the Define[blah] tag)
             #    * If you run into a DefineSprite tag, the whole process above gets nested. Current plan is to make a collection and place it as a collection instance
 
-            orig_frame = bpy.context.scene.frame_current
-            bpy.context.scene.frame_current = 1
+            orig_frame = self.swf_frame
+            self.swf_frame = first_frame
             swf_object = None
-
-            #for tag in tags:
-            for i, tag in enumerate(tags):
-                #print(i, tag.name)
+            sound_streams = [] # (stream tags, frame it starts playing) for each sound stream in the root timeline
+            # Instancing mode state: objects by depth, and the collection this timeline's objects live in
+            instances = {}
+            morph_depths = {} # characterIds of the morph shapes on this timeline, by depth
+            if not self.instance_shapes:
+                timeline_collection = None
+            elif is_sprite:
+                timeline_collection = bpy.data.collections.new("SWF Sprite")
+            else:
+                timeline_collection = self.swf_collection
+
+            for tag in tags:
+                self._num_parsed_tags += 1
+                yield
+                #print(tag.name)
+                if not self.swf_reachability.is_live(tag):
+                    # Nothing ever places this character, so don't bother with it
+                    continue
                 if tag.name == "End":
-                    if is_sprite:
+                    if is_sprite and self.instance_shapes:
+                        if self.swf_frame > 2:
+                            self.loop_instances(timeline_collection, self.swf_frame - 1)
+                        self.swf_frame = orig_frame
+                        return timeline_collection
+                    elif is_sprite:
                         # Get first and last frames of this sprite
-                        frame_start = bpy.context.scene.frame_current
+                        frame_start = self.swf_frame
                         frame_end = 0
                         for layer in swf_object.data.layers:
                             #XXX Assumes frames array is sorted by frame number
@@ -497,45 +784,64 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
                             loop_modifier.frame_start = frame_start
                             loop_modifier.frame_end = frame_end - 1 #XXX Not sure the -1 is correct; but it made the test file play smoother
 
-                    bpy.context.scene.frame_current = orig_frame
+                    else:
+                        for sound_stream, sound_frame in sound_streams:
+                            if swf_sound.supported(sound_stream): #XXX Nellymoser and Speex are skipped
+                                self.add_sound_strip(sound_stream, frame_start = sound_frame)
+                        if not self.swf_mixdown.is_silent():
+                            self.add_mixdown_strip(frame_start = first_frame)
+
+                    self.swf_frame = orig_frame
                     return swf_object
 
-                if tag.name.startswith("DefineShape"): # We have a new object to add!
-                    # Make a new Grease Pencil object to hold our shapes
-                    gp_data = bpy.data.grease_pencils.new(tag.name + ".{0:03}".format(tag.characterId))
-                    gp_data["swf_characterId"] = tag.characterId
-                    # Build fill and line maps with absolute coordinates and correct style indices
-                    tag.shapes._create_edge_maps()
-                    line_styles = tag.shapes._lineStyles
-                    fill_styles = tag.shapes._fillStyles
-                    # We need some basic layer stuff in our Grease Pencil object for drawing
-                    gp_layer = gp_data.layers.new("Layer", set_active = True)
-                    gp_frame = gp_layer.frames.new(bpy.context.scene.frame_current) #XXX This is only the first frame... not all of them
-
-                    # Start creating shapes
-                    for em_group in range(0, len(tag.shapes.fill_edge_maps)):
-                        #XXX Assumes fill_edge_maps and line_edge_maps are of equal length
-                        # Start with fills
-                        edge_map = tag.shapes.fill_edge_maps[em_group]
-                        self.create_stroke_from_edge_map(tag.shapes, edge_map, gp_data, gp_frame, "fill")
-                        # Now the lines
-                        edge_map = tag.shapes.line_edge_maps[em_group]
-                        self.create_stroke_from_edge_map(tag.shapes, edge_map, gp_data, gp_frame, "line")
-                    # Populate the swf_data dict with our newly imported stuff
-                    self.swf_data[tag.characterId] = {"data": gp_data, "type": "shape"}
-
-                if tag.name == "DefineSprite":
-                    sprite_object = self.parse_tags(tag.tags, is_sprite = True)
-                    sprite_object["swf_characterId"] = tag.characterId
-                    sprite_object["swf_sprite"] = True
-                    # Populate the swf_data dict with our newly imported stuff
-                    self.swf_data[tag.characterId] = {"data": sprite_object, "type": "sprite"}
+                if tag.name.startswith("DefineShape"):
+                    # Only register definitions here; they get built the first time something places them
+                    self.swf_data[tag.characterId] = {"tag": tag, "data": None, "type": "shape"}
+
+                elif tag.name in ["DefineFont", "DefineFont2", "DefineFont3"]:
+                    # Fonts are never placed; text looks their glyphs up in the glyph cache
+                    self.swf_fonts[tag.characterId] = tag
+
+                elif tag.name in ["TagDefineText", "DefineText2"]:
+                    self.swf_data[tag.characterId] = {"tag": tag, "data": None, "type": "text"}
+
+                elif tag.name.startswith("DefineMorphShape"):
+                    self.swf_data[tag.characterId] = {"tag": tag, "data": {}, "type": "morph"}
+
+                elif tag.name == "DefineBitsJPEG2":
+                    self.swf_data[tag.characterId] = {"tag": tag, "data": None, "type": "image"}
+
+                elif tag.name == "DefineSprite":
+                    self.swf_data[tag.characterId] = {"tag": tag, "data": None, "type": "sprite"}
 
-                if tag.name.startswith("PlaceObject"):
+                elif tag.name.startswith("TagSoundStreamHead") and not is_sprite:
+                    sound_streams.append(([tag], self.swf_frame))
+
+                elif tag.name == "TagSoundStreamBlock" and not is_sprite and len(sound_streams) > 0:
+                    # Only the blocks are kept; they're written straight to the sound file at the end
+                    sound_stream, sound_frame = sound_streams[-1]
+                    if len(sound_stream) == 1:
+                        # The stream starts playing with its first block
+                        sound_streams[-1] = (sound_stream, self.swf_frame)
+                    sound_stream.append(tag)
+
+                if tag.name.startswith("PlaceObject") and tag.hasCharacter:
+                    # Build the character before placing it, so a new sprite's tags are taken one step at a time like these
+                    character = yield from self.iter_get_character(tag.characterId, ratio = tag.ratio if tag.hasRatio else 0)
+
+                if tag.name.startswith("PlaceObject") and self.instance_shapes:
+                    self.place_instance(tag, instances, timeline_collection)
+
+                elif tag.name.startswith("PlaceObject"):
                     if tag.hasCharacter:
-                        # Add a new character (that we've already defined with ID of characterId)
-                        character = self.swf_data[tag.characterId]
-                        if character["type"] == "shape":
+                        # Add a new character (that we've already defined with ID of characterId, and built above)
+                        if self.swf_data[tag.characterId]["type"] == "morph":
+                            morph_depths[tag.depth] = tag.characterId
+                        else:
+                            morph_depths.pop(tag.depth, None)
+                        if character["type"] in ["shape", "text"]:
+                            # Shapes can be placed by more than one timeline, so make sure the copy lands on this frame
+                            character["data"].layers["Layer"].frames[0].frame_number = self.swf_frame
                             if swf_object is None:
                                 if not is_sprite:
                                     swf_object = bpy.data.objects.new("SWF Object", character["data"].copy())
@@ -560,7 +866,7 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
                                 self.swf_layer_matrices[tag.depth] = layer_matrix
                             elif str(tag.depth) not in swf_object.data.layers:
                                 layer = swf_object.data.layers.new(str(tag.depth))
-                                character["data"].layers["Layer"].frames[0].frame_number = bpy.context.scene.frame_current
+                                character["data"].layers["Layer"].frames[0].frame_number = self.swf_frame
                                 frame = layer.frames.copy(character["data"].layers["Layer"].frames[0])
                                 #XXX Hacky attempt to maintain proper sorting of layers
                                 swf_object.data.layers.active_index -= 1
@@ -569,12 +875,7 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
                                     swf_object.data.layers.move(layer, "DOWN")
                                     swf_object.data.layers.active_index -= 2
                                 swf_object.data.layers.active_index = len(swf_object.data.layers) - 1
-                                for stroke in frame.strokes:
-                                    stroke_mat = character["data"].materials[stroke.material_index]
-                                    if stroke_mat.name not in swf_object.data.materials:
-                                        swf_object.data.materials.append(stroke_mat)
-                                    # Remap index to match updated material list
-                                    stroke.material_index = {stroke_mat.name: i for i, stroke_mat in enumerate(swf_object.data.materials)}[stroke_mat.name]
+                                self._link_materials(swf_object.data, character["data"], frame.strokes)
                                 if tag.hasMatrix:
                                     layer_matrix = swf_matrix_to_blender_matrix(tag.matrix)
                                     self._transform_strokes(frame.strokes, layer_matrix, swf_object.matrix_world)
@@ -585,14 +886,9 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
                             elif str(tag.depth) in swf_object.data.layers:# and tag.hasMove:
                                 # Character at given depth is removed. New character (already defined with ID of characterId) is added at given depth
                                 layer = swf_object.data.layers[str(tag.depth)]
-                                character["data"].layers["Layer"].frames[0].frame_number = bpy.context.scene.frame_current
+                                character["data"].layers["Layer"].frames[0].frame_number = self.swf_frame
                                 frame = layer.frames.copy(character["data"].layers["Layer"].frames[0])
-                                for stroke in frame.strokes:
-                                    stroke_mat = character["data"].materials[stroke.material_index]
-                                    if stroke_mat.name not in swf_object.data.materials:
-                                        swf_object.data.materials.append(stroke_mat)
-                                    # Remap index to match updated material list
-                                    stroke.material_index = {stroke_mat.name: i for i, stroke_mat in enumerate(swf_object.data.materials)}[stroke_mat.name]
+                                self._link_materials(swf_object.data, character["data"], frame.strokes)
                                 layer_matrix = self.swf_layer_matrices[tag.depth]
                                 self._transform_strokes(frame.strokes, layer_matrix, swf_object.matrix_world)
                         elif character["type"] == "sprite":
@@ -610,8 +906,16 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
                         # Character at given depth (only one character is allowed at a given depth) has been modified
                         if "swf_sprite" not in swf_object:
                             active_layer = swf_object.data.layers[str(tag.depth)]
-                            new_frame = active_layer.frames.copy(active_layer.frames[-1])
-                            new_frame.frame_number = bpy.context.scene.frame_current
+                            if tag.hasRatio and tag.depth in morph_depths:
+                                # Shape tween: swap in the morph shape at the new ratio, where the layer's matrix left the last one
+                                character = self._get_character(morph_depths[tag.depth], ratio = tag.ratio)
+                                character["data"].layers["Layer"].frames[0].frame_number = self.swf_frame
+                                new_frame = active_layer.frames.copy(character["data"].layers["Layer"].frames[0])
+                                self._link_materials(swf_object.data, character["data"], new_frame.strokes)
+                                self._transform_strokes(new_frame.strokes, self.swf_layer_matrices[tag.depth], swf_object.matrix_world)
+                            else:
+                                new_frame = active_layer.frames.copy(active_layer.frames[-1])
+                                new_frame.frame_number = self.swf_frame
                             if tag.hasMatrix:
                                 layer_matrix = self.swf_layer_matrices[tag.depth]
                                 self._transform_strokes(new_frame.strokes, swf_object.matrix_world, layer_matrix) 
@@ -637,17 +941,19 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
                         for mat in materials:
                             swf_object.data.materials[mat].grease_pencil.mix_factor = mix_factor
 
-                if tag.name == "RemoveObject2":
+                if tag.name.startswith("RemoveObject") and self.instance_shapes:
+                    self.remove_instance(tag, instances)
+
+                elif tag.name == "RemoveObject2":
                     # Insert a blank frame in the given layer at the current frame
-                    swf_object.data.layers[str(tag.depth)].frames.new(bpy.context.scene.frame_current)
+                    swf_object.data.layers[str(tag.depth)].frames.new(self.swf_frame)
                 
                 if tag.name == "ShowFrame":
-                    bpy.context.scene.frame_current += 1
+                    self.swf_frame += 1
                     #break #XXX Only show the first frame for now
 
-    def execute(self, context):
-        swf = load_swf(self.filepath)
-
+    def setup_import(self, context, swf, reachability = None):
+        # Everything that has to happen before the timeline gets built. Returns the tags to parse
         if context.active_object is not None and context.active_object.mode != "OBJECT":
             bpy.ops.object.mode_set(mode='OBJECT')
 
@@ -667,8 +973,10 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
                 bpy.context.scene.collection.children.unlink(camera_collection)
             camera_collection.objects.link(camera_ob)
             bpy.context.scene.camera = camera_ob
-            area = next(area for area in bpy.context.screen.areas if area.type == 'VIEW_3D')
-            area.spaces[0].region_3d.view_perspective = 'CAMERA'
+            if bpy.context.screen is not None: # No screens when running headless
+                area = next((area for area in bpy.context.screen.areas if area.type == 'VIEW_3D'), None)
+                if area is not None:
+                    area.spaces[0].region_3d.view_perspective = 'CAMERA'
         else:
             # Still create the SWF Camera
             camera_data = bpy.data.cameras.new("SWF Camera")
@@ -700,8 +1008,91 @@ class SWF_OT_import(bpy.types.Operator, ImportHelper):
         bpy.context.scene.collection.children.link(self.swf_collection)
         self.swf_collection.children.link(camera_collection)
 
-        self.pre_process_tags(swf.tags) #XXX This means we're digging through the whole SWF twice, but it should make it easier to parse
+        # Start each import with a clean slate; characters and materials are built as the timeline needs them
+        self.swf_data = {}
+        self.swf_style_map = []
+        self.swf_layer_matrices = {}
+        self.swf_morphs = MorphCache()
+        self.swf_fonts = {}
+        self.swf_glyphs = GlyphCache()
+        self.swf_reachability = find_live_characters(swf) if reachability is None else reachability
+        if len(self.swf_reachability.dead) > 0:
+            self.report({"INFO"}, "SWF import: " + str(self.swf_reachability))
+
+        # Event sounds are mixed over the same window of frames the timeline gets built for
+        self.swf_mixdown = Mixdown(swf, decoders = {AudioCodec.MP3: decode_mp3_sound},
+                                   frames = (self.frame_start - 1, self.frame_end if self.frame_end > 0 else None))
+
+        if self.frame_start > 1 or self.frame_end > 0:
+            # Only build Blender data for the requested window, but keep SWF frame numbers
+            tags = frame_range_tags(swf.tags, self.frame_start, self.frame_end)
+            bpy.context.scene.frame_start = self.frame_start
+            if self.frame_end > 0:
+                bpy.context.scene.frame_end = min(self.frame_end, swf.header.frame_count)
+        else:
+            tags = swf.tags
+
+        return tags
 
-        self.parse_tags(swf.tags)
+    def execute(self, context):
+        if self.use_modal and not bpy.app.background:
+            # Parse in a worker thread; the modal timer builds Blender data once it's done
+            self._worker_result = {}
+            self._worker = threading.Thread(target = load_swf_in_background, args = (self.filepath, self._worker_result), daemon = True)
+            self._worker.start()
+            self._steps = None
+            wm = context.window_manager
+            self._timer = wm.event_timer_add(0.05, window = context.window)
+            wm.modal_handler_add(self)
+            wm.progress_begin(0, 100)
+            context.workspace.status_text_set("Importing SWF (Esc to cancel)")
+            return {"RUNNING_MODAL"}
+
+        swf = load_swf(self.filepath)
+        tags = self.setup_import(context, swf)
+        self.parse_tags(tags, first_frame = self.frame_start)
 
         return {"FINISHED"}
+
+    def modal(self, context, event):
+        if event.type == "ESC":
+            self.finish_modal(context)
+            self.report({"WARNING"}, "SWF import cancelled")
+            return {"CANCELLED"}
+        if event.type != "TIMER":
+            return {"PASS_THROUGH"}
+
+        if self._steps is None:
+            if self._worker.is_alive():
+                return {"PASS_THROUGH"}
+            if "error" in self._worker_result:
+                self.finish_modal(context)
+                self.report({"ERROR"}, "Could not read SWF: {0}".format(self._worker_result["error"]))
+                return {"CANCELLED"}
+            swf = self._worker_result["swf"]
+            tags = self.setup_import(context, swf, reachability = self._worker_result["reachability"])
+            # Sprites are built as part of the timeline, so their tags count towards the progress too
+            self._num_tags = len(tags) + sum([len(tag.tags) for tag in tags
+                                              if tag.name == "DefineSprite" and self.swf_reachability.is_live(tag)])
+            self._num_parsed_tags = 0
+            self._steps = self.iter_parse_tags(tags, first_frame = self.frame_start)
+
+        # Build as much as fits in the time slice, then hand control back to Blender
+        deadline = time.perf_counter() + MODAL_TIME_BUDGET
+        try:
+            while time.perf_counter() < deadline:
+                next(self._steps)
+        except StopIteration:
+            self.finish_modal(context)
+            return {"FINISHED"}
+        except Exception:
+            self.finish_modal(context)
+            raise
+        context.window_manager.progress_update(min(int(100 * self._num_parsed_tags / self._num_tags), 100))
+        return {"PASS_THROUGH"}
+
+    def finish_modal(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
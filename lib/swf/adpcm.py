@@ -0,0 +1,223 @@
+"""
+This module decodes Flash ADPCM sound data with NumPy.
+
+ADPCM data starts with the code size (2 to 5 bits per sample) and is
+split into packets of 4096 samples per channel. A packet starts with a
+16 bit sample and a 6 bit step index for every channel, followed by up to
+4095 codes, interleaved by channel.
+
+Full packets all have the same layout, so their codes are unpacked at
+once into an array with a row per packet. The step index and the sample
+are running sums clamped to a range, which are computed for all rows
+together in short passes over blocks of samples (see _clamped_cumsum).
+
+Run this module to benchmark the decoder.
+"""
+from __future__ import absolute_import
+import numpy as np
+
+STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+], dtype=np.int32)
+
+# Step index changes by code magnitude, for each code size
+INDEX_TABLES = {
+    2: np.array([-1, 2]),
+    3: np.array([-1, -1, 2, 4]),
+    4: np.array([-1, -1, -1, -1, 2, 4, 6, 8]),
+    5: np.array([-1, -1, -1, -1, -1, -1, -1, -1, 1, 2, 4, 6, 8, 10, 13, 16]),
+}
+
+SAMPLES_PER_PACKET = 4096
+CLAMP_BLOCK = 64 # increments per block of _clamped_cumsum
+
+def _diff_table(code_bits):
+    # The sample change for every step index and code magnitude:
+    # (magnitude + 0.5) * step / 2 ** (code_bits - 2), with the same shifts as Flash
+    magnitudes = np.arange(1 << (code_bits - 1))
+    table = np.zeros((len(STEP_TABLE), len(magnitudes)), dtype=np.int32)
+    step = STEP_TABLE[:, None].repeat(len(magnitudes), axis=1)
+    k = 1 << (code_bits - 2)
+    while k:
+        table += np.where(magnitudes & k, step, 0)
+        step = step >> 1
+        k >>= 1
+    return table + step
+
+DIFF_TABLES = dict([(code_bits, _diff_table(code_bits)) for code_bits in INDEX_TABLES])
+
+def decode(data, channels=1):
+    """
+    Decode ADPCM data to 16 bit samples.
+
+    @param data     The ADPCM data, starting with the code size.
+    @param channels 1 for mono, 2 for stereo.
+    @return         A NumPy int16 array, interleaved by channel.
+    """
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    if len(bits) < 2:
+        return np.zeros(0, dtype=np.int16)
+    code_bits = int(_read_values(bits[:2], 2)[0]) + 2
+    header_bits = 22 * channels
+    packet_bits = header_bits + (SAMPLES_PER_PACKET - 1) * channels * code_bits
+
+    # All full packets have the same layout, so they're decoded side by side
+    num_packets = (len(bits) - 2) // packet_bits
+    end = 2 + num_packets * packet_bits
+    decoded = [_decode_packets(bits[2:end].reshape(num_packets, packet_bits), channels, code_bits)]
+    # The last packet can be cut short
+    remaining = len(bits) - end
+    if remaining >= header_bits:
+        count = (remaining - header_bits) // (channels * code_bits)
+        packet = bits[end:end + header_bits + count * channels * code_bits]
+        decoded.append(_decode_packets(packet.reshape(1, -1), channels, code_bits))
+    return np.concatenate(decoded)
+
+def _read_values(bits, width):
+    # Unsigned values of width bits each, most significant bit first
+    bits = bits.reshape(bits.shape[:-1] + (bits.shape[-1] // width, width))
+    values = np.zeros(bits.shape[:-1], dtype=np.int32)
+    for i in range(width):
+        values = (values << 1) | bits[..., i]
+    return values
+
+def _decode_packets(packets, channels, code_bits):
+    # packets is a 2D array of bits, a row for each packet
+    headers = _read_values(packets[:, :22 * channels], 22)
+    codes = _read_values(packets[:, 22 * channels:], code_bits)
+    count = codes.shape[1] // channels
+    codes = codes.reshape(len(packets), count, channels)
+
+    out = np.empty((len(packets), count + 1, channels), dtype=np.int16)
+    for channel in range(channels):
+        samples = headers[:, channel] >> 6
+        samples = np.where(samples & 0x8000, samples - 0x10000, samples)
+        indices = headers[:, channel] & 0x3f
+        out[:, 0, channel] = samples
+        out[:, 1:, channel] = _decode_codes(codes[:, :, channel], samples, indices, code_bits)
+    return out.ravel()
+
+def _decode_codes(codes, samples, indices, code_bits):
+    # codes has a row for each packet, samples and indices are where the rows start
+    if codes.shape[1] == 0:
+        return codes
+    sign_mask = 1 << (code_bits - 1)
+    magnitudes = codes & (sign_mask - 1)
+    index = _clamped_cumsum(indices, INDEX_TABLES[code_bits][magnitudes], 0, 88)
+    # A code is scaled by the step from before its own index update
+    index[:, 1:] = index[:, :-1]
+    index[:, 0] = indices
+    diff = DIFF_TABLES[code_bits][index, magnitudes]
+    np.negative(diff, out=diff, where=(codes & sign_mask) > 0)
+    return _clamped_cumsum(samples, diff, -32768, 32767)
+
+def _clamped_cumsum(start, increments, lo, hi):
+    """
+    Return every value of v = min(max(v + x, lo), hi) for x along each row of increments.
+
+    Adding then clamping, done any number of times, still comes down to one
+    add and one clamp. Rows are cut into blocks of CLAMP_BLOCK increments
+    and the add and clamp of every block is worked out a column at a time,
+    for all blocks together. Applying those block by block, for all rows
+    together, gives the value each block starts at, and a last pass a
+    column at a time fills in every value.
+
+    @param start      The value before each row, between lo and hi.
+    @param increments 2D array of increments.
+    """
+    rows, count = increments.shape
+    blocks = -(-count // CLAMP_BLOCK)
+    # A column per position in a block, a block per entry; padding adds nothing
+    columns = np.zeros((rows * blocks, CLAMP_BLOCK), dtype=np.int32)
+    columns.reshape(rows, blocks * CLAMP_BLOCK)[:, :count] = increments
+    columns = np.ascontiguousarray(columns.T)
+
+    # Each block as v -> min(max(v + add, low), high)
+    add = columns[0].copy()
+    low = np.full(rows * blocks, lo, dtype=np.int32)
+    high = np.full(rows * blocks, hi, dtype=np.int32)
+    for column in columns[1:]:
+        add += column
+        low += column
+        np.clip(low, lo, hi, out=low)
+        high += column
+        np.clip(high, lo, hi, out=high)
+
+    add, low, high = add.reshape(rows, blocks), low.reshape(rows, blocks), high.reshape(rows, blocks)
+    block_starts = np.empty((rows, blocks), dtype=np.int32)
+    value = np.asarray(start, dtype=np.int32).copy()
+    for block in range(blocks):
+        block_starts[:, block] = value
+        value += add[:, block]
+        np.maximum(value, low[:, block], out=value)
+        np.minimum(value, high[:, block], out=value)
+
+    value = block_starts.ravel()
+    for column in columns:
+        value += column
+        np.clip(value, lo, hi, out=value)
+        column[:] = value
+    return columns.T.reshape(rows, blocks * CLAMP_BLOCK)[:, :count]
+
+def _encode_packet(samples, code_bits):
+    # Straightforward encoder, only used to make benchmark data
+    sign_mask = 1 << (code_bits - 1)
+    index_table = INDEX_TABLES[code_bits]
+    bits = [int(b) for b in np.binary_repr(int(samples[0]) & 0xffff, 16)] + [0] * 6
+    predicted = int(samples[0])
+    index = 0
+    for sample in samples[1:]:
+        step = int(STEP_TABLE[index])
+        diff = int(sample) - predicted
+        code = sign_mask if diff < 0 else 0
+        diff = abs(diff)
+        k = sign_mask >> 1
+        decoded = 0
+        while k:
+            if diff >= step:
+                code |= k
+                diff -= step
+                decoded += step
+            step >>= 1
+            k >>= 1
+        decoded += step
+        predicted = max(-32768, min(32767, predicted - decoded if code & sign_mask else predicted + decoded))
+        index = max(0, min(88, index + int(index_table[code & (sign_mask - 1)])))
+        bits.extend([int(b) for b in np.binary_repr(code, code_bits)])
+    return np.array(bits, dtype=np.uint8)
+
+if __name__ == "__main__":
+    import time
+    rate = 44100
+    seconds = 60
+    code_bits = 4
+    t = np.arange(SAMPLES_PER_PACKET) / float(rate)
+    state = np.random.RandomState(0)
+    signals = [
+        ("tone", np.sin(2 * np.pi * 440 * t) * 12000 + np.sin(2 * np.pi * 97 * t) * 4000),
+        # Loud enough that the samples clip and the step index keeps hitting both ends
+        ("clipped tone", np.clip(np.sin(2 * np.pi * 440 * t) * 60000, -32768, 32767)),
+        ("noise", state.randint(-32768, 32768, SAMPLES_PER_PACKET)),
+    ]
+    for name, signal in signals:
+        # One packet of the signal, repeated for a minute of stereo sound
+        mono = _encode_packet(signal.astype(np.int16), code_bits)
+        packet = np.concatenate([mono[:22], mono[:22], np.stack([
+            mono[22:].reshape(-1, code_bits), mono[22:].reshape(-1, code_bits)], axis=1).ravel()])
+        num_packets = seconds * rate // SAMPLES_PER_PACKET
+        bits = np.concatenate([np.array([(code_bits - 2) >> 1, (code_bits - 2) & 1], dtype=np.uint8),
+                               np.tile(packet, num_packets)])
+        data = np.packbits(bits).tobytes()
+
+        start = time.time()
+        samples = decode(data, channels=2)
+        elapsed = time.time() - start
+        duration = len(samples) / 2.0 / rate
+        print("Decoded %.1fs of %d bit stereo ADPCM (%s) in %.3fs: %.0fx real-time" % (
+            duration, code_bits, name, elapsed, duration / elapsed))
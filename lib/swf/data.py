@@ -3,6 +3,7 @@ from .consts import *
 from .utils import *
 from ..six.six.moves import map
 from ..six.six.moves import range
+import numpy as np
 
 class _dumb_repr(object):
     def __repr__(self):
@@ -22,26 +23,31 @@ class SWFRawTag(_dumb_repr):
         #s.f.seek(self.pos_content)
 
 class SWFStraightEdge(_dumb_repr):
-    def __init__(self, start, to, line_style_idx, fill_style_idx):
+    def __init__(self, start, to, line_style_idx, fill_style_idx, record_id=-1):
         self.start = start
         self.to = to
         self.line_style_idx = line_style_idx
         self.fill_style_idx = fill_style_idx
+        self.record_id = record_id # the shape record the edge comes from
 
     def reverse_with_new_fillstyle(self, new_fill_idx):
-        return SWFStraightEdge(self.to, self.start, self.line_style_idx, new_fill_idx)
+        return SWFStraightEdge(self.to, self.start, self.line_style_idx, new_fill_idx, self.record_id)
 
 class SWFCurvedEdge(SWFStraightEdge):
-    def __init__(self, start, control, to, line_style_idx, fill_style_idx):
-        super(SWFCurvedEdge, self).__init__(start, to, line_style_idx, fill_style_idx)
+    def __init__(self, start, control, to, line_style_idx, fill_style_idx, record_id=-1):
+        super(SWFCurvedEdge, self).__init__(start, to, line_style_idx, fill_style_idx, record_id)
         self.control = control
 
     def reverse_with_new_fillstyle(self, new_fill_idx):
-        return SWFCurvedEdge(self.to, self.control, self.start, self.line_style_idx, new_fill_idx)
+        return SWFCurvedEdge(self.to, self.control, self.start, self.line_style_idx, new_fill_idx, self.record_id)
 
 class SWFShape(_dumb_repr):
     def __init__(self, data=None, level=1, unit_divisor=20.0):
         self._records = []
+        if not hasattr(self, "_initialFillStyles"):
+            # Plain shapes (glyphs, morph edges) don't start with styles of their own
+            self._initialFillStyles = []
+            self._initialLineStyles = []
         self._fillStyles = self._initialFillStyles
         self._lineStyles = self._initialLineStyles
         self._postLineStyles = {}
@@ -189,7 +195,7 @@ class SWFShape(_dumb_repr):
                     else:
                         xPos += rec.deltaX
                 to = [NumberUtils.round_pixels_400(xPos), NumberUtils.round_pixels_400(yPos)]
-                sub_path.append(SWFStraightEdge(start, to, curr_ls_idx, curr_fs_idx1))
+                sub_path.append(SWFStraightEdge(start, to, curr_ls_idx, curr_fs_idx1, rec.record_id))
             elif rec.type == SWFShapeRecord.TYPE_CURVEDEDGE:
                 start = [NumberUtils.round_pixels_400(xPos), NumberUtils.round_pixels_400(yPos)]
                 xPosControl = xPos + rec.control_deltaX
@@ -198,7 +204,7 @@ class SWFShape(_dumb_repr):
                 yPos = yPosControl + rec.anchor_deltaY
                 control = [xPosControl, yPosControl]
                 to = [NumberUtils.round_pixels_400(xPos), NumberUtils.round_pixels_400(yPos)]
-                sub_path.append(SWFCurvedEdge(start, control, to, curr_ls_idx, curr_fs_idx1))
+                sub_path.append(SWFCurvedEdge(start, control, to, curr_ls_idx, curr_fs_idx1, rec.record_id))
             elif rec.type == SWFShapeRecord.TYPE_END:
                 # We're done. Process the last subpath, if any
                 if len(sub_path) > 0:
@@ -331,50 +337,18 @@ class SWFShape(_dumb_repr):
 
         if len(path) < 1:
             return
+        arrays = self._path_arrays(path, "fill_style_idx") if hasattr(handler, "draw_path") else None
         handler.begin_fills()
-        for i in range(0, len(path)):
+        i = 0
+        while i < len(path):
             e = path[i]
             if fill_style_idx != e.fill_style_idx:
                 fill_style_idx = e.fill_style_idx
                 pos = [100000000, 100000000]
-                try:
-                    fill_style = self._fillStyles[fill_style_idx - 1] if fill_style_idx > 0 else None
-                    if fill_style.type == 0x0:
-                        # solid fill
-                        handler.begin_fill(
-                            ColorUtils.rgb(fill_style.rgb),
-                            ColorUtils.alpha(fill_style.rgb))
-                    elif fill_style.type in [0x10, 0x12, 0x13]:
-                        # gradient fill
-                        colors = []
-                        ratios = []
-                        alphas = []
-                        for j in range(0, len(fill_style.gradient.records)):
-                            gr = fill_style.gradient.records[j]
-                            colors.append(ColorUtils.rgb(gr.color))
-                            ratios.append(gr.ratio)
-                            alphas.append(ColorUtils.alpha(gr.color))
-                        handler.begin_gradient_fill(
-                            GradientType.LINEAR if fill_style.type == 0x10 else GradientType.RADIAL,
-                            colors, alphas, ratios,
-                            fill_style.gradient_matrix,
-                            fill_style.gradient.spreadmethod,
-                            fill_style.gradient.interpolation_mode,
-                            fill_style.gradient.focal_point
-                            )
-                    elif fill_style.type in [0x40, 0x41, 0x42, 0x43]:
-                        # bitmap fill
-                        handler.begin_bitmap_fill(
-                            fill_style.bitmap_id,
-                            fill_style.bitmap_matrix,
-                            (fill_style.type == 0x40 or fill_style.type == 0x42),
-                            (fill_style.type == 0x40 or fill_style.type == 0x41)
-                            )
-                        pass
-                except:
-                    # Font shapes define no fillstyles per se, but do reference fillstyle index 1,
-                    # which represents the font color. We just report solid black in this case.
-                    handler.begin_fill(0)
+                self._begin_fill_style(handler, fill_style_idx)
+                if arrays is not None:
+                    i = self._draw_path(handler, arrays, i)
+                    continue
 
             if not self._equal_point(pos, e.start):
                 handler.move_to(e.start[0] * u, e.start[1] * u)
@@ -385,6 +359,7 @@ class SWFShape(_dumb_repr):
                 handler.line_to(e.to[0] * u, e.to[1] * u)
 
             pos = e.to
+            i += 1
 
         handler.end_fill()
         handler.end_fills()
@@ -395,86 +370,22 @@ class SWFShape(_dumb_repr):
         pos = [100000000, 100000000]
         u = 1.0 / self.unit_divisor
         line_style_idx = 10000000
-        line_style = None
         if len(path) < 1:
             return
+        arrays = self._path_arrays(path, "line_style_idx") if hasattr(handler, "draw_path") else None
 
         handler.begin_lines()
-        for i in range(0, len(path)):
+        i = 0
+        while i < len(path):
             e = path[i]
 
             if line_style_idx != e.line_style_idx:
                 line_style_idx = e.line_style_idx
                 pos = [100000000, 100000000]
-                try:
-                    line_style = self._lineStyles[line_style_idx - 1]
-                except:
-                    line_style = None
-                if line_style is not None:
-                    scale_mode = LineScaleMode.NORMAL
-                    if line_style.no_hscale_flag and line_style.no_vscale_flag:
-                        scale_mode = LineScaleMode.NONE
-                    elif line_style.no_hscale_flag:
-                        scale_mode = LineScaleMode.HORIZONTAL
-                    elif line_style.no_hscale_flag:
-                        scale_mode = LineScaleMode.VERTICAL
-
-                    if not line_style.has_fill_flag:
-                        handler.line_style(
-                            line_style.width / 20.0,
-                            ColorUtils.rgb(line_style.color),
-                            ColorUtils.alpha(line_style.color),
-                            line_style.pixelhinting_flag,
-                            scale_mode,
-                            line_style.start_caps_style,
-                            line_style.end_caps_style,
-                            line_style.joint_style,
-                            line_style.miter_limit_factor)
-                    else:
-                        fill_style = line_style.fill_type
-
-                        if fill_style.type in [0x10, 0x12, 0x13]:
-                            # gradient fill
-                            colors = []
-                            ratios = []
-                            alphas = []
-                            for j in range(0, len(fill_style.gradient.records)):
-                                gr = fill_style.gradient.records[j]
-                                colors.append(ColorUtils.rgb(gr.color))
-                                ratios.append(gr.ratio)
-                                alphas.append(ColorUtils.alpha(gr.color))
-
-                            handler.line_gradient_style(
-                                line_style.width / 20.0,
-                                line_style.pixelhinting_flag,
-                                scale_mode,
-                                line_style.start_caps_style,
-                                line_style.end_caps_style,
-                                line_style.joint_style,
-                                line_style.miter_limit_factor,
-                                GradientType.LINEAR if fill_style.type == 0x10 else GradientType.RADIAL,
-                                colors, alphas, ratios,
-                                fill_style.gradient_matrix,
-                                fill_style.gradient.spreadmethod,
-                                fill_style.gradient.interpolation_mode,
-                                fill_style.gradient.focal_point
-                                )
-                        elif fill_style.type in [0x40, 0x41, 0x42]:
-                            handler.line_bitmap_style(
-                                line_style.width / 20.0,
-                                line_style.pixelhinting_flag,
-                                scale_mode,
-                                line_style.start_caps_style,
-                                line_style.end_caps_style,
-                                line_style.joint_style,
-                                line_style.miter_limit_factor,
-                                fill_style.bitmap_id, fill_style.bitmap_matrix,
-                                (fill_style.type == 0x40 or fill_style.type == 0x42),
-                                (fill_style.type == 0x40 or fill_style.type == 0x41)
-                                )
-                else:
-                    # we should never get here
-                    handler.line_style(0)
+                self._begin_line_style(handler, line_style_idx)
+                if arrays is not None:
+                    i = self._draw_path(handler, arrays, i)
+                    continue
             if not self._equal_point(pos, e.start):
                 handler.move_to(e.start[0] * u, e.start[1] * u)
             if type(e) is SWFCurvedEdge:
@@ -482,8 +393,165 @@ class SWFShape(_dumb_repr):
             else:
                 handler.line_to(e.to[0] * u, e.to[1] * u)
             pos = e.to
+            i += 1
         handler.end_lines()
 
+    def _begin_fill_style(self, handler, fill_style_idx):
+        """ Tell handler about the fill of the edges that follow """
+        try:
+            fill_style = self._fillStyles[fill_style_idx - 1] if fill_style_idx > 0 else None
+            if fill_style.type == 0x0:
+                # solid fill
+                handler.begin_fill(
+                    ColorUtils.rgb(fill_style.rgb),
+                    ColorUtils.alpha(fill_style.rgb))
+            elif fill_style.type in [0x10, 0x12, 0x13]:
+                # gradient fill
+                colors = []
+                ratios = []
+                alphas = []
+                for j in range(0, len(fill_style.gradient.records)):
+                    gr = fill_style.gradient.records[j]
+                    colors.append(ColorUtils.rgb(gr.color))
+                    ratios.append(gr.ratio)
+                    alphas.append(ColorUtils.alpha(gr.color))
+                handler.begin_gradient_fill(
+                    GradientType.LINEAR if fill_style.type == 0x10 else GradientType.RADIAL,
+                    colors, alphas, ratios,
+                    fill_style.gradient_matrix,
+                    fill_style.gradient.spreadmethod,
+                    fill_style.gradient.interpolation_mode,
+                    fill_style.gradient.focal_point
+                    )
+            elif fill_style.type in [0x40, 0x41, 0x42, 0x43]:
+                # bitmap fill
+                handler.begin_bitmap_fill(
+                    fill_style.bitmap_id,
+                    fill_style.bitmap_matrix,
+                    (fill_style.type == 0x40 or fill_style.type == 0x42),
+                    (fill_style.type == 0x40 or fill_style.type == 0x41)
+                    )
+                pass
+        except:
+            # Font shapes define no fillstyles per se, but do reference fillstyle index 1,
+            # which represents the font color. We just report solid black in this case.
+            handler.begin_fill(0)
+
+    def _begin_line_style(self, handler, line_style_idx):
+        """ Tell handler about the line style of the edges that follow """
+        try:
+            line_style = self._lineStyles[line_style_idx - 1]
+        except:
+            line_style = None
+        if line_style is not None:
+            scale_mode = LineScaleMode.NORMAL
+            if line_style.no_hscale_flag and line_style.no_vscale_flag:
+                scale_mode = LineScaleMode.NONE
+            elif line_style.no_hscale_flag:
+                scale_mode = LineScaleMode.HORIZONTAL
+            elif line_style.no_hscale_flag:
+                scale_mode = LineScaleMode.VERTICAL
+
+            if not line_style.has_fill_flag:
+                handler.line_style(
+                    line_style.width / 20.0,
+                    ColorUtils.rgb(line_style.color),
+                    ColorUtils.alpha(line_style.color),
+                    line_style.pixelhinting_flag,
+                    scale_mode,
+                    line_style.start_caps_style,
+                    line_style.end_caps_style,
+                    line_style.joint_style,
+                    line_style.miter_limit_factor)
+            else:
+                fill_style = line_style.fill_type
+
+                if fill_style.type in [0x10, 0x12, 0x13]:
+                    # gradient fill
+                    colors = []
+                    ratios = []
+                    alphas = []
+                    for j in range(0, len(fill_style.gradient.records)):
+                        gr = fill_style.gradient.records[j]
+                        colors.append(ColorUtils.rgb(gr.color))
+                        ratios.append(gr.ratio)
+                        alphas.append(ColorUtils.alpha(gr.color))
+
+                    handler.line_gradient_style(
+                        line_style.width / 20.0,
+                        line_style.pixelhinting_flag,
+                        scale_mode,
+                        line_style.start_caps_style,
+                        line_style.end_caps_style,
+                        line_style.joint_style,
+                        line_style.miter_limit_factor,
+                        GradientType.LINEAR if fill_style.type == 0x10 else GradientType.RADIAL,
+                        colors, alphas, ratios,
+                        fill_style.gradient_matrix,
+                        fill_style.gradient.spreadmethod,
+                        fill_style.gradient.interpolation_mode,
+                        fill_style.gradient.focal_point
+                        )
+                elif fill_style.type in [0x40, 0x41, 0x42]:
+                    handler.line_bitmap_style(
+                        line_style.width / 20.0,
+                        line_style.pixelhinting_flag,
+                        scale_mode,
+                        line_style.start_caps_style,
+                        line_style.end_caps_style,
+                        line_style.joint_style,
+                        line_style.miter_limit_factor,
+                        fill_style.bitmap_id, fill_style.bitmap_matrix,
+                        (fill_style.type == 0x40 or fill_style.type == 0x42),
+                        (fill_style.type == 0x40 or fill_style.type == 0x41)
+                        )
+        else:
+            # we should never get here
+            handler.line_style(0)
+
+    def _path_arrays(self, path, style_attr):
+        """
+        The edges of a path as arrays for _draw_path(): a row of start,
+        control and end point per edge (straight edges get their end point as
+        control), whether every edge is curved, and the index after every run
+        of edges that share a style.
+        """
+        points = np.array([e.start + (e.control if type(e) is SWFCurvedEdge else e.to) + e.to for e in path],
+                          dtype=np.float64).reshape(-1, 6)
+        curved = np.array([type(e) is SWFCurvedEdge for e in path], dtype=bool)
+        styles = np.array([getattr(e, style_attr) for e in path])
+        run_ends = np.append(np.flatnonzero(styles[1:] != styles[:-1]) + 1, len(path))
+        return points, curved, run_ends
+
+    def _draw_path(self, handler, arrays, start):
+        """
+        Hand the run of edges from start that share a style to handler.draw_path()
+        and return the index after it.
+
+        draw_path(commands, coords) gets a string of "M", "L" and "Q" commands
+        and a flat array of the (unit divided) x, y coordinates they take:
+        two for moves and lines, four for curves.
+        """
+        points, curved, run_ends = arrays
+        end = run_ends[np.searchsorted(run_ends, start, side="right")]
+        points = points[start:end]
+        commands, used = self._path_commands(points, curved[start:end])
+        handler.draw_path(commands, points[used] * (1.0 / self.unit_divisor))
+        return end
+
+    def _path_commands(self, points, curved):
+        """
+        Return the draw_path() commands of a run of edges given as rows of
+        _path_arrays(), and a mask of the row values that make their coordinates.
+        """
+        # Move wherever an edge doesn't start where the previous one ended
+        moves = np.ones(len(points), dtype=bool)
+        moves[1:] = np.abs(points[1:, 0:2] - points[:-1, 4:6]).max(axis=1) >= 0.001
+        # Per edge: the move, the control point of a curve, the end point
+        used = np.column_stack((moves, moves, curved, curved, np.ones((len(points), 2), dtype=bool)))
+        commands = np.char.add(np.where(moves, "M", ""), np.where(curved, "Q", "L"))
+        return "".join(commands.tolist()), used
+
     def _append_to(self, v1, v2):
         for i in range(0, len(v2)):
             v1.append(v2[i])
@@ -973,7 +1041,7 @@ class SWFMorphFillStyle(_dumb_repr):
         return set([self.bitmapId]) if hasattr(self, 'bitmapId') else set()
 
     def parse(self, data, level=1):
-        type = data.readUI8()
+        self.type = type = data.readUI8()
         if type == 0x0:
             self.startColor = data.readRGBA()
             self.endColor = data.readRGBA()
@@ -8,6 +8,11 @@ from .utils import *
 from .data import *
 from .tag import *
 from .filters import *
+from .reachability import find_live_characters
+from .timeline import Timeline
+from .morph import MorphCache, collect_morph_ratios
+from .glyphs import GlyphCache, EM_SQUARE_LENGTH
+from .text import layout_text
 from lxml import objectify
 from lxml import etree
 import base64
@@ -19,8 +24,10 @@ except ImportError:
     from PIL import Image
 from io import BytesIO
 from ..six.six.moves import cStringIO
+from ..six.six import unichr
 import math
 import re
+import numpy as np
 import copy
 import cgi
 
@@ -31,7 +38,6 @@ XLINK_HREF  = "{%s}href" % XLINK_NS
 NS = {"svg" : SVG_NS, "xlink" : XLINK_NS}
 
 PIXELS_PER_TWIP = 20
-EM_SQUARE_LENGTH = 1024
 
 MINIMUM_STROKE_WIDTH = 0.5
 
@@ -123,38 +129,177 @@ class DefaultShapeExporter(object):
         #print "curve_to", cx, cy, ax, ay
         pass
 
+# A move, or a run of lines or curves, in the commands of draw_path()
+_PATH_RUNS = re.compile("M|L+|Q+")
+
+class SVGPathBuilder(object):
+    """
+    Builds SVG path data from a list of tokens that is joined only once.
+
+    @param precision Number of decimals for coordinates. None keeps the
+                     classic output: 1/100 pixel, always with a decimal point.
+                     Otherwise trailing zeros are dropped ("12.5", "3").
+    @param relative  Whether to use relative (lowercase) commands.
+    """
+    def __init__(self, precision=None, relative=False):
+        self.precision = precision
+        self.relative = relative
+        self.clear()
+
+    def clear(self):
+        self._tokens = []
+        self._command = ""
+        self._x = 0.0
+        self._y = 0.0
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def round(self, value):
+        """ Round a coordinate to the builder's precision """
+        if self.precision is None:
+            return NumberUtils.round_pixels_20(value)
+        return round(value, self.precision)
+
+    def format(self, value):
+        """ Format a rounded coordinate """
+        if self.precision is None:
+            return str(value)
+        s = "%.*f" % (self.precision, value)
+        if "." in s:
+            s = s.rstrip("0").rstrip(".")
+        return "0" if s == "-0" else s
+
+    def move_to(self, x, y):
+        """ Add a move. Returns the rounded absolute point """
+        x, y = self.round(x), self.round(y)
+        self._command = ""
+        self._add("M", [x, y])
+        return x, y
+
+    def line_to(self, x, y):
+        """ Add a line. Returns the rounded absolute point """
+        x, y = self.round(x), self.round(y)
+        self._add("L", [x, y])
+        return x, y
+
+    def curve_to(self, cx, cy, ax, ay):
+        """ Add a quadratic curve. Returns the rounded absolute points """
+        points = [self.round(cx), self.round(cy), self.round(ax), self.round(ay)]
+        self._add("Q", points)
+        return points
+
+    def lines(self, coords):
+        """ Add a polyline from flat x, y coordinates. Returns the rounded absolute coordinates """
+        return self._add_run("L", coords, 2)
+
+    def curves(self, coords):
+        """ Add quadratic curves from flat cx, cy, ax, ay coordinates. Returns the rounded absolute coordinates """
+        return self._add_run("Q", coords, 4)
+
+    def getvalue(self):
+        """ Return the path data """
+        return " ".join(self._tokens)
+
+    def __str__(self):
+        return self.getvalue()
+
+    def _add(self, command, values):
+        # values are rounded absolute x, y pairs, the last pair is the new current point
+        end = values[-2:]
+        if self.relative:
+            command = command.lower()
+            step = 4 if command == "q" else 2
+            x, y = self._x, self._y
+            deltas = []
+            for i in range(0, len(values), step):
+                segment = values[i:i + step]
+                deltas.extend([self.round(v - (y if j % 2 else x)) for j, v in enumerate(segment)])
+                x, y = segment[-2:]
+            values = deltas
+        self._x, self._y = end
+        self._extend(command, [self.format(v) for v in values])
+
+    def _add_run(self, command, coords, step):
+        # Like _add(), but rounds and formats a whole run of segments at once
+        points = self._round_array(np.asarray(coords, dtype=np.float64).reshape(-1, step))
+        if len(points) == 0:
+            return []
+        values = points
+        if self.relative:
+            command = command.lower()
+            # Every segment is relative to where the one before it ended
+            starts = np.vstack(([[self._x, self._y]], points[:-1, -2:]))
+            values = self._round_array(points - np.tile(starts, step // 2))
+        self._x, self._y = points[-1, -2:].tolist()
+        values = values.ravel().tolist()
+        self._extend(command, list(map(str, values)) if self.precision is None else [self.format(v) for v in values])
+        return points.ravel().tolist()
+
+    def _round_array(self, values):
+        if self.precision is None:
+            # Same as round_pixels_20(), plus 0.0 so there's no -0.0
+            return np.rint(values * 100) / 100 + 0.0
+        return np.array([round(v, self.precision) for v in values.ravel().tolist()]).reshape(values.shape)
+
+    def _extend(self, command, tokens):
+        # Repeated commands can be left out, moves always get theirs
+        if command != self._command:
+            tokens[0] = command + tokens[0]
+            self._command = "" if command in "Mm" else command
+        self._tokens.extend(tokens)
+
 class DefaultSVGShapeExporter(DefaultShapeExporter):
     def __init__(self, defs=None):
         self.defs = defs
-        self.current_draw_command = ""
-        self.path_data = ""
+        self.defs_index = {}
+        self.bounds = SVGBounds()
+        self.path_data = SVGPathBuilder()
         self._e = objectify.ElementMaker(annotate=False,
                         namespace=SVG_NS, nsmap={None : SVG_NS, "xlink" : XLINK_NS})
         super(DefaultSVGShapeExporter, self).__init__()
 
+    def set_defs(self, defs, defs_index):
+        """ Start adding to the defs of a new document """
+        self.defs = defs
+        self.defs_index = defs_index
+
+    def set_path_options(self, precision=None, relative=False):
+        """ Set the coordinate precision and command mode of the path data (see SVGPathBuilder) """
+        self.path_data = SVGPathBuilder(precision, relative)
+
+    def draw_path(self, commands, coords):
+        """ Add a whole style run at once (see SWFShape._draw_path) """
+        j = 0
+        for run in _PATH_RUNS.findall(commands):
+            if run == "M":
+                self.move_to(float(coords[j]), float(coords[j + 1]))
+                j += 2
+                continue
+            # Runs of lines or curves go to the path builder in one piece
+            end = j + (4 if run[0] == "Q" else 2) * len(run)
+            if run[0] == "Q":
+                # The control points too, like the bounds of the path data always had
+                values = self.path_data.curves(coords[j:end])
+            else:
+                values = self.path_data.lines(coords[j:end])
+            self.bounds.add_point(min(values[0::2]), min(values[1::2]))
+            self.bounds.add_point(max(values[0::2]), max(values[1::2]))
+            j = end
+
     def move_to(self, x, y):
-        self.current_draw_command = ""
-        self.path_data += "M" + \
-            str(NumberUtils.round_pixels_20(x)) + " " + \
-            str(NumberUtils.round_pixels_20(y)) + " "
+        x, y = self.path_data.move_to(x, y)
+        self.bounds.add_point(x, y)
 
     def line_to(self, x, y):
-        if self.current_draw_command != "L":
-            self.current_draw_command = "L"
-            self.path_data += "L"
-        self.path_data += "" + \
-            str(NumberUtils.round_pixels_20(x)) + " " + \
-            str(NumberUtils.round_pixels_20(y)) + " "
+        x, y = self.path_data.line_to(x, y)
+        self.bounds.add_point(x, y)
 
     def curve_to(self, cx, cy, ax, ay):
-        if self.current_draw_command != "Q":
-            self.current_draw_command = "Q"
-            self.path_data += "Q"
-        self.path_data += "" + \
-            str(NumberUtils.round_pixels_20(cx)) + " " + \
-            str(NumberUtils.round_pixels_20(cy)) + " " + \
-            str(NumberUtils.round_pixels_20(ax)) + " " + \
-            str(NumberUtils.round_pixels_20(ay)) + " "
+        cx, cy, ax, ay = self.path_data.curve_to(cx, cy, ax, ay)
+        # The control point too, like the bounds of the path data always had
+        self.bounds.add_point(cx, cy)
+        self.bounds.add_point(ax, ay)
 
     def begin_bitmap_fill(self, bitmap_id, matrix=None, repeat=False, smooth=False):
         self.finalize_path()
@@ -193,8 +338,7 @@ class DefaultSVGShapeExporter(DefaultShapeExporter):
         self.finalize_path()
 
     def finalize_path(self):
-        self.current_draw_command = ""
-        self.path_data = ""
+        self.path_data.clear()
 
 class SVGShapeExporter(DefaultSVGShapeExporter):
     def __init__(self):
@@ -203,12 +347,28 @@ class SVGShapeExporter(DefaultSVGShapeExporter):
         self.num_gradients = 0
         self._gradients = {}
         self._gradient_ids = {}
+        self._pattern_ids = {}
         self.paths = {}
         self.fills_ended = False
         super(SVGShapeExporter, self).__init__()
 
+    def add_def(self, element):
+        """ Append an element to the defs, indexed by its id """
+        self.defs.append(element)
+        self.defs_index[element.get("id")] = element
+
+    def set_defs(self, defs, defs_index):
+        super(SVGShapeExporter, self).set_defs(defs, defs_index)
+        # Gradients and patterns of an earlier document aren't in these defs
+        self.num_patterns = 0
+        self.num_gradients = 0
+        self._gradients = {}
+        self._gradient_ids = {}
+        self._pattern_ids = {}
+
     def begin_shape(self):
         self.g = self._e.g()
+        self.bounds = SVGBounds()
 
     def begin_fill(self, color, alpha=1.0):
         self.finalize_path()
@@ -285,20 +445,16 @@ class SVGShapeExporter(DefaultSVGShapeExporter):
             self._gradients[key] = copy.copy(gradient)
             self._gradient_ids[key] = gradient_id
             gradient.set("id", gradient_id)
-            self.defs.append(gradient)
+            self.add_def(gradient)
 
         return gradient_id
 
     def export_pattern(self, bitmap_id, matrix, repeat=False, smooth=False):
-        self.num_patterns += 1
         bitmap_id = "c%d" % bitmap_id
-        e = self.defs.xpath("./svg:image[@id='%s']" % bitmap_id, namespaces=NS)
-        if len(e) < 1:
+        image = self.defs_index.get(bitmap_id)
+        if image is None:
             raise Exception("SVGShapeExporter::begin_bitmap_fill Could not find bitmap!")
-        image = e[0]
-        pattern_id = "pat%d" % (self.num_patterns)
         pattern = self._e.pattern()
-        pattern.set("id", pattern_id)
         pattern.set("width", image.get("width"))
         pattern.set("height", image.get("height"))
         pattern.set("patternUnits", "userSpaceOnUse")
@@ -309,7 +465,16 @@ class SVGShapeExporter(DefaultSVGShapeExporter):
         use = self._e.use()
         use.set(XLINK_HREF, "#%s" % bitmap_id)
         pattern.append(use)
-        self.defs.append(pattern)
+
+        # prevent same pattern in <defs />
+        key = etree.tostring(pattern)
+        if key in self._pattern_ids:
+            return self._pattern_ids[key]
+        self.num_patterns += 1
+        pattern_id = "pat%d" % (self.num_patterns)
+        pattern.set("id", pattern_id)
+        self._pattern_ids[key] = pattern_id
+        self.add_def(pattern)
 
         return pattern_id
 
@@ -383,8 +548,7 @@ class SVGShapeExporter(DefaultSVGShapeExporter):
 
     def finalize_path(self):
         if self.path is not None and len(self.path_data) > 0:
-            self.path_data = self.path_data.rstrip()
-            self.path.set("d", self.path_data)
+            self.path.set("d", self.path_data.getvalue())
             self.g.append(self.path)
         self.path = self._e.path()
         super(SVGShapeExporter, self).finalize_path()
@@ -397,14 +561,21 @@ class BaseExporter(object):
         self.mask_id = None
         self.jpegTables = None
         self.force_stroke = force_stroke
+        self.reachability = None
+        self.glyph_cache = GlyphCache()
         if swf is not None:
             self.export(swf)
 
     def export(self, swf, force_stroke=False):
         self.force_stroke = force_stroke
-        self.export_define_shapes(swf.tags)
+        self.export_definitions(swf)
         self.export_display_list(self.get_display_tags(swf.tags))
 
+    def export_definitions(self, swf):
+        # Definitions that are never placed (even through sprites) don't need exporting
+        self.reachability = find_live_characters(swf)
+        self.export_define_shapes(swf.tags)
+
     def export_define_bits(self, tag):
         png_buffer = BytesIO()
         image = None
@@ -457,13 +628,20 @@ class BaseExporter(object):
         self.shape_exporter.debug = isinstance(tag, TagDefineShape4)
         tag.shapes.export(self.shape_exporter)
 
+    def export_define_morph_shape(self, tag):
+        pass
+
     def export_define_shapes(self, tags):
         for tag in tags:
+            if self.reachability is not None and not self.reachability.is_live(tag):
+                continue
             if isinstance(tag, SWFTimelineContainer):
                 self.export_define_sprite(tag)
                 self.export_define_shapes(tag.tags)
             elif isinstance(tag, TagDefineShape):
                 self.export_define_shape(tag)
+            elif isinstance(tag, TagDefineMorphShape):
+                self.export_define_morph_shape(tag)
             elif isinstance(tag, TagJPEGTables):
                 if tag.length > 0:
                     self.jpegTables = tag.jpegTables
@@ -505,10 +683,17 @@ class BaseExporter(object):
         return None
 
 class SVGExporter(BaseExporter):
-    def __init__(self, swf=None, margin=0):
+    """
+    @param margin          Extra space around the content in the viewBox.
+    @param path_precision  Decimals of path coordinates, None for the classic 1/100 pixel.
+    @param relative_paths  Whether to write path data with relative commands.
+    """
+    def __init__(self, swf=None, margin=0, path_precision=None, relative_paths=False):
         self._e = objectify.ElementMaker(annotate=False,
                         namespace=SVG_NS, nsmap={None : SVG_NS, "xlink" : XLINK_NS})
         self._margin = margin
+        self._path_precision = path_precision
+        self._relative_paths = relative_paths
         super(SVGExporter, self).__init__(swf)
 
     def export(self, swf, force_stroke=False):
@@ -517,23 +702,14 @@ class SVGExporter(BaseExporter):
         @param swf  The SWF.
         @param force_stroke Whether to force strokes on non-stroked fills.
         """
-        self.svg = self._e.svg(version=SVG_VERSION)
-        self.force_stroke = force_stroke
-        self.defs = self._e.defs()
-        self.root = self._e.g()
-        self.svg.append(self.defs)
-        self.svg.append(self.root)
-        self.shape_exporter.defs = self.defs
-        self._num_filters = 0
-        self.fonts = dict([(x.characterId,x) for x in swf.all_tags_of_type(TagDefineFont)])
-        self.fontInfos = dict([(x.characterId,x) for x in swf.all_tags_of_type(TagDefineFontInfo)])
+        self._setup_document(swf, force_stroke)
 
         # GO!
         super(SVGExporter, self).export(swf, force_stroke)
 
         # Setup svg @width, @height and @viewBox
         # and add the optional margin
-        self.bounds = SVGBounds(self.svg)
+        self.bounds = self.get_display_list_bounds(self.get_display_tags(swf.tags))
         self.svg.set("width", "%dpx" % round(self.bounds.width))
         self.svg.set("height", "%dpx" % round(self.bounds.height))
         if self._margin > 0:
@@ -545,16 +721,75 @@ class SVGExporter(BaseExporter):
         # Return the SVG as StringIO
         return self._serialize()
 
+    def _setup_document(self, swf, force_stroke=False):
+        self.svg = self._e.svg(version=SVG_VERSION)
+        self.force_stroke = force_stroke
+        self.defs = self._e.defs()
+        self.root = self._e.g()
+        self.svg.append(self.defs)
+        self.svg.append(self.root)
+        self.defs_index = {}
+        self.character_bounds = {}
+        self._sprite_display_tags = {}
+        self.shape_exporter.set_defs(self.defs, self.defs_index)
+        self.shape_exporter.set_path_options(self._path_precision, self._relative_paths)
+        self._num_filters = 0
+        self._filter_ids = {}
+        self.fonts = dict([(x.characterId,x) for x in swf.all_tags_of_type(TagDefineFont)])
+        self.fontInfos = dict([(x.characterId,x) for x in swf.all_tags_of_type(TagDefineFontInfo)])
+        self.morph_ratios = collect_morph_ratios(swf)
+        self.morph_cache = MorphCache()
+
     def _serialize(self):
         return BytesIO(etree.tostring(self.svg,
                 encoding="UTF-8", xml_declaration=True))
 
+    def add_def(self, element):
+        """ Append an element to the defs, indexed by its id """
+        self.defs.append(element)
+        self.defs_index[element.get("id")] = element
+
+    def get_stage_viewbox(self, swf):
+        """ Return the [x, y, width, height] of the SWF's stage, or None without a header """
+        header = getattr(swf, "header", None)
+        if header is None:
+            return None
+        r = header.frame_size
+        return [r.xmin / PIXELS_PER_TWIP, r.ymin / PIXELS_PER_TWIP,
+                (r.xmax - r.xmin) / PIXELS_PER_TWIP, (r.ymax - r.ymin) / PIXELS_PER_TWIP]
+
+    def get_character_bounds(self, characterId):
+        """ Return the SVGBounds of a character in its own coordinates, or None """
+        bounds = self.character_bounds.get(characterId)
+        if bounds is None and characterId in self._sprite_display_tags:
+            # Guard against sprites that (indirectly) place themselves
+            self.character_bounds[characterId] = SVGBounds()
+            bounds = self.get_display_list_bounds(self._sprite_display_tags[characterId])
+            self.character_bounds[characterId] = bounds
+        return bounds
+
+    def get_display_list_bounds(self, tags):
+        """ Return the SVGBounds of PlaceObject tags from the bounds of their characters """
+        bounds = SVGBounds()
+        for tag in tags:
+            character_bounds = self.get_character_bounds(tag.characterId)
+            if character_bounds is None:
+                continue
+            if tag.hasMatrix:
+                matrix = Matrix2(*_swf_matrix_to_matrix(tag.matrix))
+                bounds.merge_transformed(character_bounds, matrix)
+            else:
+                bounds.merge(character_bounds)
+        return bounds
+
     def export_define_sprite(self, tag, parent=None):
         id = "c%d"%tag.characterId
         g = self._e.g(id=id)
-        self.defs.append(g)
+        self.add_def(g)
         self.clip_depth = 0
-        super(SVGExporter, self).export_define_sprite(tag, g)
+        display_tags = self.get_display_tags(tag.tags)
+        self._sprite_display_tags[tag.characterId] = display_tags
+        self.export_display_list(display_tags, g)
 
     def export_define_font(self, tag):
         fontInfo = self.fontInfos[tag.characterId]
@@ -563,86 +798,61 @@ class SVGExporter(BaseExporter):
 
         defs = self._e.defs(id="font_{0}".format(tag.characterId))
 
-        for index, glyph in enumerate(tag.glyphShapeTable):
-            # Export the glyph as a shape and add the path to the "defs"
-            # element to be referenced later when exporting text.
+        for index in range(len(tag.glyphShapeTable)):
+            # Add the glyph's path to the "defs" element to be referenced
+            # later when exporting text. The path comes from the glyph cache,
+            # so each glyph is only exported as a shape once.
             code_point = fontInfo.codeTable[index]
-            pathGroup = glyph.export().g.getchildren()
-
-            if len(pathGroup):
-                path = pathGroup[0]
+            path = self.glyph_cache.get_outline(tag, index).copy_svg_path()
 
+            if path is not None:
                 path.set("id", "font_{0}_{1}".format(tag.characterId, code_point))
 
                 # SWF glyphs are always defined on an EM square of 1024 by 1024 units.
                 path.set("transform", "scale({0})".format(float(1)/EM_SQUARE_LENGTH))
 
-                # We'll be setting the color on the USE element that
-                # references this element.
-                del path.attrib["stroke"]
-                del path.attrib["fill"]
-
                 defs.append(path)
 
-        self.defs.append(defs)
+        self.add_def(defs)
 
     def export_define_text(self, tag):
         g = self._e.g(id="c{0}".format(int(tag.characterId)))
         g.set("class", "text_content")
 
-        x = 0
-        y = 0
-
-        for rec in tag.records:
-            if rec.hasXOffset:
-                x = rec.xOffset/PIXELS_PER_TWIP
-            if rec.hasYOffset:
-                y = rec.yOffset/PIXELS_PER_TWIP
+        layout = layout_text(tag)
+        code_points = layout.code_points(dict([(id, info.codeTable) for id, info in self.fontInfos.items()]))
+        # Ignore control characters (and glyphs without a code point)
+        visible = code_points >= 32
+        sizes = layout.heights / PIXELS_PER_TWIP
+        xs = layout.x / PIXELS_PER_TWIP
+        ys = layout.y / PIXELS_PER_TWIP
 
-            size = rec.textHeight/PIXELS_PER_TWIP
+        for record_index, run in layout.runs():
+            rec = tag.records[record_index]
             fontInfo = self.fontInfos[rec.fontId]
+            color = ColorUtils.to_rgb_string(ColorUtils.rgb(rec.textColor))
+            size = rec.textHeight/PIXELS_PER_TWIP
+            shown = visible[run]
 
-            if not fontInfo.useGlyphText:
-                inner_text = ""
-                xValues = []
-
-            for glyph in rec.glyphEntries:
-                code_point = fontInfo.codeTable[glyph.index]
-
-                # Ignore control characters
-                if code_point in range(32):
-                    continue
-
-                if fontInfo.useGlyphText:
+            if fontInfo.useGlyphText:
+                # Glyphs of a record share their size, so the transforms only differ by the pen position
+                for code_point, x, y in zip(code_points[run][shown].tolist(),
+                                            (xs[run][shown] / size).tolist(),
+                                            (ys[run][shown] / size).tolist()):
                     use = self._e.use()
                     use.set(XLINK_HREF, "#font_{0}_{1}".format(rec.fontId, code_point))
-
-                    use.set(
-                        'transform',
-                        "scale({0}) translate({1} {2})".format(
-                            size, float(x)/size, float(y)/size
-                        )
-                    )
-
-                    color = ColorUtils.to_rgb_string(ColorUtils.rgb(rec.textColor))
+                    use.set('transform', "scale({0}) translate({1} {2})".format(size, x, y))
                     use.set("style", "fill: {0}; stroke: {0}".format(color))
-
                     g.append(use)
-                else:
-                    inner_text += unichr(code_point)
-                    xValues.append(str(x))
-
-                x = x + float(glyph.advance)/PIXELS_PER_TWIP
-
-            if not fontInfo.useGlyphText:
-                text = self._e.text(inner_text)
+            else:
+                text = self._e.text("".join(map(unichr, code_points[run][shown].tolist())))
 
                 text.set("font-family", fontInfo.fontName)
                 text.set("font-size", str(size))
-                text.set("fill", ColorUtils.to_rgb_string(ColorUtils.rgb(rec.textColor)))
+                text.set("fill", color)
 
-                text.set("y", str(y))
-                text.set("x", " ".join(xValues))
+                text.set("y", str(float(ys[run][0])))
+                text.set("x", " ".join(map(str, xs[run][shown].tolist())))
 
                 if fontInfo.bold:
                     text.set("font-weight", "bold")
@@ -651,14 +861,38 @@ class SVGExporter(BaseExporter):
 
                 g.append(text)
 
-        self.defs.append(g)
+        self.add_def(g)
 
     def export_define_shape(self, tag):
         self.shape_exporter.force_stroke = self.force_stroke
         super(SVGExporter, self).export_define_shape(tag)
         shape = self.shape_exporter.g
         shape.set("id", "c%d" % tag.characterId)
-        self.defs.append(shape)
+        self.add_def(shape)
+        self.character_bounds[tag.characterId] = self.shape_exporter.bounds
+
+    def export_define_morph_shape(self, tag):
+        """ Export a morph shape as one shape per ratio it's shown at """
+        bounds = SVGBounds()
+        self.shape_exporter.force_stroke = self.force_stroke
+        for ratio in sorted(self.morph_ratios.get(tag.characterId) or [0]):
+            self.morph_cache.get_frame(tag, ratio).export(self.shape_exporter)
+            shape = self.shape_exporter.g
+            shape.set("id", "c%d_%d" % (tag.characterId, ratio))
+            self.add_def(shape)
+            bounds.merge(self.shape_exporter.bounds)
+        self.character_bounds[tag.characterId] = bounds
+
+    def get_mask_def_ids(self, swf):
+        """ Return the ids of the defs that PlaceObjects anywhere in the SWF use as masks """
+        return set([self.get_character_def_id(x) for x in swf.all_tags_of_type(TagPlaceObject)
+                    if x.hasCharacter and x.hasClipDepth])
+
+    def get_character_def_id(self, tag):
+        """ Return the id of the def a PlaceObject shows; morph shapes have one per ratio """
+        if tag.characterId in self.morph_ratios:
+            return "c%d_%d" % (tag.characterId, tag.ratio if tag.hasRatio else 0)
+        return "c%d" % tag.characterId
 
     def export_display_list_item(self, tag, parent=None):
         g = self._e.g()
@@ -672,17 +906,15 @@ class SVGExporter(BaseExporter):
             self.clip_depth = tag.clipDepth
             g = self._e.mask(id=self.mask_id)
             # make sure the mask is completely filled white
-            paths = self.defs.xpath("./svg:g[@id='c%d']/svg:path" % tag.characterId, namespaces=NS)
-            for path in paths:
-                path.set("fill", "#ffffff")
+            shape = self.defs_index.get(self.get_character_def_id(tag))
+            if shape is not None:
+                _fill_white(shape)
         elif tag.depth <= self.clip_depth and self.mask_id is not None:
             g.set("mask", "url(#%s)" % self.mask_id)
 
         filters = []
         filter_cxform = None
-        self._num_filters += 1
-        filter_id = "filter%d" % self._num_filters
-        svg_filter = self._e.filter(id=filter_id)
+        svg_filter = self._e.filter()
 
         if tag.hasColorTransform:
             filter_cxform = self.export_color_transform(tag.colorTransform, svg_filter)
@@ -693,10 +925,19 @@ class SVGExporter(BaseExporter):
             if len(f) > 0:
                 filters.extend(f)
         if tag.hasColorTransform or (tag.hasFilterList and len(filters) > 0):
-            self.defs.append(svg_filter)
+            # prevent same filter chain in <defs />
+            key = etree.tostring(svg_filter)
+            if key in self._filter_ids:
+                filter_id = self._filter_ids[key]
+            else:
+                self._num_filters += 1
+                filter_id = "filter%d" % self._num_filters
+                svg_filter.set("id", filter_id)
+                self._filter_ids[key] = filter_id
+                self.add_def(svg_filter)
             use.set("filter", "url(#%s)" % filter_id)
 
-        use.set(XLINK_HREF, "#c%s" % tag.characterId)
+        use.set(XLINK_HREF, "#%s" % self.get_character_def_id(tag))
         g.append(use)
 
         if is_mask:
@@ -806,7 +1047,7 @@ class SVGExporter(BaseExporter):
             img.set("width", "%s" % str(image.size[0]))
             img.set("height", "%s" % str(image.size[1]))
             img.set(XLINK_HREF, "%s" % data_url)
-            self.defs.append(img)
+            self.add_def(img)
 
 class SingleShapeSVGExporter(SVGExporter):
     """
@@ -883,31 +1124,261 @@ class FrameSVGExporterMixin(object):
         @param frame Which frame to export, by 0-based index (int)
         """
         self.wanted_frame = frame
-        return super(FrameSVGExporterMixin, self).export(swf, *export_opts)
+        return super(FrameSVGExporterMixin, self).export(swf, **export_opts)
+
+    def get_timeline(self, tags):
+        """ Return the (cached) Timeline for a tag list, so exporting frame after frame doesn't replay from frame 0 """
+        if not hasattr(self, "_timelines"):
+            self._timelines = {}
+        if id(tags) not in self._timelines or self._timelines[id(tags)].tags is not tags:
+            self._timelines[id(tags)] = Timeline(tags)
+        return self._timelines[id(tags)]
 
     def get_display_tags(self, tags, z_sorted=True):
+        return self.get_timeline(tags).display_list(self.wanted_frame).get_display_tags(z_sorted)
 
-        current_frame = 0
-        frame_tags = dict() # keys are depths, values are placeobject tags
-        for tag in tags:
-            if isinstance(tag, TagShowFrame):
-                if current_frame == self.wanted_frame:
-                    break
-                current_frame += 1
-            elif isinstance(tag, TagPlaceObject):
-                if tag.hasMove:
-                    orig_tag = frame_tags.pop(tag.depth)
-
-                    if not tag.hasCharacter:
-                        tag.characterId = orig_tag.characterId
-                    # this is for NamesSVGExporterMixin
-                    if not tag.hasName:
-                        tag.instanceName = orig_tag.instanceName
-                frame_tags[tag.depth] = tag
-            elif isinstance(tag, TagRemoveObject):
-                del frame_tags[tag.depth]
-
-        return super(FrameSVGExporterMixin, self).get_display_tags(frame_tags.values(), z_sorted)
+class SequenceSVGExporter(SVGExporter):
+    """
+    Exports all frames of a SWF in one pass.
+
+    Definitions are exported once into a shared <defs> and the timeline is
+    walked once. Use export() for a single SVG with a <g id="frameN"> per
+    frame, or export_frames() and serialize_defs() for one SVG per frame
+    that references a separate defs document.
+
+    Every frame gets the stage (header frame size) as its viewBox.
+    """
+    def export(self, swf, force_stroke=False, frames=None):
+        """ Exports the frames of the specified SWF to a single SVG.
+
+        @param swf    The SWF.
+        @param frames Optional (start, end) range of 0-based frames, end excluded.
+        """
+        self.begin_sequence(swf, force_stroke)
+        for frame, display_list in self._frames(frames):
+            g = self._e.g(id="frame%d" % frame)
+            if len(self.root.getchildren()):
+                g.set("display", "none")
+            self.root.append(g)
+            self._export_frame(display_list, g)
+        self._set_stage_viewbox(self.svg, swf)
+        return self._serialize()
+
+    def export_frames(self, swf, defs_href="defs.svg", force_stroke=False, frames=None):
+        """ Generator for (frame, BytesIO) with one SVG document per frame.
+
+        Character references point at defs_href, which should hold the
+        output of serialize_defs(). That can be serialized before or after
+        the frames: it's complete once begin_sequence() has run, masks
+        included. Filters are specific to a frame and stay in that frame's
+        document.
+
+        @param swf       The SWF.
+        @param defs_href URL of the shared defs document, relative to the frame documents.
+        @param frames    Optional (start, end) range of 0-based frames, end excluded.
+        """
+        self.begin_sequence(swf, force_stroke)
+        start, end = (0, None) if frames is None else frames
+        return self.export_frame_range(swf, start, end, defs_href)
+
+    def export_frame_range(self, swf, start, end=None, defs_href="defs.svg", display_list=None):
+        """ Like export_frames(), but reuses the definitions of an earlier begin_sequence().
+
+        @param display_list Optional DisplayList with the stage at the start of
+                            the start frame, so the timeline doesn't have to seek.
+        """
+        for frame, frame_display_list in self.timeline.frames(start, end, display_list):
+            svg = self._e.svg(version=SVG_VERSION)
+            frame_defs = self._e.defs()
+            g = self._e.g()
+            svg.append(frame_defs)
+            svg.append(g)
+            num_defs = len(self.defs.getchildren())
+            # Filters go out with the frame that made them, so frames can't share them
+            self._filter_ids = {}
+            self._num_filters = self._num_shared_filters
+            self._export_frame(frame_display_list, g)
+            # Move this frame's filters over from the shared defs
+            for element in self.defs.getchildren()[num_defs:]:
+                frame_defs.append(element)
+                self.defs_index.pop(element.get("id"), None)
+            for use in g.iter("{%s}use" % SVG_NS):
+                use.set(XLINK_HREF, defs_href + use.get(XLINK_HREF))
+            self._set_stage_viewbox(svg, swf)
+            yield frame, BytesIO(etree.tostring(svg, encoding="UTF-8", xml_declaration=True))
+
+    def add_def(self, element):
+        # Frames only reference the shared defs, so shapes used as masks
+        # are filled white as they go in rather than when a frame uses them
+        if element.get("id") in self._mask_ids:
+            _fill_white(element)
+        super(SequenceSVGExporter, self).add_def(element)
+
+    def serialize_defs(self):
+        """ Return the shared defs as a standalone SVG document.
+
+        Any time after begin_sequence() will do; exporting frames doesn't
+        change the shared defs.
+        """
+        svg = self._e.svg(version=SVG_VERSION)
+        svg.append(copy.deepcopy(self.defs))
+        return BytesIO(etree.tostring(svg, encoding="UTF-8", xml_declaration=True))
+
+    def begin_sequence(self, swf, force_stroke=False):
+        """ Export the definitions and index the timeline """
+        self._setup_document(swf, force_stroke)
+        self._mask_ids = self.get_mask_def_ids(swf)
+        self.export_definitions(swf)
+        # Sprites may have put filters in the shared defs, frame filters are numbered after them
+        self._num_shared_filters = self._num_filters
+        self.timeline = Timeline(swf.tags)
+
+    def _frames(self, frames):
+        start, end = (0, None) if frames is None else frames
+        return self.timeline.frames(start, end)
+
+    def _export_frame(self, display_list, parent):
+        self.clip_depth = 0
+        self.mask_id = None
+        self.export_display_list(display_list.get_display_tags(), parent)
+
+    def _set_stage_viewbox(self, svg, swf):
+        vb = self.get_stage_viewbox(swf)
+        if vb is None:
+            bounds = SVGBounds(self.svg, self.defs_index)
+            vb = [bounds.minx, bounds.miny, bounds.width, bounds.height]
+        svg.set("width", "%dpx" % round(vb[2]))
+        svg.set("height", "%dpx" % round(vb[3]))
+        svg.set("viewBox", "%s" % " ".join(map(str, vb)))
+
+# Namespace declarations of the root element written by StreamingSVGExporter
+_STREAM_NS_DECLS = (
+    (' xmlns="%s"' % SVG_NS).encode("ascii"),
+    (' xmlns:xlink="%s"' % XLINK_NS).encode("ascii"),
+)
+
+class StreamingSVGExporter(SVGExporter):
+    """
+    Exports a SWF to SVG while writing it to a file.
+
+    Elements are serialized with lxml's incremental writer as soon as they
+    are complete and then dropped, so memory use doesn't grow with the size
+    of the output. Only small stand-ins (id, width and height) stay in
+    defs_index for later lookups.
+
+    The document gets the stage (header frame size) as its viewBox, since
+    the root element has to be written before any bounds are known. Filters
+    made for top level display items are written in a <defs> right before
+    the item.
+    """
+    def __init__(self, margin=0, path_precision=None, relative_paths=False):
+        # No swf argument: exporting needs an output, so call export() for that
+        self._xf = None
+        super(StreamingSVGExporter, self).__init__(None, margin, path_precision, relative_paths)
+
+    def export(self, swf, output, force_stroke=False):
+        """ Exports the specified SWF to SVG.
+
+        @param swf    The SWF.
+        @param output Filename or file-like object to write the SVG to.
+        @param force_stroke Whether to force strokes on non-stroked fills.
+        """
+        self._setup_document(swf, force_stroke)
+        vb = self.get_stage_viewbox(swf)
+        if vb is None:
+            raise Exception("StreamingSVGExporter::export needs the SWF header for the viewBox")
+        if self._margin > 0:
+            vb = [vb[0] - self._margin, vb[1] - self._margin,
+                  vb[2] + 2 * self._margin, vb[3] + 2 * self._margin]
+
+        # Shapes used as masks are filled white before they are written,
+        # there's no going back to them once the display list needs them
+        self._mask_ids = self.get_mask_def_ids(swf)
+
+        attrib = {"version": SVG_VERSION,
+                  "width": "%dpx" % round(vb[2]),
+                  "height": "%dpx" % round(vb[3]),
+                  "viewBox": " ".join(map(str, vb))}
+        # Elements are written to the stream directly (see _write), so it
+        # has to be a file object
+        close_output = not hasattr(output, "write")
+        if close_output:
+            output = open(output, "wb")
+        try:
+            with etree.xmlfile(output, encoding="UTF-8") as xf:
+                xf.write_declaration()
+                with xf.element("{%s}svg" % SVG_NS, attrib, nsmap={None : SVG_NS, "xlink" : XLINK_NS}):
+                    self._xf = xf
+                    self._output = output
+                    self._in_display_list = False
+                    with xf.element("{%s}defs" % SVG_NS):
+                        self.export_definitions(swf)
+                        self._flush_defs()
+                    self._in_display_list = True
+                    with xf.element("{%s}g" % SVG_NS):
+                        self.export_display_list(self.get_display_tags(swf.tags))
+                        self._flush_display_list()
+        finally:
+            self._xf = None
+            self._output = None
+            if close_output:
+                output.close()
+
+    def add_def(self, element):
+        if element.get("id") in self._mask_ids:
+            _fill_white(element)
+        super(StreamingSVGExporter, self).add_def(element)
+        if not self._in_display_list:
+            self._flush_defs()
+
+    def export_define_sprite(self, tag, parent=None):
+        # Unlike SVGExporter, the sprite can only be written once its display list is in it
+        g = self._e.g(id="c%d" % tag.characterId)
+        self.clip_depth = 0
+        display_tags = self.get_display_tags(tag.tags)
+        self._sprite_display_tags[tag.characterId] = display_tags
+        self.export_display_list(display_tags, g)
+        self.add_def(g)
+
+    def export_display_list_item(self, tag, parent=None):
+        # Top level items are written one item late, so mixins can still
+        # change the <use> they get back
+        if parent is None:
+            self._flush_display_list()
+        return super(StreamingSVGExporter, self).export_display_list_item(tag, parent)
+
+    def _flush_defs(self):
+        for element in self.defs.getchildren():
+            self._write(element)
+            self.defs.remove(element)
+            id = element.get("id")
+            if id is not None and self.defs_index.get(id) is element:
+                self.defs_index[id] = self._stand_in(element)
+
+    def _flush_display_list(self):
+        if len(self.defs.getchildren()):
+            with self._xf.element("{%s}defs" % SVG_NS):
+                self._flush_defs()
+        for element in self.root.getchildren():
+            self._write(element)
+            self.root.remove(element)
+
+    def _write(self, element):
+        # xmlfile.write() declares the namespaces again on every element it
+        # writes, so serialize it here without the ones the <svg> has
+        xml = etree.tostring(element, encoding="UTF-8")
+        head, sep, rest = xml.partition(b">")
+        for decl in _STREAM_NS_DECLS:
+            head = head.replace(decl, b"", 1)
+        self._xf.flush()
+        self._output.write(head + sep + rest)
+
+    def _stand_in(self, element):
+        stand_in = etree.Element(element.tag)
+        for name in ("id", "width", "height"):
+            if element.get(name) is not None:
+                stand_in.set(name, element.get(name))
+        return stand_in
 
 class NamesSVGExporterMixin(object):
     '''
@@ -985,7 +1456,7 @@ class SVGFilterFactory(object):
         return offset
 
 class SVGBounds(object):
-    def __init__(self, svg=None):
+    def __init__(self, svg=None, defs_index=None):
         self.minx = 1000000.0
         self.miny = 1000000.0
         self.maxx = -self.minx
@@ -994,8 +1465,18 @@ class SVGBounds(object):
         self._matrix = self._calc_combined_matrix()
         if svg is not None:
             self._svg = svg;
+            self._defs_index = defs_index if defs_index is not None else self._index_defs(svg)
             self._parse(svg)
 
+    def _index_defs(self, svg):
+        # One pass over the defs instead of a search for every <use>
+        index = {}
+        for defs in svg.findall("{%s}defs" % SVG_NS):
+            for g in defs.iter("{%s}g" % SVG_NS):
+                if g.get("id"):
+                    index[g.get("id")] = g
+        return index
+
     def add_point(self, x, y):
         self.minx = x if x < self.minx else self.minx
         self.miny = y if y < self.miny else self.miny
@@ -1024,6 +1505,15 @@ class SVGBounds(object):
         self.maxx = other.maxx if other.maxx > self.maxx else self.maxx
         self.maxy = other.maxy if other.maxy > self.maxy else self.maxy
 
+    def merge_transformed(self, other, matrix):
+        """ Merge the corners of other's box after transforming them by a Matrix2 """
+        if other.minx > other.maxx or other.miny > other.maxy:
+            return
+        for x, y in ((other.minx, other.miny), (other.maxx, other.miny),
+                     (other.minx, other.maxy), (other.maxx, other.maxy)):
+            w = matrix.multiply_point([x, y])
+            self.add_point(w[0], w[1])
+
     def shrink(self, margin):
         self.minx += margin
         self.miny += margin
@@ -1048,10 +1538,9 @@ class SVGBounds(object):
             href = element.get(XLINK_HREF)
             if href:
                 href = href.replace("#", "")
-                els = self._svg.xpath("./svg:defs//svg:g[@id='%s']" % href,
-                        namespaces=NS)
-                if len(els) > 0:
-                    self._parse(els[0])
+                el = self._defs_index.get(href)
+                if el is not None and el.tag == "{%s}g" % SVG_NS:
+                    self._parse(el)
 
         for child in element.getchildren():
             if child.tag == "{%s}defs" % SVG_NS: continue
@@ -1099,6 +1588,11 @@ class SVGBounds(object):
         self._stack.append(self._build_matrix(transform))
         self._matrix = self._calc_combined_matrix()
 
+def _fill_white(element):
+    # Masks go by luminance, so the shapes that make them are filled white
+    for path in element.findall("{%s}path" % SVG_NS):
+        path.set("fill", "#ffffff")
+
 def _encode_jpeg(data):
     return "data:image/jpeg;base64," + base64.encodestring(data)[:-1]
 
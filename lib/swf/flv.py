@@ -0,0 +1,151 @@
+"""
+This module writes the embedded video streams of a SWF to FLV files.
+
+A DefineVideoStream and its VideoFrame tags (see collect_video_streams)
+are muxed into an FLV container as they are, without transcoding: FLV
+uses the same codec ids and, apart from VP6, the same packets. Each frame
+is written as soon as it's muxed, with its timestamp worked out from its
+frame number and the SWF's frame rate.
+"""
+from __future__ import absolute_import
+from .consts import VideoCodec
+import binascii
+import os
+import struct
+import tempfile
+
+FLV_TAG_SCRIPT = 18
+FLV_TAG_VIDEO = 9
+
+FRAME_KEY = 1
+FRAME_INTER = 2
+FRAME_DISPOSABLE = 3
+
+class FLVWriter(object):
+    """
+    Writes the frames of one video stream to an FLV file, one tag at a time.
+
+    @param output      A file object open for writing bytes.
+    @param stream_tag  The TagDefineVideoStream.
+    @param frame_rate  The SWF's frame rate, in frames per second.
+    """
+    def __init__(self, output, stream_tag, frame_rate):
+        self.output = output
+        self.stream_tag = stream_tag
+        self.frame_rate = float(frame_rate) or 12.0 # what Flash plays a 0 fps movie at
+        self.codec = stream_tag.codec
+        # VP6 in FLV stores how much to crop off its 16 pixel macroblocks
+        self.adjustment = ((-stream_tag.width % 16) << 4) | (-stream_tag.height % 16)
+        self.frames_written = 0
+
+    def write_header(self):
+        """ Write the FLV header and the onMetaData script tag """
+        self.output.write(b'FLV' + struct.pack('>BBI', 1, 0x01, 9))
+        self.output.write(struct.pack('>I', 0)) # size of the (missing) previous tag
+        self._write_tag(FLV_TAG_SCRIPT, 0, _amf_string('onMetaData') + _amf_ecma_array([
+            ('duration', self.stream_tag.numFrames / self.frame_rate),
+            ('width', float(self.stream_tag.width)),
+            ('height', float(self.stream_tag.height)),
+            ('framerate', self.frame_rate),
+            ('videocodecid', float(self.codec)),
+        ]))
+
+    def write_frame(self, frame_tag):
+        """ Write a TagVideoFrame as an FLV video tag """
+        data = frame_tag.videoData
+        packet_header = struct.pack('>B', (get_frame_type(self.codec, data) << 4) | self.codec)
+        if self.codec in (VideoCodec.VP6, VideoCodec.VP6Alpha):
+            packet_header += struct.pack('>B', self.adjustment)
+        timestamp = int(round(frame_tag.frameNumber * 1000 / self.frame_rate))
+        self._write_tag(FLV_TAG_VIDEO, timestamp, packet_header, data)
+        self.frames_written += 1
+
+    def _write_tag(self, tag_type, timestamp, *payload):
+        size = sum([len(part) for part in payload])
+        # 24 bit size and timestamp, then the timestamp's upper 8 bits and a 24 bit stream id of 0
+        self.output.write(struct.pack('>I', (tag_type << 24) | size))
+        self.output.write(struct.pack('>I', ((timestamp & 0xffffff) << 8) | ((timestamp >> 24) & 0xff)))
+        self.output.write(b'\0\0\0')
+        for part in payload:
+            self.output.write(part)
+        self.output.write(struct.pack('>I', 11 + size))
+
+def get_frame_type(codec, data):
+    """ Return FRAME_KEY, FRAME_INTER or FRAME_DISPOSABLE for a frame's video data """
+    if codec == VideoCodec.SorensonH263:
+        # PictureStartCode (17 bits), Version (5), TemporalReference (8), PictureSize (3),
+        # an optional custom size (2x8 or 2x16 bits), then PictureType (2)
+        if len(data) < 9:
+            return FRAME_INTER
+        bits = int(binascii.hexlify(data[:9]), 16)
+        position = 30
+        picture_size = (bits >> (72 - position - 3)) & 0x7
+        position += 3 + (16 if picture_size == 0 else 32 if picture_size == 1 else 0)
+        return [FRAME_KEY, FRAME_INTER, FRAME_DISPOSABLE, FRAME_INTER][(bits >> (72 - position - 2)) & 0x3]
+    elif codec == VideoCodec.ScreenVideo:
+        return FRAME_KEY if _is_screen_video_keyframe(bytearray(data)) else FRAME_INTER
+    elif codec in (VideoCodec.VP6, VideoCodec.VP6Alpha):
+        # The first bit of a VP6 frame is 0 for intra frames; alpha packets start with a 24 bit offset
+        start = 3 if codec == VideoCodec.VP6Alpha else 0
+        if len(data) <= start:
+            return FRAME_INTER
+        return FRAME_INTER if bytearray(data)[start] & 0x80 else FRAME_KEY
+    return FRAME_INTER
+
+def _is_screen_video_keyframe(data):
+    # A screen video frame is a key frame if every block has data; empty blocks keep the previous frame's pixels
+    if len(data) < 4:
+        return False
+    block_width = ((data[0] >> 4) + 1) * 16
+    image_width = ((data[0] & 0xf) << 8) | data[1]
+    block_height = ((data[2] >> 4) + 1) * 16
+    image_height = ((data[2] & 0xf) << 8) | data[3]
+    num_blocks = -(-image_width // block_width) * -(-image_height // block_height)
+    position = 4
+    for i in range(num_blocks):
+        if position + 2 > len(data):
+            return False
+        size = (data[position] << 8) | data[position + 1]
+        if size == 0:
+            return False
+        position += 2 + size
+    return True
+
+def _amf_string(s):
+    s = s.encode('utf-8')
+    return struct.pack('>BH', 2, len(s)) + s
+
+def _amf_ecma_array(items):
+    data = struct.pack('>BI', 8, len(items))
+    for name, value in items:
+        name = name.encode('utf-8')
+        data += struct.pack('>H', len(name)) + name + struct.pack('>Bd', 0, value)
+    return data + b'\0\0\x09'
+
+def write_video_stream(stream, output, frame_rate):
+    """
+    Mux a video stream into an FLV file in one pass.
+
+    @param stream      A video stream, as returned by collect_video_streams.
+    @param output      A file object open for writing bytes.
+    @param frame_rate  The SWF's frame rate, in frames per second.
+    @return            The number of frames written.
+    """
+    writer = FLVWriter(output, stream[0], frame_rate)
+    writer.write_header()
+    for frame_tag in stream[1:]:
+        writer.write_frame(frame_tag)
+    return writer.frames_written
+
+def extract_video_streams(swf, directory=None, prefix='swf_video_'):
+    """
+    Write every video stream of a SWF to its own new, uniquely named FLV file.
+    Returns a list of (stream, path) tuples in timeline order.
+    """
+    rc = []
+    for stream in swf.collect_video_streams():
+        fd, path = tempfile.mkstemp(suffix='.flv', prefix=prefix, dir=directory)
+        with os.fdopen(fd, 'wb') as output:
+            write_video_stream(stream, output, swf.header.frame_rate)
+        rc.append((stream, path))
+    return rc
@@ -0,0 +1,124 @@
+"""
+This module keeps the outlines of font glyphs, so text pays once per glyph
+rather than once per character it shows.
+
+Glyphs are SWFShapes in a font's glyphShapeTable, drawn on an EM square of
+1024 units (DefineFont3 uses 20 times that). GlyphCache holds a
+GlyphOutline per (fontId, glyph index), which works out its SVG path and
+its contours, flattened to lists of points, the first time each is asked
+for.
+"""
+from __future__ import absolute_import
+from .data import SWFShapeRecord
+from .tag import TagDefineFont3
+import copy
+
+EM_SQUARE_LENGTH = 1024
+CURVE_SEGMENTS = 8 # line segments per quadratic curve of a flattened glyph
+
+class GlyphOutline(object):
+    """
+    The outline of one glyph of a font.
+
+    @param font   The TagDefineFont(2/3) the glyph belongs to.
+    @param index  Index of the glyph in the font's glyphShapeTable.
+    """
+    def __init__(self, font, index):
+        self.font = font
+        self.index = index
+        self.shape = font.glyphShapeTable[index]
+        self._contours = None
+        self._holes = None
+        self._svg_path = None
+        self._svg_path_exported = False
+
+    @property
+    def contours(self):
+        """
+        The glyph's closed contours as lists of (x, y) points, in EM square
+        units (1024 per EM for every kind of DefineFont).
+        """
+        if self._contours is None:
+            # Glyphs have a single fill, so contours can come straight from the records:
+            # every move starts one, and holes are simply wound the other way
+            scale = float(EM_SQUARE_LENGTH) / get_em_square(self.font)
+            contours = []
+            x = y = 0
+            for record in self.shape.records:
+                if len(contours) == 0 and record.type in (SWFShapeRecord.TYPE_STRAIGHTEDGE, SWFShapeRecord.TYPE_CURVEDEDGE):
+                    contours.append([(0.0, 0.0)]) # drawing started at the origin without a move
+                if record.type == SWFShapeRecord.TYPE_STYLECHANGE:
+                    if record.state_moveto:
+                        x, y = record.move_deltaX, record.move_deltaY
+                        contours.append([(x * scale, y * scale)])
+                elif record.type == SWFShapeRecord.TYPE_STRAIGHTEDGE:
+                    x += record.deltaX
+                    y += record.deltaY
+                    contours[-1].append((x * scale, y * scale))
+                elif record.type == SWFShapeRecord.TYPE_CURVEDEDGE:
+                    cx, cy = x + record.control_deltaX, y + record.control_deltaY
+                    ax, ay = cx + record.anchor_deltaX, cy + record.anchor_deltaY
+                    for i in range(1, CURVE_SEGMENTS + 1):
+                        t = float(i) / CURVE_SEGMENTS
+                        a, b, c = (1 - t) * (1 - t), 2 * t * (1 - t), t * t
+                        contours[-1].append(((a * x + b * cx + c * ax) * scale, (a * y + b * cy + c * ay) * scale))
+                    x, y = ax, ay
+            self._contours = [contour for contour in contours if len(contour) > 2]
+        return self._contours
+
+    @property
+    def holes(self):
+        """ For each of the contours, whether it's a hole: wound against the glyph's largest contour """
+        if self._holes is None:
+            areas = [_signed_area(contour) for contour in self.contours]
+            outer = max(areas, key=abs) if len(areas) else 0
+            self._holes = [area * outer < 0 for area in areas]
+        return self._holes
+
+    @property
+    def svg_path(self):
+        """ The glyph's SVG <path> element, without fill or stroke, or None for an empty glyph """
+        if not self._svg_path_exported:
+            paths = self.shape.export().g.getchildren()
+            if len(paths):
+                self._svg_path = paths[0]
+                # Text sets its own color on the <use> elements that show the glyph
+                for name in ("stroke", "fill"):
+                    if name in self._svg_path.attrib:
+                        del self._svg_path.attrib[name]
+            self._svg_path_exported = True
+        return self._svg_path
+
+    def copy_svg_path(self):
+        """ Return a copy of svg_path that can go in a document, or None """
+        return copy.deepcopy(self.svg_path) if self.svg_path is not None else None
+
+def _signed_area(points):
+    # Shoelace formula; the sign gives the winding
+    return sum([x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1])]) / 2.0
+
+def get_em_square(font):
+    """ Return the size of the EM square a font's glyphs are drawn on """
+    return EM_SQUARE_LENGTH * 20 if isinstance(font, TagDefineFont3) else EM_SQUARE_LENGTH
+
+class GlyphCache(object):
+    """
+    Glyph outlines by (fontId, glyph index).
+
+    Outlines are made the first time they're asked for. An outline is made
+    again when its fontId turns up with another font tag, as it will when
+    the same cache is used for more than one SWF.
+    """
+    def __init__(self):
+        self._outlines = {}
+
+    def get_outline(self, font, index):
+        """ Return the GlyphOutline of a font's glyph """
+        key = (font.characterId, index)
+        outline = self._outlines.get(key)
+        if outline is None or outline.font is not font:
+            outline = self._outlines[key] = GlyphOutline(font, index)
+        return outline
+
+    def clear(self):
+        self._outlines = {}
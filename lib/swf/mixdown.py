@@ -0,0 +1,309 @@
+"""
+This module mixes the event sounds of a SWF down to a single PCM track.
+
+Every StartSound and StartSound2 on the root timeline, and on the timelines
+of sprites while they're on stage (sprites loop), becomes a SoundEvent at a
+sample offset worked out from the frame rate. Each event plays its sound
+the way its SWFSoundInfo says: in and out points, loops and the volume
+envelope. syncStop cuts off the sound's playing events and syncNoMultiple
+skips the event if the sound is already playing. In and out points and
+envelope positions are in 44.1 kHz samples, envelope positions count from
+the start of the event.
+
+Sounds are decoded once, as floats at the mix rate. The mix itself is
+rendered a chunk at a time, so write() streams it to a WAV file without
+ever holding the whole track.
+"""
+from __future__ import absolute_import
+from . import consts
+from . import sound
+from .tag import TagDefineSound, TagDefineSprite, TagStartSound, TagStartSound2, TagSymbolClass, \
+    TagPlaceObject, TagRemoveObject, TagShowFrame, TagSoundStreamHead
+import numpy as np
+import os
+import tempfile
+import wave
+
+MIX_RATE = 44100
+CHUNK_SIZE = 65536 # samples per rendered chunk
+SOUND_INFO_RATE = 44100 # in/out points and envelope positions are in 44.1 kHz samples
+DEFAULT_FRAME_RATE = 12.0 # what Flash plays a 0 fps movie at
+
+def decode_sound(tag):
+    """
+    Decode an uncompressed or ADPCM DefineSound.
+
+    @param tag  The TagDefineSound.
+    @return     A float32 array with a row per sample and a column per channel,
+                at the tag's sample rate, or None for other codecs.
+    """
+    channels = consts.AudioChannels.Channels[tag.soundChannels]
+    tag.soundData.seek(0)
+    data = tag.soundData.read()
+    if tag.soundFormat in sound.uncompressed:
+        if consts.AudioSampleSize.Bits[tag.soundSampleSize] == 8:
+            samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+        else:
+            samples = np.frombuffer(data[:len(data) & ~1], dtype='<i2').astype(np.float32) / 32768
+    elif tag.soundFormat == consts.AudioCodec.ADPCM and sound.adpcm is not None:
+        samples = sound.adpcm.decode(data, channels).astype(np.float32) / 32768
+    else:
+        return None
+    samples = samples[:len(samples) // channels * channels].reshape(-1, channels)
+    return samples[:tag.soundSamples]
+
+def resample(samples, from_rate, to_rate):
+    """ Linearly resample an array with a row per sample """
+    if from_rate == to_rate or len(samples) == 0:
+        return samples
+    count = int(round(len(samples) * to_rate / float(from_rate)))
+    positions = np.arange(count) * (from_rate / float(to_rate))
+    indices = np.arange(len(samples))
+    return np.stack([np.interp(positions, indices, samples[:, channel])
+                     for channel in range(samples.shape[1])], axis=1).astype(np.float32)
+
+def get_mix_rate(swf):
+    """ Return the playback rate of the SWF's sound stream, or MIX_RATE if it has none """
+    for tag in swf.tags:
+        if isinstance(tag, TagSoundStreamHead):
+            return consts.AudioSampleRate.Rates[tag.playbackRate]
+    return MIX_RATE
+
+class SoundEvent(object):
+    """
+    One playback of a sound in the mix. Positions are in mix samples.
+
+    @param sound_id  The DefineSound's soundId.
+    @param info      The SWFSoundInfo it's played with.
+    @param start     First sample of the playback.
+    """
+    def __init__(self, sound_id, info, start):
+        self.sound_id = sound_id
+        self.info = info
+        self.start = start
+        self.in_point = 0
+        self.segment = 0 # samples in one loop
+        self.end = start
+        self.envelope = None # (positions, left levels, right levels)
+
+class Mixdown(object):
+    """
+    The event sound mix of a SWF.
+
+    @param swf       The SWF.
+    @param rate      Sample rate of the mix. Defaults to the rate of the sound stream (see get_mix_rate).
+    @param decoders  Optional dict of AudioCodec to a function that decodes a DefineSound tag
+                     the way decode_sound does. Uncompressed and ADPCM sounds are decoded
+                     by decode_sound, sounds in other codecs are left out of the mix.
+    @param frames    Optional (start, end) range of 0-based frames to mix, end excluded.
+                     Sounds that start earlier and are still playing are mixed in.
+    """
+    def __init__(self, swf, rate=None, decoders=None, frames=None):
+        self.rate = get_mix_rate(swf) if rate is None else rate
+        self.frame_rate = float(swf.header.frame_rate) or DEFAULT_FRAME_RATE
+        self.decoders = dict([(codec, decode_sound) for codec in sound.uncompressed])
+        if sound.adpcm is not None:
+            self.decoders[consts.AudioCodec.ADPCM] = decode_sound
+        self.decoders.update(decoders or {})
+
+        self.sounds = {}
+        self._sprites = {}
+        self._class_ids = {}
+        for tag in swf.tags:
+            if isinstance(tag, TagDefineSound):
+                self.sounds[tag.soundId] = tag
+            elif isinstance(tag, TagDefineSprite):
+                self._sprites[tag.characterId] = tag
+            elif isinstance(tag, TagSymbolClass):
+                for symbol in tag.symbols:
+                    self._class_ids[symbol.name] = symbol.tagId
+        self._sound_sprites = self._find_sound_sprites()
+
+        frame_count = len([tag for tag in swf.tags if isinstance(tag, TagShowFrame)])
+        start, end = (0, None) if frames is None else frames
+        end = frame_count if end is None else min(end, frame_count)
+        self.offset = self.frame_to_sample(start)
+        self.length = max(self.frame_to_sample(end) - self.offset, 0)
+
+        timeline_events = []
+        self._collect_events(swf.tags, 0, end, False, timeline_events)
+        self.events = self._resolve_events(timeline_events)
+        self._sources = {}
+
+    def frame_to_sample(self, frame):
+        """ Return the first mix sample of a 0-based frame, counted from the start of the timeline """
+        return int(round(frame * self.rate / self.frame_rate))
+
+    def supported(self, sound_id):
+        """ Return True if the sound can be decoded """
+        return self.sounds[sound_id].soundFormat in self.decoders
+
+    def is_silent(self):
+        """ Return True if no supported sound plays in the mixed range """
+        return not any(self.supported(event.sound_id) and event.end > self.offset and
+                       event.start < self.offset + self.length for event in self.events)
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """ Generator for the mix as float32 arrays of up to chunk_size rows, with a left and a right column """
+        for chunk_start in range(self.offset, self.offset + self.length, chunk_size):
+            chunk = np.zeros((min(chunk_size, self.offset + self.length - chunk_start), 2), dtype=np.float32)
+            for event in self.events:
+                if event.start >= chunk_start + len(chunk):
+                    break # events are sorted by start
+                self._mix_event(event, chunk, chunk_start)
+            yield chunk
+
+    def render(self):
+        """ Return the whole mix as one float32 array with a left and a right column """
+        chunks = list(self.chunks())
+        return np.concatenate(chunks) if len(chunks) else np.zeros((0, 2), dtype=np.float32)
+
+    def write(self, output):
+        """
+        Write the mix to a 16 bit stereo WAV file, chunk by chunk.
+
+        @param output  A path or a file object.
+        """
+        w = wave.open(output, 'wb')
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(self.rate)
+        for chunk in self.chunks():
+            np.clip(chunk, -1, 1, out=chunk)
+            w.writeframes((chunk * 32767).astype('<i2').tobytes())
+        w.close()
+
+    def _find_sound_sprites(self):
+        # Sprites that start sounds themselves or place sprites that do; the others needn't be walked
+        found = set([characterId for characterId, sprite in self._sprites.items()
+                     if any(isinstance(tag, (TagStartSound, TagStartSound2)) for tag in sprite.tags)])
+        places = dict([(characterId, set([tag.characterId for tag in sprite.tags
+                                          if isinstance(tag, TagPlaceObject) and tag.hasCharacter]))
+                       for characterId, sprite in self._sprites.items()])
+        changed = True
+        while changed:
+            changed = False
+            for characterId in places:
+                if characterId not in found and len(places[characterId] & found) > 0:
+                    found.add(characterId)
+                    changed = True
+        return found
+
+    def _collect_events(self, tags, first_frame, end_frame, loop, events):
+        # Play a timeline from first_frame up to end_frame, adding (frame, StartSound tag) to events.
+        # Sprites placed on it are played from the frame they're placed until they're removed.
+        frame = first_frame
+        while frame < end_frame:
+            loop_start = frame
+            instances = {} # depth: (characterId, frame placed)
+            for tag in tags:
+                if isinstance(tag, (TagStartSound, TagStartSound2)):
+                    events.append((frame, tag))
+                elif isinstance(tag, TagPlaceObject) and tag.hasCharacter:
+                    self._end_instance(instances.pop(tag.depth, None), frame, events)
+                    if tag.characterId in self._sound_sprites:
+                        instances[tag.depth] = (tag.characterId, frame)
+                elif isinstance(tag, TagRemoveObject):
+                    self._end_instance(instances.pop(tag.depth, None), frame, events)
+                elif isinstance(tag, TagShowFrame):
+                    frame += 1
+                    if frame >= end_frame:
+                        break
+            # Whatever is still on stage plays until the timeline stops or starts over
+            for instance in instances.values():
+                self._end_instance(instance, end_frame if not loop else frame, events)
+            if not loop or frame == loop_start:
+                break
+
+    def _end_instance(self, instance, end_frame, events):
+        if instance is not None:
+            characterId, first_frame = instance
+            self._collect_events(self._sprites[characterId].tags, first_frame, end_frame, True, events)
+
+    def _resolve_events(self, timeline_events):
+        # Turn (frame, StartSound tag) into SoundEvents, applying the sync flags in timeline order
+        events = []
+        playing = {} # soundId: SoundEvents
+        timeline_events.sort(key=lambda event: event[0])
+        for frame, tag in timeline_events:
+            if isinstance(tag, TagStartSound):
+                sound_id = tag.soundId
+            else:
+                sound_id = self._class_ids.get(tag.soundClassName)
+            if sound_id not in self.sounds:
+                continue
+            start = self.frame_to_sample(frame)
+            info = tag.soundInfo
+            active = [event for event in playing.get(sound_id, []) if event.end > start]
+            if info.syncStop:
+                for event in active:
+                    event.end = start
+                continue
+            if info.syncNoMultiple and len(active) > 0:
+                continue
+            event = self._make_event(sound_id, info, start)
+            playing.setdefault(sound_id, []).append(event)
+            events.append(event)
+        events.sort(key=lambda event: event.start)
+        return events
+
+    def _make_event(self, sound_id, info, start):
+        tag = self.sounds[sound_id]
+        scale = self.rate / float(SOUND_INFO_RATE)
+        length = int(round(tag.soundSamples * self.rate / float(consts.AudioSampleRate.Rates[tag.soundRate])))
+        event = SoundEvent(sound_id, info, start)
+        event.in_point = min(int(round(info.inPoint * scale)), length) if info.hasInPoint else 0
+        out_point = min(int(round(info.outPoint * scale)), length) if info.hasOutPoint else length
+        event.segment = max(out_point - event.in_point, 0)
+        loops = max(info.loopCount, 1) if info.hasLoops else 1
+        event.end = start + event.segment * loops
+        if info.hasEnvelope and len(info.envelopePoints) > 0:
+            points = info.envelopePoints
+            event.envelope = (np.array([point.position * scale for point in points]),
+                              np.array([point.leftLevel / 32768.0 for point in points]),
+                              np.array([point.rightLevel / 32768.0 for point in points]))
+        return event
+
+    def _get_source(self, sound_id):
+        # The decoded sound, stereo at the mix rate; None if it can't be decoded
+        if sound_id not in self._sources:
+            tag = self.sounds[sound_id]
+            samples = self.decoders[tag.soundFormat](tag) if self.supported(sound_id) else None
+            if samples is not None:
+                samples = np.asarray(samples, dtype=np.float32).reshape(len(samples), -1)
+                samples = resample(samples, consts.AudioSampleRate.Rates[tag.soundRate], self.rate)
+                if samples.shape[1] == 1:
+                    samples = samples.repeat(2, axis=1)
+                samples = samples[:, :2]
+            self._sources[sound_id] = samples
+        return self._sources[sound_id]
+
+    def _mix_event(self, event, chunk, chunk_start):
+        # Add the part of an event that falls in the chunk
+        begin = max(event.start, chunk_start)
+        end = min(event.end, chunk_start + len(chunk))
+        if begin >= end:
+            return
+        source = self._get_source(event.sound_id)
+        if source is None or len(source) <= event.in_point:
+            return
+        positions = np.arange(begin - event.start, end - event.start)
+        indices = event.in_point + positions % event.segment
+        samples = source[np.minimum(indices, len(source) - 1)]
+        # The decoded sound can come up a little short of its sample count
+        samples *= (indices < len(source))[:, None]
+        if event.envelope is not None:
+            envelope_positions, left, right = event.envelope
+            samples *= np.stack([np.interp(positions, envelope_positions, left),
+                                 np.interp(positions, envelope_positions, right)], axis=1)
+        chunk[begin - chunk_start:end - chunk_start] += samples
+
+def extract_mixdown(mixdown, directory=None, prefix='swf_mixdown_'):
+    """
+    Write a mix to a new, uniquely named WAV file.
+    Returns the path of the file.
+    """
+    fd, path = tempfile.mkstemp(suffix='.wav', prefix=prefix, dir=directory)
+    with os.fdopen(fd, 'wb') as output:
+        mixdown.write(output)
+    return path
@@ -0,0 +1,438 @@
+"""
+This module interpolates morph shapes (DefineMorphShape and DefineMorphShape2).
+
+A morph shape has a start and an end edge list with the same edges, plus
+styles with a start and an end value. MorphShape pairs the edges up once:
+every record becomes a row of a start and an end array, with straight
+edges stored as curves when the other side is curved. The styles' colors,
+widths, matrices and gradient ratios go in another pair of arrays. A
+ratio is then one lerp over each pair, and a cumulative sum turns the
+rows into absolute points.
+
+Exporters that take whole paths (draw_path) and the rasterizer work from
+those points directly: the paths of the start shape are worked out once,
+as indices into the points, and every ratio only fills in coordinates.
+Anything else gets the interpolated SWFShapeWithStyle. MorphCache keeps
+the frames by (characterId, ratio).
+"""
+from __future__ import absolute_import
+from .data import SWFShapeWithStyle, SWFShapeRecord, SWFShapeRecordStyleChange, SWFShapeRecordStraightEdge, \
+    SWFShapeRecordCurvedEdge, SWFShapeRecordEnd, SWFFillStyle, SWFLineStyle, SWFLineStyle2, SWFMorphLineStyle2, \
+    SWFGradient, SWFGradientRecord, SWFMatrix
+from .tag import TagDefineMorphShape, TagDefineMorphShape2, TagPlaceObject, SWFTimelineContainer
+from .timeline import DisplayList
+import numpy as np
+
+MAX_RATIO = 65535
+
+MOVE = 0
+STRAIGHT = 1
+CURVED = 2
+
+MATRIX_FIELDS = ("scaleX", "scaleY", "rotateSkew0", "rotateSkew1", "translateX", "translateY")
+
+class MorphFrame(object):
+    """
+    A morph shape at one ratio. It has the name, characterId and shapes of
+    a DefineShape tag, so it can be handed to anything that imports shapes.
+    """
+    def __init__(self, tag, ratio, morph):
+        self.name = tag.name
+        self.characterId = tag.characterId
+        self.ratio = ratio
+        self.morph = morph
+        self._shapes = None
+
+    @property
+    def shapes(self):
+        """ The SWFShapeWithStyle at this ratio, built the first time it's asked for """
+        if self._shapes is None:
+            self._shapes = self.morph.shape_at(self.ratio)
+        return self._shapes
+
+    def export(self, handler):
+        """ Export the shape at this ratio to a shape exporter (see MorphShape.export) """
+        return self.morph.export(handler, self.ratio)
+
+class MorphShape(object):
+    """
+    The start and end states of a morph shape, paired up into arrays.
+
+    @param tag  The TagDefineMorphShape or TagDefineMorphShape2.
+    """
+    def __init__(self, tag):
+        self.tag = tag
+        self.level = 4 if isinstance(tag, TagDefineMorphShape2) else 3
+        self._pair_records(tag.startEdges.records, tag.endEdges.records)
+        self._style_start = []
+        self._style_end = []
+        self._fill_styles = [self._add_fill_style(style) for style in tag.morph_fill_styles]
+        self._line_styles = [self._add_line_style(style) for style in tag.morph_line_styles]
+        self._style_start = np.array(self._style_start, dtype=np.float64)
+        self._style_end = np.array(self._style_end, dtype=np.float64)
+        self._paths = None
+
+    def points_at(self, ratio):
+        """
+        Return the absolute start, control and end point of every row at a
+        PlaceObject ratio, in twips, as an array of (x0, y0, cx, cy, x1, y1)
+        rows. Rows of style changes start and end at the pen.
+        """
+        values = _lerp(self._start, self._end, ratio)
+        is_edge = (self._kind_array != MOVE)[:, None]
+        steps = np.where(is_edge, values[:, 0:2] + values[:, 2:4], 0.0)
+        totals = np.cumsum(steps, axis=0)
+        # Moves put the pen where they say, later rows go on from there
+        move_rows = np.flatnonzero(self._move_array)
+        last_move = np.cumsum(self._move_array) - 1
+        ends = totals.copy()
+        moved = last_move >= 0
+        ends[moved] += (values[move_rows, 0:2] - totals[move_rows])[last_move[moved]]
+        starts = np.vstack(([[0.0, 0.0]], ends))[:-1]
+        controls = starts + np.where(is_edge, values[:, 0:2], 0.0)
+        return np.hstack((starts, controls, ends))
+
+    def edges_at(self, ratio):
+        """
+        Return the edges at a PlaceObject ratio as arrays: rows of points like
+        points_at(), whether every edge is curved, and rows of the indices of
+        its fill0, fill1 and line style in the lists of styles_at(), or -1.
+        """
+        is_edge = self._kind_array != MOVE
+        return (self.points_at(ratio)[is_edge], self._kind_array[is_edge] == CURVED,
+                self._row_styles[is_edge])
+
+    def styles_at(self, ratio):
+        """ Return the fill styles and line styles at a PlaceObject ratio """
+        styles = _lerp(self._style_start, self._style_end, ratio).tolist()
+        return ([make_style(styles) for make_style in self._fill_styles],
+                [make_style(styles) for make_style in self._line_styles])
+
+    def export(self, handler, ratio):
+        """
+        Export the shape at a PlaceObject ratio to a shape exporter.
+
+        Exporters with a draw_path() get the paths of the start shape with the
+        coordinates of this ratio, others the SWFShapeWithStyle of shape_at().
+        """
+        if not hasattr(handler, "draw_path"):
+            return self.shape_at(ratio).export(handler)
+        shape = SWFShapeWithStyle(None, self.level, 20.0)
+        fill_styles, line_styles = self.styles_at(ratio)
+        shape._initialFillStyles.extend(fill_styles)
+        shape._initialLineStyles.extend(line_styles)
+        coords = self.points_at(ratio).ravel() * (1.0 / shape.unit_divisor)
+        handler.begin_shape()
+        for fills, lines in self._get_paths():
+            if len(fills):
+                handler.begin_fills()
+                for style_idx, commands, index in fills:
+                    shape._begin_fill_style(handler, style_idx)
+                    handler.draw_path(commands, coords[index])
+                handler.end_fill()
+                handler.end_fills()
+            if len(lines):
+                handler.begin_lines()
+                for style_idx, commands, index in lines:
+                    shape._begin_line_style(handler, style_idx)
+                    handler.draw_path(commands, coords[index])
+                handler.end_lines()
+        handler.end_shape()
+        return handler
+
+    def shape_at(self, ratio):
+        """ Return the SWFShapeWithStyle at a PlaceObject ratio (0 to 65535) """
+        values = _lerp(self._start, self._end, ratio).tolist()
+        shape = SWFShapeWithStyle(None, self.level, 20.0)
+        fill_styles, line_styles = self.styles_at(ratio)
+        shape._initialFillStyles.extend(fill_styles)
+        shape._initialLineStyles.extend(line_styles)
+        records = shape.records
+        for kind, style_change, moved, (x0, y0, x1, y1) in zip(self._kinds, self._style_changes, self._moves, values):
+            if kind == MOVE:
+                record = SWFShapeRecordStyleChange(None)
+                if style_change is not None:
+                    record.state_line_style = style_change.state_line_style
+                    record.state_fill_style0 = style_change.state_fill_style0
+                    record.state_fill_style1 = style_change.state_fill_style1
+                    record.line_style = style_change.line_style
+                    record.fill_style0 = style_change.fill_style0
+                    record.fill_style1 = style_change.fill_style1
+                record.state_moveto = moved
+                if moved:
+                    record.move_deltaX = x0
+                    record.move_deltaY = y0
+            elif kind == STRAIGHT:
+                record = SWFShapeRecordStraightEdge(None)
+                record.general_line_flag = True
+                record.vert_line_flag = False
+                record.deltaX = x0 + x1
+                record.deltaY = y0 + y1
+            else:
+                record = SWFShapeRecordCurvedEdge(None)
+                record.control_deltaX = x0
+                record.control_deltaY = y0
+                record.anchor_deltaX = x1
+                record.anchor_deltaY = y1
+            record.record_id = len(records)
+            records.append(record)
+        end = SWFShapeRecordEnd()
+        end.record_id = len(records)
+        records.append(end)
+        return shape
+
+    def _get_paths(self):
+        # Per group of the start shape, the runs of its fill and its line path
+        # as (style index, draw_path() commands, indices of their coordinates
+        # in the points_at() rows). Records and rows have the same index.
+        if self._paths is None:
+            shape = self.shape_at(0)
+            shape._create_edge_maps()
+            points = self.points_at(0)
+            self._paths = [(self._path_runs(shape, points, shape.fill_edge_maps[group], "fill_style_idx"),
+                            self._path_runs(shape, points, shape.line_edge_maps[group], "line_style_idx"))
+                           for group in range(shape.num_groups)]
+        return self._paths
+
+    def _path_runs(self, shape, points, edge_map, style_attr):
+        path = shape._create_path_from_edge_map(edge_map)
+        if len(path) == 0:
+            return []
+        edge_points, curved, run_ends = shape._path_arrays(path, style_attr)
+        rows = np.array([e.record_id for e in path])
+        # Edges can be turned around on their way into the path, those start at their row's end
+        row_points = points[rows]
+        turned = np.hypot(*(edge_points[:, 0:2] - row_points[:, 4:6]).T) < \
+            np.hypot(*(edge_points[:, 0:2] - row_points[:, 0:2]).T)
+        starts = rows * 6 + np.where(turned, 4, 0)
+        ends = rows * 6 + np.where(turned, 0, 4)
+        controls = rows * 6 + 2
+        index = np.column_stack((starts, starts + 1, controls, controls + 1, ends, ends + 1))
+        runs = []
+        start = 0
+        for end in run_ends.tolist():
+            commands, used = shape._path_commands(edge_points[start:end], curved[start:end])
+            runs.append((getattr(path[start], style_attr), commands, index[start:end][used]))
+            start = end
+        return runs
+
+    def _pair_records(self, start_records, end_records):
+        # Walk both edge lists side by side. Style changes only come from the start
+        # list, but either list can move the pen; the other side's pen then stays put.
+        self._kinds = []
+        self._style_changes = []
+        self._moves = [] # whether a style change row moves the pen
+        start = []
+        end = []
+        pens = [[0, 0], [0, 0]]
+        i = j = 0
+        while i < len(start_records) and start_records[i].type != SWFShapeRecord.TYPE_END:
+            s = start_records[i]
+            e = end_records[j] if j < len(end_records) and end_records[j].type != SWFShapeRecord.TYPE_END else None
+            s_style = s if s.type == SWFShapeRecord.TYPE_STYLECHANGE else None
+            e_style = e if e is not None and e.type == SWFShapeRecord.TYPE_STYLECHANGE else None
+            if s_style is not None or e_style is not None:
+                if s_style is not None:
+                    i += 1
+                if e_style is not None:
+                    j += 1
+                for pen, record in zip(pens, (s_style, e_style)):
+                    if record is not None and record.state_moveto:
+                        pen[:] = [record.move_deltaX, record.move_deltaY]
+                moved = any([record is not None and record.state_moveto for record in (s_style, e_style)])
+                self._kinds.append(MOVE)
+                self._style_changes.append(s_style)
+                start.append(pens[0] + [0, 0])
+                end.append(pens[1] + [0, 0])
+                self._moves.append(moved)
+                continue
+            i += 1
+            j += 1
+            if e is None:
+                e = s # the end list ran out; keep the start edge as it is
+            s_values = _edge_values(s)
+            e_values = _edge_values(e)
+            both_straight = s.type == SWFShapeRecord.TYPE_STRAIGHTEDGE and e.type == SWFShapeRecord.TYPE_STRAIGHTEDGE
+            self._kinds.append(STRAIGHT if both_straight else CURVED)
+            self._style_changes.append(None)
+            start.append(s_values)
+            end.append(e_values)
+            self._moves.append(False)
+            for pen, values in zip(pens, (s_values, e_values)):
+                pen[0] += values[0] + values[2]
+                pen[1] += values[1] + values[3]
+        self._start = np.array(start, dtype=np.float64).reshape(-1, 4)
+        self._end = np.array(end, dtype=np.float64).reshape(-1, 4)
+        self._kind_array = np.array(self._kinds, dtype=np.int64)
+        self._move_array = np.array(self._moves, dtype=bool)
+        self._row_styles = self._get_row_styles()
+
+    def _get_row_styles(self):
+        # The fill0, fill1 and line style index of every row, counted from 0, or -1
+        styles = []
+        fill0 = fill1 = line = -1
+        for style_change in self._style_changes:
+            if style_change is not None:
+                if style_change.state_fill_style0:
+                    fill0 = style_change.fill_style0 - 1
+                if style_change.state_fill_style1:
+                    fill1 = style_change.fill_style1 - 1
+                if style_change.state_line_style:
+                    line = style_change.line_style - 1
+            styles.append((fill0, fill1, line))
+        return np.array(styles, dtype=np.int64).reshape(-1, 3)
+
+    def _add_values(self, start, end):
+        # Add style values to the style arrays and return where they went
+        offset = len(self._style_start)
+        self._style_start.extend(start)
+        self._style_end.extend(end)
+        return offset
+
+    def _add_color(self, start, end):
+        return self._add_values(_channels(start), _channels(end))
+
+    def _add_matrix(self, start, end):
+        return self._add_values([getattr(start, field) for field in MATRIX_FIELDS],
+                                [getattr(end, field) for field in MATRIX_FIELDS])
+
+    def _add_fill_style(self, morph_style):
+        # Returns a function that makes the SWFFillStyle from the interpolated style values
+        fill_type = morph_style.type
+        if fill_type == 0x0:
+            color = self._add_color(morph_style.startColor, morph_style.endColor)
+        elif fill_type in SWFFillStyle.GRADIENT:
+            matrix = self._add_matrix(morph_style.startGradientMatrix, morph_style.endGradientMatrix)
+            records = [(self._add_values([record.startRatio], [record.endRatio]),
+                        self._add_color(record.startColor, record.endColor))
+                       for record in morph_style.gradient.records]
+        else:
+            matrix = self._add_matrix(morph_style.startBitmapMatrix, morph_style.endBitmapMatrix)
+
+        def make_style(values):
+            style = SWFFillStyle()
+            style.type = fill_type
+            if fill_type == 0x0:
+                style.rgb = _argb(values, color)
+            elif fill_type in SWFFillStyle.GRADIENT:
+                style.gradient_matrix = _matrix(values, matrix)
+                style.gradient = SWFGradient()
+                style.gradient.spreadmethod = 0
+                style.gradient.interpolation_mode = 0
+                for ratio, color_offset in records:
+                    record = SWFGradientRecord()
+                    record.ratio = int(round(values[ratio]))
+                    record.color = _argb(values, color_offset)
+                    style.gradient.records.append(record)
+            else:
+                style.bitmap_id = morph_style.bitmapId
+                style.bitmap_matrix = _matrix(values, matrix)
+            return style
+        return make_style
+
+    def _add_line_style(self, morph_style):
+        # Returns a function that makes the SWFLineStyle(2) from the interpolated style values
+        width = self._add_values([morph_style.startWidth], [morph_style.endWidth])
+        fill = None
+        color = None
+        if morph_style.hasFillFlag:
+            fill = self._add_fill_style(morph_style.fillType)
+        else:
+            color = self._add_color(morph_style.startColor, morph_style.endColor)
+
+        def make_style(values):
+            if isinstance(morph_style, SWFMorphLineStyle2):
+                style = SWFLineStyle2()
+                style.start_caps_style = morph_style.startCapsStyle
+                style.end_caps_style = morph_style.endCapsStyle
+                style.joint_style = morph_style.jointStyle
+                style.has_fill_flag = morph_style.hasFillFlag
+                style.no_hscale_flag = morph_style.noHScaleFlag
+                style.no_vscale_flag = morph_style.noVScaleFlag
+                style.pixelhinting_flag = morph_style.pixelHintingFlag
+                style.no_close = morph_style.noClose
+                style.miter_limit_factor = morph_style.miterLimitFactor
+            else:
+                style = SWFLineStyle()
+            style.width = values[width]
+            if fill is not None:
+                style.fill_type = fill(values)
+            else:
+                style.color = _argb(values, color)
+            return style
+        return make_style
+
+def _lerp(start, end, ratio):
+    t = min(max(ratio, 0), MAX_RATIO) / float(MAX_RATIO)
+    return start + (end - start) * t
+
+def _edge_values(record):
+    # An edge as (control x, control y, anchor x, anchor y) deltas; straight edges get their midpoint as control
+    if record.type == SWFShapeRecord.TYPE_CURVEDEDGE:
+        return [record.control_deltaX, record.control_deltaY, record.anchor_deltaX, record.anchor_deltaY]
+    dx = record.deltaX / 2.0
+    dy = record.deltaY / 2.0
+    return [dx, dy, dx, dy]
+
+def _channels(color):
+    return [(color >> 24) & 0xff, (color >> 16) & 0xff, (color >> 8) & 0xff, color & 0xff]
+
+def _argb(values, offset):
+    a, r, g, b = [min(max(int(round(v)), 0), 255) for v in values[offset:offset + 4]]
+    return (a << 24) | (r << 16) | (g << 8) | b
+
+def _matrix(values, offset):
+    matrix = SWFMatrix(None)
+    for i, field in enumerate(MATRIX_FIELDS):
+        setattr(matrix, field, values[offset + i])
+    return matrix
+
+class MorphCache(object):
+    """
+    Interpolated morph shapes by (characterId, ratio).
+
+    Morph tags are paired up the first time one of their ratios is asked for.
+    """
+    def __init__(self):
+        self._morphs = {}
+        self._frames = {}
+
+    def get_morph(self, tag):
+        """ Return the MorphShape of a morph tag """
+        morph = self._morphs.get(tag.characterId)
+        if morph is None:
+            morph = self._morphs[tag.characterId] = MorphShape(tag)
+        return morph
+
+    def get_frame(self, tag, ratio):
+        """ Return the MorphFrame of a morph tag at a ratio """
+        key = (tag.characterId, ratio)
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = MorphFrame(tag, ratio, self.get_morph(tag))
+        return frame
+
+    def clear(self):
+        self._morphs = {}
+        self._frames = {}
+
+def collect_morph_ratios(timeline):
+    """
+    Return a dict of morph characterIds to the set of ratios they're shown at,
+    on a SWF's timeline and the timelines of its sprites.
+    """
+    morph_ids = set([tag.characterId for tag in timeline.all_tags_of_type(TagDefineMorphShape)])
+    ratios = dict([(characterId, set()) for characterId in morph_ids])
+    if len(morph_ids) == 0:
+        return ratios
+    timelines = [timeline.tags] + [tag.tags for tag in timeline.all_tags_of_type(SWFTimelineContainer)]
+    for tags in timelines:
+        display_list = DisplayList()
+        for tag in tags:
+            if isinstance(tag, TagPlaceObject) and display_list.place(tag):
+                placement = display_list[tag.depth]
+                if placement.characterId in morph_ids:
+                    ratios[placement.characterId].add(placement.ratio if placement.hasRatio else 0)
+            else:
+                display_list.apply(tag)
+    return ratios
@@ -0,0 +1,113 @@
+"""
+This module exports the frames of a SWF in a pool of processes.
+
+The timeline is split into ranges of frames. Every worker process parses
+the SWF and exports its definitions once (or sets up a Rasterizer, for PNG
+frames), then renders whole ranges, starting each one from the DisplayList
+snapshot it is handed instead of replaying the timeline. Frames come back
+in timeline order.
+"""
+from __future__ import absolute_import
+from .movie import SWF
+from .export import SequenceSVGExporter
+from .raster import Rasterizer, encode_png
+from .timeline import Timeline, DisplayList
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import os
+
+FORMATS = ("svg", "png")
+
+_worker = {}
+
+def _load(source):
+    if isinstance(source, bytes):
+        return SWF(BytesIO(source))
+    with open(source, "rb") as f:
+        return SWF(f)
+
+def _init_worker(source, exporter_class, defs_href, format, scale):
+    swf = _load(source)
+    _worker["swf"] = swf
+    if format == "png":
+        _worker["rasterizer"] = Rasterizer(swf, scale=scale)
+    else:
+        exporter = exporter_class()
+        exporter.begin_sequence(swf)
+        _worker["exporter"] = exporter
+        _worker["defs_href"] = defs_href
+
+def _export_range(task):
+    start, end, display_list, format = task
+    swf = _worker["swf"]
+    frames = []
+    if format == "png":
+        rasterizer = _worker["rasterizer"]
+        for frame, frame_display_list in rasterizer.timeline.frames(start, end, display_list):
+            frames.append((frame, encode_png(rasterizer.render_display_list(frame_display_list, frame))))
+        return frames
+    exporter = _worker["exporter"]
+    for frame, svg in exporter.export_frame_range(swf, start, end, _worker["defs_href"], display_list):
+        frames.append((frame, svg.getvalue()))
+    return frames
+
+def frame_ranges(frame_count, start=0, end=None, chunk_size=16):
+    """ Split [start, end) into (start, end) ranges of at most chunk_size frames """
+    end = frame_count if end is None else min(end, frame_count)
+    return [(i, min(i + chunk_size, end)) for i in range(start, end, chunk_size)]
+
+def export_frames_parallel(source, frames=None, defs_href="defs.svg", format="svg",
+                           max_workers=None, chunk_size=None, exporter_class=SequenceSVGExporter, scale=1.0):
+    """
+    Generator for (frame, data) of every frame, in timeline order.
+
+    @param source         Path to the SWF or its contents as bytes.
+    @param frames         Optional (start, end) range of 0-based frames, end excluded.
+    @param defs_href      URL of the shared defs document (see write_frames_parallel).
+    @param format         Output format of the frames: "svg" documents or "png" images.
+    @param max_workers    Number of processes (defaults to the number of CPUs).
+    @param chunk_size     Frames per task. Defaults to about four tasks per worker.
+    @param exporter_class SequenceSVGExporter or a (picklable) subclass of it.
+    @param scale          Pixels per stage pixel of PNG frames.
+    """
+    if format not in FORMATS:
+        raise Exception("Unsupported frame format: %s" % format)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    start, end = (0, None) if frames is None else frames
+
+    timeline = Timeline(_load(source).tags)
+    end = timeline.frame_count if end is None else min(end, timeline.frame_count)
+    if chunk_size is None:
+        chunk_size = max(1, min(64, (end - start) // (max_workers * 4)))
+
+    # Each task gets the stage at the start of its range, so workers never seek
+    tasks = []
+    for range_start, range_end in frame_ranges(timeline.frame_count, start, end, chunk_size):
+        display_list = timeline.display_list(range_start - 1) if range_start > 0 else DisplayList()
+        tasks.append((range_start, range_end, display_list, format))
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(source, exporter_class, defs_href, format, scale)) as executor:
+        for frames in executor.map(_export_range, tasks):
+            for frame in frames:
+                yield frame
+
+def write_frames_parallel(source, output_dir, name="frame%05d", frames=None, format="svg", **options):
+    """
+    Write every frame to output_dir, plus defs.svg for SVG frames.
+    Returns the number of frames written.
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    if format == "svg":
+        exporter = options.get("exporter_class", SequenceSVGExporter)()
+        exporter.begin_sequence(_load(source))
+        with open(os.path.join(output_dir, "defs.svg"), "wb") as f:
+            f.write(exporter.serialize_defs().getvalue())
+    count = 0
+    for frame, data in export_frames_parallel(source, frames=frames, format=format, **options):
+        with open(os.path.join(output_dir, (name % frame) + "." + format), "wb") as f:
+            f.write(data)
+        count += 1
+    return count
@@ -0,0 +1,612 @@
+"""
+This module renders the frames of a SWF to RGBA arrays with NumPy, for
+previews that don't need Blender or an SVG renderer.
+
+Shapes are compiled once into arrays of flattened edges, each with the
+fill styles on either side of it and its line style. To draw a placement,
+the edges are moved to the stage by its matrix and every sub-scanline
+crossing of every edge becomes one entry of a crossing array. Sorting the
+crossings by fill style, scanline and x, and summing their winding, gives
+the spans inside each fill, whose coverage is added up in one bincount.
+Lines are filled the same way, as a quad around each of their edges.
+
+Run this module to benchmark the rasterizer.
+"""
+from __future__ import absolute_import
+from .consts import GradientSpreadMode
+from .data import SWFShapeRecord, SWFFillStyle
+from .glyphs import GlyphCache, EM_SQUARE_LENGTH
+from .morph import MorphCache
+from .tag import DefinitionTag, TagDefineShape, TagDefineMorphShape, TagDefineSprite, TagDefineText, TagDefineFont
+from .tag import TagDefineBits, TagDefineBitsJPEG2, TagDefineBitsJPEG3, TagDefineBitsLossless
+from .tag import TagJPEGTables, TagSetBackgroundColor
+from .text import layout_text
+from .timeline import Timeline
+from io import BytesIO
+import numpy as np
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+
+NONZERO = "nonzero"
+EVEN_ODD = "evenodd"
+
+SAMPLES = 4 # sub-scanlines per row of pixels
+CURVE_TOLERANCE = 5.0 # furthest a flattened curve may stray from the real one, in twips
+MAX_CURVE_SEGMENTS = 32
+GRADIENT_SQUARE = 16384.0 # half the side of the square gradients are drawn on, in twips
+
+class CompiledShape(object):
+    """
+    The flattened edges of a shape, in twips.
+
+    @ivar x0, y0, x1, y1  Start and end of every edge.
+    @ivar fill0, fill1    Index in fill_styles of the fill on the left and the right of every edge, or -1.
+    @ivar line            Index in line_styles of the line along every edge, or -1.
+    @ivar fill_styles     Every fill style of the shape, including those of new style records.
+    @ivar line_styles     Every line style of the shape.
+    """
+    def __init__(self, edges, fill_styles, line_styles):
+        edges = np.array(edges, dtype=np.float64).reshape(-1, 7)
+        self.x0, self.y0, self.x1, self.y1 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+        self.fill0 = edges[:, 4].astype(np.int64)
+        self.fill1 = edges[:, 5].astype(np.int64)
+        self.line = edges[:, 6].astype(np.int64)
+        self.fill_styles = fill_styles
+        self.line_styles = line_styles
+
+    def __len__(self):
+        return len(self.x0)
+
+def compile_shape(shape, tolerance=CURVE_TOLERANCE):
+    """
+    Return the CompiledShape of a SWFShape or SWFShapeWithStyle.
+
+    @param tolerance  Furthest a flattened curve may stray from the real one, in shape units.
+    """
+    fill_styles = list(getattr(shape, "_initialFillStyles", []))
+    line_styles = list(getattr(shape, "_initialLineStyles", []))
+    fill_base = line_base = 0
+    fill0 = fill1 = line = -1
+    x = y = 0
+    rows = []
+    for record in shape.records:
+        if record.type == SWFShapeRecord.TYPE_STYLECHANGE:
+            if record.state_new_styles:
+                # Style indices after this point count from the new styles
+                fill_base, line_base = len(fill_styles), len(line_styles)
+                fill_styles.extend(record.fill_styles)
+                line_styles.extend(record.line_styles)
+                fill0 = fill1 = line = -1
+            if record.state_fill_style0:
+                fill0 = fill_base + record.fill_style0 - 1 if record.fill_style0 > 0 else -1
+            if record.state_fill_style1:
+                fill1 = fill_base + record.fill_style1 - 1 if record.fill_style1 > 0 else -1
+            if record.state_line_style:
+                line = line_base + record.line_style - 1 if record.line_style > 0 else -1
+            if record.state_moveto:
+                x, y = record.move_deltaX, record.move_deltaY
+        elif record.type == SWFShapeRecord.TYPE_STRAIGHTEDGE:
+            ax, ay = x + record.deltaX, y + record.deltaY
+            rows.append((x, y, ax, ay, ax, ay, False, fill0, fill1, line))
+            x, y = ax, ay
+        elif record.type == SWFShapeRecord.TYPE_CURVEDEDGE:
+            cx, cy = x + record.control_deltaX, y + record.control_deltaY
+            ax, ay = cx + record.anchor_deltaX, cy + record.anchor_deltaY
+            rows.append((x, y, cx, cy, ax, ay, True, fill0, fill1, line))
+            x, y = ax, ay
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 10)
+    return CompiledShape(_flatten(rows[:, 0:6], rows[:, 6] > 0, rows[:, 7:10], tolerance), fill_styles, line_styles)
+
+def compile_morph(morph, ratio, tolerance=CURVE_TOLERANCE):
+    """
+    Return the CompiledShape of a MorphShape at a PlaceObject ratio.
+
+    @param tolerance  Furthest a flattened curve may stray from the real one, in twips.
+    """
+    points, curved, styles = morph.edges_at(ratio)
+    fill_styles, line_styles = morph.styles_at(ratio)
+    return CompiledShape(_flatten(points, curved, styles, tolerance), fill_styles, line_styles)
+
+def _flatten(points, curved, styles, tolerance):
+    # Rows of (x0, y0, cx, cy, x1, y1) points and their styles as (x0, y0, x1, y1,
+    # fill0, fill1, line) edges, with every curve cut into chords
+    x, y, cx, cy, ax, ay = points.T
+    # A quadratic strays from n chords by at most a quarter of |p0 - 2c + p1| / n^2
+    deviation = np.hypot(x - 2 * cx + ax, y - 2 * cy + ay) / 4.0
+    counts = np.where(curved, np.clip(np.ceil(np.sqrt(deviation / tolerance)), 1, MAX_CURVE_SEGMENTS), 1)
+    counts = counts.astype(np.int64)
+    rows = np.repeat(np.arange(len(points)), counts)
+    chords = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = np.stack((chords, chords + 1)) / counts[rows].astype(np.float64)
+    a, b, c = (1 - t) * (1 - t), 2 * t * (1 - t), t * t
+    xs = a * x[rows] + b * cx[rows] + c * ax[rows]
+    ys = a * y[rows] + b * cy[rows] + c * ay[rows]
+    return np.column_stack((xs[0], ys[0], xs[1], ys[1], styles[rows]))
+
+def _to_matrix(swf_matrix):
+    # SWFMatrix as a 3x3 array that maps column vectors
+    if swf_matrix is None:
+        return np.identity(3)
+    a, b, c, d, tx, ty = swf_matrix.to_array()
+    return np.array([[a, c, tx], [b, d, ty], [0.0, 0.0, 1.0]])
+
+def _to_color_transform(cxform):
+    # Color transform as (multiply, add) arrays of RGBA, for colors from 0 to 1
+    mult = np.ones(4)
+    add = np.zeros(4)
+    if cxform is None:
+        return mult, add
+    if cxform.hasMultTerms:
+        mult[:3] = (cxform.rMult / 256.0, cxform.gMult / 256.0, cxform.bMult / 256.0)
+        mult[3] = getattr(cxform, "aMult", 256) / 256.0
+    if cxform.hasAddTerms:
+        add[:3] = (cxform.rAdd / 255.0, cxform.gAdd / 255.0, cxform.bAdd / 255.0)
+        add[3] = getattr(cxform, "aAdd", 0) / 255.0
+    return mult, add
+
+def _argb_to_rgba(colors):
+    # ARGB integers as RGBA floats from 0 to 1, on the last axis
+    colors = np.asarray(colors, dtype=np.uint32)
+    channels = np.stack([colors >> 16, colors >> 8, colors, colors >> 24], axis=-1) & 0xff
+    return channels.astype(np.float32) / 255.0
+
+def _transform_colors(rgba, color_transform):
+    # Apply a color transform to straight RGBA and premultiply the result
+    mult, add = color_transform
+    rgba = np.clip(rgba * mult.astype(np.float32) + add.astype(np.float32), 0.0, 1.0)
+    rgba[..., :3] *= rgba[..., 3:4]
+    return rgba
+
+def _solid_fill_style(color):
+    style = SWFFillStyle()
+    style.type = 0x0
+    style.rgb = color
+    return style
+
+def _crossings(x0, y0, x1, y1, styles, windings, scanlines, samples):
+    # Every crossing of an edge with the center of a sub-scanline, as (style, scanline, x, winding)
+    sy0, sy1 = y0 * samples, y1 * samples
+    first = np.clip(np.ceil(np.minimum(sy0, sy1) - 0.5), 0, scanlines).astype(np.int64)
+    last = np.clip(np.ceil(np.maximum(sy0, sy1) - 0.5), 0, scanlines).astype(np.int64)
+    counts = last - first
+    edges = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    scanline = first[edges] + np.arange(len(edges)) - starts[edges]
+    # Edges with crossings aren't horizontal, so the division is safe
+    sy0, sy1 = sy0[edges], sy1[edges]
+    x = x0[edges] + (scanline + 0.5 - sy0) * (x1[edges] - x0[edges]) / (sy1 - sy0)
+    winding = np.where(sy1 > sy0, 1, -1) * windings[edges]
+    return styles[edges], scanline, x, winding
+
+def _spans(styles, scanline, x, winding, scanlines, width, even_odd):
+    # Sort crossings along each scanline of each style and keep the stretches between them that are inside
+    key = styles * scanlines + scanline
+    # One float sort key is much faster than a lexsort. Crossings off the sides of the
+    # canvas are clamped to just past them, which keeps their order where it matters.
+    x = np.clip(x, -1.0, width + 1.0)
+    order = np.argsort(key * (width + 3.0) + (x + 1.0))
+    key, x, winding = key[order], x[order], winding[order]
+    if even_odd:
+        winding = np.ones_like(winding)
+    total = np.cumsum(winding)
+    group_starts = np.maximum.accumulate(np.where(np.r_[True, key[1:] != key[:-1]], np.arange(len(key)), 0))
+    winding = total - (total - winding)[group_starts]
+    inside = (winding % 2 == 1) if even_odd else (winding != 0)
+    span = inside[:-1] & (key[1:] == key[:-1])
+    key = key[:-1][span]
+    return key // scanlines, key % scanlines, x[:-1][span], x[1:][span]
+
+def _coverage(scanline, left, right, width, samples):
+    # Coverage of a style's spans over the box around them, as (coverage, top row, left column)
+    rows = scanline // samples
+    top = int(rows[0]) # spans come sorted by scanline
+    height = int(rows[-1]) - top + 1
+    left = np.clip(left, 0, width)
+    right = np.clip(right, 0, width)
+    first = min(int(np.floor(left.min())), width - 1)
+    columns = max(min(int(np.ceil(right.max())) + 1, width) - first, 1)
+    stride = columns + 2
+    # Each span end adds its area to the pixel it falls in and the pixel after it;
+    # a running sum along every row then fills in the pixels between the ends
+    indices = []
+    weights = []
+    for ends, sign in ((left, 1.0), (right, -1.0)):
+        ends = ends - first
+        column = np.floor(ends)
+        fraction = ends - column
+        index = (rows - top) * stride + column.astype(np.int64)
+        indices.extend((index, index + 1))
+        weights.extend((sign * (1.0 - fraction), sign * fraction))
+    cells = np.bincount(np.concatenate(indices), np.concatenate(weights), minlength=height * stride)
+    cells = cells[:height * stride].reshape(height, stride).astype(np.float32) * np.float32(1.0 / samples)
+    coverage = np.cumsum(cells, axis=1)[:, :columns]
+    return np.clip(coverage, 0.0, 1.0, out=coverage), top, first
+
+def rasterize_edges(x0, y0, x1, y1, styles, windings, width, height, samples=SAMPLES, even_odd=False):
+    """
+    Generator for (style, coverage, top row, left column) of every style a set of edges fills,
+    in style order. coverage is a float32 array of the box around the style's pixels.
+
+    @param x0, y0, x1, y1  Start and end of every edge, in pixels.
+    @param styles          Style of every edge: an index, from 0.
+    @param windings        1 for edges with their style on the right, -1 for edges with it on the left.
+    """
+    scanlines = height * samples
+    crossings = _crossings(x0, y0, x1, y1, styles, windings, scanlines, samples)
+    if len(crossings[0]) == 0:
+        return
+    span_styles, scanline, left, right = _spans(*crossings, scanlines=scanlines, width=width, even_odd=even_odd)
+    if len(span_styles) == 0:
+        return
+    # Spans are sorted by style, so each style's are one slice
+    boundaries = np.flatnonzero(np.diff(span_styles)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(span_styles)]])
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        coverage, top, first = _coverage(scanline[start:end], left[start:end], right[start:end], width, samples)
+        yield int(span_styles[start]), coverage, top, first
+
+def _composite(canvas, paint, coverage, top, first):
+    # Draw premultiplied paint, of shape (4, 1, 1) or (4, rows, columns), over a box of a canvas
+    rows, columns = coverage.shape
+    region = canvas[:, top:top + rows, first:first + columns]
+    region *= 1.0 - coverage * paint[3]
+    region += coverage * paint
+
+class Rasterizer(object):
+    """
+    Renders frames of a SWF to RGBA arrays.
+
+    Compiled shapes, decoded bitmaps and sprite timelines are kept between
+    frames, so rendering a sequence only pays for them once.
+
+    @param swf         The SWF.
+    @param scale       Pixels per stage pixel.
+    @param samples     Sub-scanlines per row of pixels, for vertical anti-aliasing.
+    @param fill_rule   NONZERO (as Flash fills shapes) or EVEN_ODD, for fills; lines are always NONZERO.
+    @param background  ARGB color behind the stage. Defaults to the SWF's SetBackgroundColor,
+                       or transparent when it has none.
+    """
+    def __init__(self, swf, scale=1.0, samples=SAMPLES, fill_rule=NONZERO, background=None):
+        if fill_rule not in (NONZERO, EVEN_ODD):
+            raise Exception("Unknown fill rule: %s" % fill_rule)
+        self.swf = swf
+        self.scale = scale
+        self.samples = samples
+        self.even_odd = fill_rule == EVEN_ODD
+        self.timeline = Timeline(swf.tags)
+        self.characters = {}
+        self.jpeg_tables = None
+        self.background = background
+        for tag in swf.tags:
+            if isinstance(tag, TagJPEGTables):
+                if tag.length > 0:
+                    self.jpeg_tables = tag.jpegTables
+            elif isinstance(tag, TagSetBackgroundColor):
+                if self.background is None:
+                    self.background = tag.color
+            elif isinstance(tag, (DefinitionTag, TagDefineSprite)):
+                self.characters[tag.characterId] = tag
+
+        frame_size = swf.header.frame_size
+        self.width = max(int(np.ceil((frame_size.xmax - frame_size.xmin) / 20.0 * scale)), 1)
+        self.height = max(int(np.ceil((frame_size.ymax - frame_size.ymin) / 20.0 * scale)), 1)
+        pixels = scale / 20.0
+        self.stage_matrix = np.array([
+            [pixels, 0.0, -frame_size.xmin * pixels],
+            [0.0, pixels, -frame_size.ymin * pixels],
+            [0.0, 0.0, 1.0]])
+
+        self.morph_cache = MorphCache()
+        self.glyph_cache = GlyphCache()
+        self._shapes = {}
+        self._bitmaps = {}
+        self._sprite_timelines = {}
+        self._sprite_display_lists = {}
+
+    def render(self, frame=0):
+        """ Return a frame as a (height, width, 4) uint8 RGBA array """
+        return self.render_display_list(self.timeline.display_list(frame), frame)
+
+    def render_display_list(self, display_list, frame=None):
+        """
+        Return the stage of a DisplayList as a (height, width, 4) uint8 RGBA array.
+
+        @param frame  The frame of the SWF's timeline the display list is at. Sprites
+                      play (and loop) from the frame they were placed in, so without
+                      it they all show their first frame.
+        """
+        # The canvas is premultiplied RGBA with a plane per channel, which composites
+        # several times faster than interleaved channels
+        canvas = np.zeros((4, self.height, self.width), dtype=np.float32)
+        if self.background is not None:
+            canvas[:] = _transform_colors(_argb_to_rgba(self.background), _to_color_transform(None)).reshape(4, 1, 1)
+        self._draw_placements(canvas, display_list.get_display_tags(), self.stage_matrix, _to_color_transform(None),
+                              self.timeline if frame is not None else None, frame, frame)
+        # Back to straight alpha
+        alpha = canvas[3]
+        canvas[:3] /= np.where(alpha > 0, alpha, 1.0)
+        return np.ascontiguousarray(np.round(np.clip(canvas, 0.0, 1.0) * 255).astype(np.uint8).transpose(1, 2, 0))
+
+    def _draw_placements(self, canvas, placements, matrix, color_transform, timeline=None, frame=None, age=None):
+        # Placements come sorted by depth; a clip layer draws everything up to its clipDepth
+        # on a layer of its own, which goes on the canvas through the clip's coverage.
+        # timeline and frame are where the placements come from, and age is the number of
+        # frames the timeline has played, loops included, for the age of sprites.
+        clips = []
+        for placement in placements:
+            while len(clips) and placement.depth > clips[-1][0]:
+                canvas = self._end_clip(canvas, clips.pop())
+            placed = timeline.placement_frame(placement.depth, frame) if timeline is not None else None
+            if placed is None:
+                character_age = 0
+            elif timeline.keeps_placement(placement.depth):
+                character_age = age
+            else:
+                character_age = frame - placed
+            placement_matrix = matrix.dot(_to_matrix(placement.matrix if placement.hasMatrix else None))
+            placement_color = self._compose_color_transforms(color_transform,
+                _to_color_transform(placement.colorTransform if placement.hasColorTransform else None))
+            if placement.hasClipDepth:
+                mask = np.zeros_like(canvas)
+                self._draw_character(mask, placement, placement_matrix, _to_color_transform(None), character_age)
+                clips.append((placement.clipDepth, mask[3:4].copy(), canvas))
+                canvas = np.zeros_like(canvas)
+            else:
+                self._draw_character(canvas, placement, placement_matrix, placement_color, character_age)
+        while len(clips):
+            canvas = self._end_clip(canvas, clips.pop())
+        return canvas
+
+    def _end_clip(self, layer, clip):
+        clip_depth, mask, canvas = clip
+        layer *= mask
+        canvas *= 1.0 - layer[3:4]
+        canvas += layer
+        return canvas
+
+    def _compose_color_transforms(self, outer, inner):
+        return outer[0] * inner[0], outer[0] * inner[1] + outer[1]
+
+    def _draw_character(self, canvas, placement, matrix, color_transform, age=0):
+        # age is the number of frames since the character was placed
+        tag = self.characters.get(placement.characterId)
+        if isinstance(tag, TagDefineShape):
+            self._draw_shape(canvas, self._get_shape(tag), matrix, color_transform)
+        elif isinstance(tag, TagDefineMorphShape):
+            ratio = placement.ratio if placement.hasRatio else 0
+            self._draw_shape(canvas, self._get_shape(tag, ratio), matrix, color_transform)
+        elif isinstance(tag, TagDefineText):
+            self._draw_shape(canvas, self._get_text(tag), matrix, color_transform)
+        elif isinstance(tag, TagDefineSprite):
+            # Sprites loop from the frame they were placed in; actions that stop them aren't run
+            timeline = self._sprite_timelines.get(tag.characterId)
+            if timeline is None:
+                timeline = self._sprite_timelines[tag.characterId] = Timeline(tag.tags)
+            frame = age % timeline.frame_count if timeline.frame_count > 0 else 0
+            display_list = self._sprite_display_lists.get((tag.characterId, frame))
+            if display_list is None:
+                display_list = self._sprite_display_lists[(tag.characterId, frame)] = timeline.display_list(frame)
+            self._draw_placements(canvas, display_list.get_display_tags(), matrix, color_transform, timeline, frame, age)
+
+    def _get_shape(self, tag, ratio=None):
+        key = (tag.characterId, ratio)
+        shape = self._shapes.get(key)
+        if shape is None:
+            if ratio is None:
+                shape = compile_shape(tag.shapes)
+            else:
+                shape = compile_morph(self.morph_cache.get_morph(tag), ratio)
+            self._shapes[key] = shape
+        return shape
+
+    def _get_text(self, tag):
+        # Static text as a shape with a solid fill style per text color
+        key = (tag.characterId, None)
+        shape = self._shapes.get(key)
+        if shape is not None:
+            return shape
+        layout = layout_text(tag)
+        text_matrix = _to_matrix(tag.textMatrix)
+        colors = []
+        edges = []
+        for i in range(len(layout)):
+            font = self.characters.get(int(layout.font_ids[i]))
+            if not isinstance(font, TagDefineFont) or layout.glyph_indices[i] >= len(font.glyphShapeTable):
+                continue
+            color = int(layout.colors[i])
+            if color not in colors:
+                colors.append(color)
+            style = colors.index(color)
+            scale = layout.heights[i] / EM_SQUARE_LENGTH
+            for contour in self.glyph_cache.get_outline(font, int(layout.glyph_indices[i])).contours:
+                points = np.array(contour) * scale + (layout.x[i], layout.y[i])
+                points = points.dot(text_matrix[:2, :2].T) + text_matrix[:2, 2]
+                ends = np.roll(points, -1, axis=0)
+                for (x0, y0), (x1, y1) in zip(points.tolist(), ends.tolist()):
+                    edges.append((x0, y0, x1, y1, -1, style, -1))
+        shape = self._shapes[key] = CompiledShape(edges, [_solid_fill_style(color) for color in colors], [])
+        return shape
+
+    def _draw_shape(self, canvas, shape, matrix, color_transform):
+        if len(shape) == 0:
+            return
+        x0 = matrix[0, 0] * shape.x0 + matrix[0, 1] * shape.y0 + matrix[0, 2]
+        y0 = matrix[1, 0] * shape.x0 + matrix[1, 1] * shape.y0 + matrix[1, 2]
+        x1 = matrix[0, 0] * shape.x1 + matrix[0, 1] * shape.y1 + matrix[0, 2]
+        y1 = matrix[1, 0] * shape.x1 + matrix[1, 1] * shape.y1 + matrix[1, 2]
+
+        # Fills: an edge counts towards the fill on its right and, reversed, the fill
+        # on its left. Edges with the same fill on both sides cancel out and are dropped.
+        right = (shape.fill1 >= 0) & (shape.fill1 != shape.fill0)
+        left = (shape.fill0 >= 0) & (shape.fill1 != shape.fill0)
+        if right.any() or left.any():
+            self._fill(canvas, shape.fill_styles, matrix, color_transform,
+                np.concatenate([x0[right], x0[left]]), np.concatenate([y0[right], y0[left]]),
+                np.concatenate([x1[right], x1[left]]), np.concatenate([y1[right], y1[left]]),
+                np.concatenate([shape.fill1[right], shape.fill0[left]]),
+                np.concatenate([np.ones(right.sum(), dtype=np.int64), -np.ones(left.sum(), dtype=np.int64)]),
+                self.even_odd)
+
+        # Lines: a quad around every edge, all wound the same way and filled nonzero
+        # whatever the fill rule, so where quads overlap (at every joint) they don't cancel
+        lined = shape.line >= 0
+        if lined.any():
+            x0, y0, x1, y1, styles = x0[lined], y0[lined], x1[lined], y1[lined], shape.line[lined]
+            line_scale = np.sqrt(abs(np.linalg.det(matrix[:2, :2])))
+            widths = np.array([style.width for style in shape.line_styles], dtype=np.float64)[styles]
+            half = np.maximum(widths * line_scale, 1.0) / 2.0
+            dx, dy = x1 - x0, y1 - y0
+            length = np.hypot(dx, dy)
+            keep = length > 0
+            ux, uy = dx[keep] / length[keep] * half[keep], dy[keep] / length[keep] * half[keep]
+            x0, y0, x1, y1, styles = x0[keep] - ux, y0[keep] - uy, x1[keep] + ux, y1[keep] + uy, styles[keep]
+            corners_x = [x0 - uy, x1 - uy, x1 + uy, x0 + uy]
+            corners_y = [y0 + ux, y1 + ux, y1 - ux, y0 - ux]
+            line_styles = [style.fill_type if style.has_fill_flag and style.fill_type is not None else _solid_fill_style(style.color)
+                for style in shape.line_styles]
+            self._fill(canvas, line_styles, matrix, color_transform,
+                np.concatenate(corners_x), np.concatenate(corners_y),
+                np.concatenate(corners_x[1:] + corners_x[:1]), np.concatenate(corners_y[1:] + corners_y[:1]),
+                np.tile(styles, 4), np.ones(len(styles) * 4, dtype=np.int64), False)
+
+    def _fill(self, canvas, styles, matrix, color_transform, x0, y0, x1, y1, style_indices, windings, even_odd):
+        height, width = canvas.shape[1:]
+        for style, coverage, top, first in rasterize_edges(x0, y0, x1, y1, style_indices, windings,
+                                                           width, height, self.samples, even_odd):
+            rows, columns = coverage.shape
+            paint = self._paint(styles[style], matrix, color_transform, top, first, rows, columns)
+            if paint is not None:
+                _composite(canvas, paint, coverage, top, first)
+
+    def _pixel_coordinates(self, matrix, top, first, rows, columns):
+        # Centers of the pixels of a box, mapped back through a matrix
+        inverse = np.linalg.inv(matrix)
+        xs = np.arange(first, first + columns, dtype=np.float64) + 0.5
+        ys = np.arange(top, top + rows, dtype=np.float64) + 0.5
+        u = inverse[0, 0] * xs[None, :] + inverse[0, 1] * ys[:, None] + inverse[0, 2]
+        v = inverse[1, 0] * xs[None, :] + inverse[1, 1] * ys[:, None] + inverse[1, 2]
+        return u, v
+
+    def _paint(self, style, matrix, color_transform, top, first, rows, columns):
+        # Premultiplied RGBA planes of a fill style over a box: (4, 1, 1) for one color, else (4, rows, columns)
+        if style.type in SWFFillStyle.COLOR:
+            return _transform_colors(_argb_to_rgba(style.rgb), color_transform).reshape(4, 1, 1)
+        elif style.type in SWFFillStyle.GRADIENT:
+            try:
+                u, v = self._pixel_coordinates(matrix.dot(_to_matrix(style.gradient_matrix)), top, first, rows, columns)
+            except np.linalg.LinAlgError:
+                return None
+            if style.type == 0x10:
+                t = (u + GRADIENT_SQUARE) / (2 * GRADIENT_SQUARE)
+            else:
+                t = np.hypot(u, v) / GRADIENT_SQUARE # focal gradients are drawn as plain radial ones
+            spread = style.gradient.spreadmethod
+            if spread == GradientSpreadMode.REFLECT:
+                t = 1.0 - np.abs(np.mod(t, 2.0) - 1.0)
+            elif spread == GradientSpreadMode.REPEAT:
+                t = np.mod(t, 1.0)
+            lut = _transform_colors(self._gradient_colors(style.gradient), color_transform)
+            return np.moveaxis(lut[np.clip(np.round(t * 255), 0, 255).astype(np.int64)], -1, 0)
+        elif style.type in SWFFillStyle.BITMAP:
+            bitmap = self._get_bitmap(style.bitmap_id)
+            if bitmap is None:
+                return None
+            try:
+                u, v = self._pixel_coordinates(matrix.dot(_to_matrix(style.bitmap_matrix)), top, first, rows, columns)
+            except np.linalg.LinAlgError:
+                return None
+            bitmap_height, bitmap_width = bitmap.shape[:2]
+            u, v = np.floor(u).astype(np.int64), np.floor(v).astype(np.int64)
+            if style.type in (0x40, 0x42):
+                u, v = np.mod(u, bitmap_width), np.mod(v, bitmap_height)
+            else:
+                u, v = np.clip(u, 0, bitmap_width - 1), np.clip(v, 0, bitmap_height - 1)
+            return np.moveaxis(_transform_colors(bitmap[v, u], color_transform), -1, 0)
+        return None
+
+    def _gradient_colors(self, gradient):
+        # 256 straight RGBA colors along a gradient
+        ratios = np.array([record.ratio for record in gradient.records], dtype=np.float64)
+        colors = _argb_to_rgba([record.color for record in gradient.records])
+        if len(ratios) == 0:
+            return np.zeros((256, 4), dtype=np.float32)
+        steps = np.arange(256, dtype=np.float64)
+        return np.stack([np.interp(steps, ratios, colors[:, i]) for i in range(4)], axis=-1).astype(np.float32)
+
+    def _get_bitmap(self, character_id):
+        # Straight RGBA of a bitmap character, or None if it can't be decoded
+        if character_id in self._bitmaps:
+            return self._bitmaps[character_id]
+        tag = self.characters.get(character_id)
+        bitmap = None
+        try:
+            image = self._decode_bitmap(tag)
+            if image is not None:
+                bitmap = np.asarray(image.convert("RGBA"), dtype=np.float32) / 255.0
+        except (IOError, ValueError):
+            bitmap = None
+        self._bitmaps[character_id] = bitmap
+        return bitmap
+
+    def _decode_bitmap(self, tag):
+        if isinstance(tag, TagDefineBitsJPEG3):
+            tag.bitmapData.seek(0)
+            image = Image.open(tag.bitmapData).convert("RGBA")
+            alpha = tag.bitmapAlphaData.getvalue()
+            if len(alpha) == image.size[0] * image.size[1]:
+                image.putalpha(Image.frombytes("L", image.size, alpha))
+            return image
+        elif isinstance(tag, TagDefineBitsJPEG2):
+            tag.bitmapData.seek(0)
+            return Image.open(tag.bitmapData)
+        elif isinstance(tag, TagDefineBits):
+            tag.bitmapData.seek(0)
+            if self.jpeg_tables is None:
+                return Image.open(tag.bitmapData)
+            self.jpeg_tables.seek(0)
+            return Image.open(BytesIO(self.jpeg_tables.read() + tag.bitmapData.read()))
+        elif isinstance(tag, TagDefineBitsLossless):
+            tag.bitmapData.seek(0)
+            return Image.open(tag.bitmapData)
+        return None
+
+def render_frame(swf, frame=0, **options):
+    """ Return a frame of a SWF as a (height, width, 4) uint8 RGBA array. See Rasterizer for the options. """
+    return Rasterizer(swf, **options).render(frame)
+
+def encode_png(image):
+    """ Return an RGBA array as PNG bytes """
+    data = BytesIO()
+    Image.fromarray(image, "RGBA").save(data, "PNG")
+    return data.getvalue()
+
+if __name__ == "__main__":
+    import time
+    # A 550x400 stage of overlapping curved stars, like a busy frame of a cartoon
+    state = np.random.RandomState(0)
+    stars = []
+    for i in range(200):
+        cx, cy = state.uniform(0, 11000), state.uniform(0, 8000)
+        radius = state.uniform(200, 2000)
+        angles = np.linspace(0, 2 * np.pi, 41)[:-1]
+        radii = np.where(np.arange(40) % 2 == 0, radius, radius * 0.5)
+        xs, ys = cx + radii * np.cos(angles), cy + radii * np.sin(angles)
+        stars.append((xs, ys, np.roll(xs, -1), np.roll(ys, -1)))
+    x0, y0, x1, y1 = [np.concatenate(values) / 20.0 for values in zip(*stars)]
+    styles = np.repeat(np.arange(len(stars)), 40)
+    windings = np.ones(len(x0), dtype=np.int64)
+
+    colors = [_transform_colors(_argb_to_rgba(0x80000000 | int(state.randint(0, 0xffffff))),
+        _to_color_transform(None)).reshape(4, 1, 1) for i in range(len(stars))]
+    repeats = 50
+    start = time.time()
+    for i in range(repeats):
+        canvas = np.zeros((4, 400, 550), dtype=np.float32)
+        for style, coverage, top, first in rasterize_edges(x0, y0, x1, y1, styles, windings, 550, 400):
+            _composite(canvas, colors[style], coverage, top, first)
+    elapsed = time.time() - start
+    print("Filled %d shapes of %d edges on a 550x400 stage in %.1fms per frame" % (
+        len(stars), len(x0), elapsed * 1000 / repeats))
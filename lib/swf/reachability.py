@@ -0,0 +1,101 @@
+"""
+This module finds the characters a SWF timeline can actually display.
+
+A definition tag is live when a PlaceObject tag references it, either
+directly or through the sprites, buttons, fonts and bitmap fills that
+it depends on. Everything else is dead and can be skipped by importers
+and exporters.
+"""
+from __future__ import absolute_import
+from .tag import DefinitionTag, DisplayListTag, SWFTimelineContainer, TagDefineShape
+
+class SWFReachability(object):
+    """
+    Result of a reachability pass over a timeline.
+
+    @param definitions  dict of characterIds to lists of their defining tags
+    @param live         set of characterIds reachable from the display list
+    """
+    def __init__(self, definitions, live):
+        self.definitions = definitions
+        self.live = live
+
+    @property
+    def dead(self):
+        """ Return the set of defined characterIds that are never displayed """
+        return set(self.definitions.keys()) - self.live
+
+    def is_live(self, tag):
+        """ Whether the tag needs processing. Only definition tags can be dead """
+        if not isinstance(tag, DefinitionTag) or tag.characterId < 0:
+            return True
+        return tag.characterId in self.live
+
+    def dead_tags(self):
+        """ Generator for all the definition tags that can be skipped """
+        for characterId in sorted(self.dead):
+            for tag in self.definitions[characterId]:
+                yield tag
+
+    def dead_counts(self):
+        """ Return a dict of tag names to the number of dead tags of that type """
+        counts = {}
+        for tag in self.dead_tags():
+            counts[tag.name] = counts.get(tag.name, 0) + 1
+        return counts
+
+    @property
+    def dead_shape_records(self):
+        """ Return the number of shape records that no longer need edge maps """
+        return sum(len(tag.shapes.records) for tag in self.dead_tags() if isinstance(tag, TagDefineShape))
+
+    def __str__(self):
+        s = "%d of %d characters live" % (len(self.live), len(self.definitions))
+        counts = self.dead_counts()
+        if len(counts):
+            s += ", skipping " + ", ".join(["%d %s" % (counts[name], name) for name in sorted(counts)])
+            s += " (%d shape records)" % self.dead_shape_records
+        return s
+
+def find_live_characters(timeline):
+    """
+    Run a reachability pass over a SWF (or any other timeline container).
+
+    Starts from the characters placed on the root timeline and follows
+    get_dependencies() of their definitions, including everything placed
+    on the timelines of live sprites.
+
+    @param timeline  the SWF
+    @return          a SWFReachability
+    """
+    definitions = {}
+    _collect_definitions(timeline.tags, definitions)
+
+    live = set()
+    ids_to_visit = _display_list_dependencies(timeline.tags)
+    while len(ids_to_visit):
+        characterId = ids_to_visit.pop()
+        if characterId in live or characterId not in definitions:
+            continue
+        live.add(characterId)
+        for tag in definitions[characterId]:
+            ids_to_visit.update(tag.get_dependencies())
+            if isinstance(tag, SWFTimelineContainer):
+                ids_to_visit.update(_display_list_dependencies(tag.tags))
+    return SWFReachability(definitions, live)
+
+def _collect_definitions(tags, definitions):
+    # Font info and other tags share the characterId of what they describe, so keep a list per id
+    for tag in tags:
+        if isinstance(tag, DefinitionTag) and tag.characterId >= 0:
+            definitions.setdefault(tag.characterId, []).append(tag)
+        if isinstance(tag, SWFTimelineContainer):
+            _collect_definitions(tag.tags, definitions)
+
+def _display_list_dependencies(tags):
+    s = set()
+    for tag in tags:
+        if isinstance(tag, DisplayListTag):
+            s.update(tag.get_dependencies())
+    s.discard(-1)
+    return s
@@ -3,12 +3,23 @@ from . import consts
 from . import tag
 import wave
 from . import stream
+import os
+import tempfile
+from array import array
+from bisect import bisect_right
+try:
+    from . import adpcm
+except ImportError:
+    # ADPCM needs NumPy
+    adpcm = None
 
 supportedCodecs = (
     consts.AudioCodec.MP3,
     consts.AudioCodec.UncompressedNativeEndian,
     consts.AudioCodec.UncompressedLittleEndian,
 )
+if adpcm is not None:
+    supportedCodecs += (consts.AudioCodec.ADPCM,)
 
 uncompressed = (
     consts.AudioCodec.UncompressedNativeEndian,
@@ -49,29 +60,187 @@ def get_wave_for_header(header, output):
     w = wave.open(output, 'w')
     w.setframerate(consts.AudioSampleRate.Rates[header.soundRate])
     w.setnchannels(consts.AudioChannels.Channels[header.soundChannels])
-    w.setsampwidth(consts.AudioSampleSize.Bits[header.soundSampleSize] / 8)
+    if header.soundFormat == consts.AudioCodec.ADPCM:
+        # ADPCM always decodes to 16 bit samples
+        w.setsampwidth(2)
+    else:
+        w.setsampwidth(consts.AudioSampleSize.Bits[header.soundSampleSize] // 8)
     return w
+
+def decode_adpcm(header, data):
+    """ Decode ADPCM data to little endian 16 bit PCM """
+    channels = consts.AudioChannels.Channels[header.soundChannels]
+    return adpcm.decode(data, channels).astype('<i2').tobytes()
     
+class StreamIndex(object):
+    """
+    Where the audio of every SWF frame starts in an extracted MP3 stream,
+    worked out from the block sizes and sample counts without decoding.
+
+    byte_offsets and sample_offsets have an entry for every frame from
+    first_frame through the frame of the last block, plus one for the end
+    of the stream, so the audio of frame first_frame + i runs from offsets[i]
+    to offsets[i + 1]. Frames without a block get an empty window. Samples
+    are counted per channel; seek_samples has each block's SeekSamples.
+    Pass the arrays to numpy.asarray() to use them as NumPy arrays.
+    """
+    def __init__(self, first_frame=0):
+        self.first_frame = first_frame
+        self.byte_offsets = array('q', [0])
+        self.sample_offsets = array('q', [0])
+        self.seek_samples = array('q')
+
+    @property
+    def frame_count(self):
+        return len(self.seek_samples)
+
+    def add_block(self, frame, size, samples, seek=0):
+        """ Add the next block of the stream, played on the given frame """
+        if frame < self.first_frame + self.frame_count and self.frame_count > 0:
+            # a second block on the same frame extends that frame's window
+            self.byte_offsets[-1] += size
+            self.sample_offsets[-1] += samples
+            return
+        while self.first_frame + self.frame_count < frame:
+            self._add_frame(0, 0, 0)
+        self._add_frame(size, samples, seek)
+
+    def _add_frame(self, size, samples, seek):
+        self.byte_offsets.append(self.byte_offsets[-1] + size)
+        self.sample_offsets.append(self.sample_offsets[-1] + samples)
+        self.seek_samples.append(seek)
+
+    def byte_window(self, frame):
+        """ Return (start, end) of a frame's MP3 data in the extracted file """
+        i = self._frame_index(frame)
+        return self.byte_offsets[i], self.byte_offsets[i + 1]
+
+    def sample_window(self, frame):
+        """ Return (start, end) of a frame's samples in the decoded stream """
+        i = self._frame_index(frame)
+        return self.sample_offsets[i], self.sample_offsets[i + 1]
+
+    def frame_at_sample(self, sample):
+        """ Return the frame playing a sample of the decoded stream """
+        i = min(max(bisect_right(self.sample_offsets, sample) - 1, 0), self.frame_count - 1)
+        return self.first_frame + i
+
+    def _frame_index(self, frame):
+        i = frame - self.first_frame
+        if i < 0 or i >= self.frame_count:
+            raise Exception("Frame %d is not part of the stream" % frame)
+        return i
+
+def _block_frames(stream):
+    # The frame of every block; blocks that weren't collected with their frame follow the previous one
+    frame = -1
+    for block in stream[1:]:
+        frame = block.frame if block.frame is not None else frame + 1
+        yield frame, block
+
+def index_stream(stream):
+    """
+    Return the StreamIndex of an MP3 stream, without writing it.
+    """
+    header = get_header(stream)
+    assert header.soundFormat == consts.AudioCodec.MP3, 'stream is not MP3'
+    index = None
+    for frame, block in _block_frames(stream):
+        block.complete_parse_with_header(header)
+        if index is None:
+            index = StreamIndex(frame)
+        index.add_block(frame, len(block.mpegFrames), block.sampleCount, block.seekSize)
+    return index if index is not None else StreamIndex()
+
 def write_stream_to_file(stream, output):
+    """
+    Write a stream's audio to output. MP3 streams are written as they are,
+    the others as WAV. Returns the StreamIndex of an MP3 stream, built
+    along the way, or None.
+    """
     header = get_header(stream)
     
     w = None
-    if header.soundFormat in uncompressed:
+    index = None
+    if header.soundFormat in uncompressed or header.soundFormat == consts.AudioCodec.ADPCM:
         w = get_wave_for_header(header, output)
     
-    for block in stream[1:]:
+    for frame, block in _block_frames(stream):
         block.complete_parse_with_header(header)
         
         if header.soundFormat == consts.AudioCodec.MP3:
             output.write(block.mpegFrames)
+            if index is None:
+                index = StreamIndex(frame)
+            index.add_block(frame, len(block.mpegFrames), block.sampleCount, block.seekSize)
+        elif header.soundFormat == consts.AudioCodec.ADPCM:
+            # every block starts its own ADPCM data
+            block.data.seek(0)
+            w.writeframes(decode_adpcm(header, block.data.read()))
         else:
+            block.data.seek(0)
             w.writeframes(block.data.read())
     
     if w:
         w.close()
+    if header.soundFormat == consts.AudioCodec.MP3 and index is None:
+        index = StreamIndex()
+    return index
+
+def get_extension(stream_or_tag):
+    header = get_header(stream_or_tag)
+    return '.mp3' if header.soundFormat == consts.AudioCodec.MP3 else '.wav'
+
+def extract_stream(stream, directory=None, prefix='swf_sound_'):
+    """
+    Write a supported stream to a new, uniquely named file.
+    Blocks are written one by one, the audio is never held in one piece.
+    Returns the path of the file.
+    """
+    return extract_stream_with_index(stream, directory, prefix)[0]
+
+def extract_stream_with_index(stream, directory=None, prefix='swf_sound_'):
+    """
+    Like extract_stream, but returns (path, StreamIndex) for MP3 streams
+    and (path, None) for the others.
+    """
+    fd, path = tempfile.mkstemp(suffix=get_extension(stream), prefix=prefix, dir=directory)
+    with os.fdopen(fd, 'wb') as output:
+        index = write_stream_to_file(stream, output)
+    return path, index
+
+def extract_sound_streams(timeline, directory=None, prefix='swf_sound_'):
+    """
+    Write every supported stream of a timeline and its sprites to its own file.
+    Returns a list of (stream, path) tuples in timeline order.
+    """
+    rc = []
+    for stream in timeline.collect_sound_streams():
+        if supported(stream):
+            rc.append((stream, extract_stream(stream, directory, prefix)))
+    return rc
+
+def read_stream(stream):
+    """
+    Return the MP3 data of a stream in a single preallocated bytearray.
+    """
+    header = get_header(stream)
+    assert header.soundFormat == consts.AudioCodec.MP3, 'stream is not MP3'
+    size = 0
+    for block in stream[1:]:
+        block.complete_parse_with_header(header)
+        size += len(block.mpegFrames)
+    data = bytearray(size)
+    view = memoryview(data)
+    pos = 0
+    for block in stream[1:]:
+        view[pos:pos + len(block.mpegFrames)] = block.mpegFrames
+        pos += len(block.mpegFrames)
+    return data
 
 def write_sound_to_file(st, output):
     assert isinstance(st, tag.TagDefineSound)
+    st.soundData.seek(0)
     if st.soundFormat == consts.AudioCodec.MP3:
         swfs = stream.SWFStream(st.soundData)
         seekSamples = swfs.readSI16()
@@ -79,4 +248,8 @@ def write_sound_to_file(st, output):
     elif st.soundFormat in uncompressed:
         w = get_wave_for_header(st, output)
         w.writeframes(st.soundData.read())
+        w.close()
+    elif st.soundFormat == consts.AudioCodec.ADPCM:
+        w = get_wave_for_header(st, output)
+        w.writeframes(decode_adpcm(st, st.soundData.read()))
         w.close()
\ No newline at end of file
@@ -231,19 +231,28 @@ class SWFTimelineContainer(DefinitionTag):
 
         A stream is returned as a list: the first element is the tag
         which introduced that stream; other elements are the tags
-        which made up the stream body (if any).
+        which made up the stream body (if any). Each block's frame is
+        set to the 0-based frame of its timeline it plays on.
         """
         rc = []
         current_stream = None
-        # looking in all containers for frames
-        for tag in self.all_tags_of_type((TagSoundStreamHead, TagSoundStreamBlock)):
+        frame = 0
+        # blocks belong to the last head of their own timeline, so sprites
+        # are collected separately instead of through all_tags_of_type()
+        for tag in self.tags:
             if isinstance(tag, TagSoundStreamHead):
                 # we have a new stream
                 current_stream = [ tag ]
                 rc.append(current_stream)
-            if isinstance(tag, TagSoundStreamBlock):
+            elif isinstance(tag, TagSoundStreamBlock) and current_stream is not None:
                 # we have a frame for the current stream
+                tag.frame = frame
                 current_stream.append(tag)
+            elif isinstance(tag, TagShowFrame):
+                frame += 1
+        for tag in self.tags:
+            if isinstance(tag, SWFTimelineContainer):
+                rc.extend(tag.collect_sound_streams())
         return rc
 
     def collect_video_streams(self):
@@ -631,7 +640,7 @@ class TagDefineFont(DefinitionTag):
         # font) can be inferred by dividing the first entry in the offset
         # table by two.
         self.offsetTable.append(data.readUI16())
-        numGlyphs = self.offsetTable[0] / 2
+        numGlyphs = self.offsetTable[0] // 2
 
         for i in range(1, numGlyphs):
             self.offsetTable.append(data.readUI16())
@@ -809,7 +818,7 @@ class TagDefineFontInfo(Tag):
         self.wideCodes = ((flags & 0x01) != 0)
 
         if self.wideCodes:
-            numGlyphs = (length - 2 - 1 - fontNameLen - 1) / 2
+            numGlyphs = (length - 2 - 1 - fontNameLen - 1) // 2
         else:
             numGlyphs = length - 2 - 1 - fontNameLen - 1
 
@@ -2062,6 +2071,7 @@ class TagSoundStreamBlock(Tag):
     different values for StreamSoundCompression and StreamSoundSize (SWF 3 file format).
     """
     TYPE = 19
+    frame = None # set by collect_sound_streams
 
     def __init__(self):
         super(TagSoundStreamBlock, self).__init__()
@@ -2080,6 +2090,7 @@ class TagSoundStreamBlock(Tag):
         self.data = BytesIO(data.read(length))
 
     def complete_parse_with_header(self, head):
+        self.data.seek(0)
         stream = SWFStream(self.data)
         if head.soundFormat in (AudioCodec.UncompressedNativeEndian,
                                 AudioCodec.UncompressedLittleEndian):
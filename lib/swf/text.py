@@ -0,0 +1,90 @@
+"""
+This module lays out static text (DefineText and DefineText2) with NumPy.
+
+A text tag is a list of text records, each a run of glyph entries with
+the font, height, color and pen offsets it was given or inherited.
+layout_text() turns the whole tag into a TextLayout: one array entry per
+glyph for its font, glyph index, pen position, height and color, so
+renderers can place glyph outlines in bulk instead of walking records.
+"""
+from __future__ import absolute_import
+import numpy as np
+
+class TextLayout(object):
+    """
+    The glyphs of a text tag, in drawing order. Positions and heights are
+    in twips, in the tag's text space (before its textMatrix).
+
+    @ivar font_ids       fontId of each glyph.
+    @ivar glyph_indices  Index of each glyph in its font's glyphShapeTable.
+    @ivar x, y           Pen position of each glyph.
+    @ivar heights        Text height of each glyph.
+    @ivar colors         RGB(A) color of each glyph, as in its text record.
+    @ivar records        Index of the text record each glyph comes from.
+    """
+    def __init__(self, font_ids, glyph_indices, x, y, heights, colors, records):
+        self.font_ids = font_ids
+        self.glyph_indices = glyph_indices
+        self.x = x
+        self.y = y
+        self.heights = heights
+        self.colors = colors
+        self.records = records
+
+    def __len__(self):
+        return len(self.glyph_indices)
+
+    def code_points(self, code_tables):
+        """
+        Return the code point of every glyph, or -1 where its font has no code table.
+
+        @param code_tables  dict of fontIds to code tables (DefineFontInfo or DefineFont2/3 codeTable).
+        """
+        code_points = np.full(len(self), -1, dtype=np.int64)
+        for font_id in np.unique(self.font_ids):
+            code_table = code_tables.get(int(font_id))
+            if code_table is None or len(code_table) == 0:
+                continue
+            mask = self.font_ids == font_id
+            indices = self.glyph_indices[mask]
+            valid = indices < len(code_table)
+            codes = np.full(len(indices), -1, dtype=np.int64)
+            codes[valid] = np.asarray(code_table, dtype=np.int64)[indices[valid]]
+            code_points[mask] = codes
+        return code_points
+
+    def runs(self):
+        """ Generator for (record index, slice) of each text record's glyphs """
+        if len(self) == 0:
+            return
+        boundaries = np.flatnonzero(np.diff(self.records)) + 1
+        starts = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [len(self)]])
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            yield int(self.records[start]), slice(start, end)
+
+def layout_text(tag):
+    """ Return the TextLayout of a TagDefineText or TagDefineText2 """
+    records = tag.records
+    counts = np.array([len(record.glyphEntries) for record in records], dtype=np.int64)
+    glyph_indices = np.array([entry.index for record in records for entry in record.glyphEntries], dtype=np.int64)
+    advances = np.array([entry.advance for record in records for entry in record.glyphEntries], dtype=np.float64)
+
+    # The parser already carries fonts, colors, heights and y offsets over
+    # from the record before, so those are simply repeated per glyph
+    record_index = np.repeat(np.arange(len(records)), counts)
+    font_ids = np.repeat(np.array([record.fontId for record in records], dtype=np.int64), counts)
+    heights = np.repeat(np.array([record.textHeight for record in records], dtype=np.float64), counts)
+    colors = np.repeat(np.array([record.textColor for record in records], dtype=np.uint32), counts)
+    y = np.repeat(np.array([record.yOffset for record in records], dtype=np.float64), counts)
+
+    # The pen only moves back on records with an x offset. Every other record
+    # carries on from the last glyph before it, so a glyph is at the x offset
+    # of the last record that had one, plus the advances since that record.
+    has_x = np.array([record.hasXOffset for record in records], dtype=bool)
+    x_offsets = np.array([record.xOffset if record.hasXOffset else 0 for record in records], dtype=np.float64)
+    record_starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    anchors = np.maximum.accumulate(np.where(has_x, np.arange(len(records)), 0))
+    pen = np.concatenate([[0.0], np.cumsum(advances)]) # advances before each glyph, and in total
+    x = x_offsets[anchors][record_index] + pen[:-1] - pen[record_starts[anchors]][record_index]
+    return TextLayout(font_ids, glyph_indices, x, y, heights, colors, record_index)
@@ -0,0 +1,189 @@
+"""
+This module keeps track of what is on stage at any frame of a SWF timeline.
+
+DisplayList applies PlaceObject/RemoveObject deltas and stores one merged,
+self-contained placement per depth. Timeline indexes a tag list once and
+keeps a DisplayList snapshot every so many frames, so seeking to a frame
+only replays the tags since the closest snapshot.
+"""
+from __future__ import absolute_import
+from .tag import TagPlaceObject, TagRemoveObject, TagShowFrame
+import bisect
+import copy
+
+SNAPSHOT_INTERVAL = 64
+
+# PlaceObject fields that a move can update, keyed by the flag that says they're present
+PLACEMENT_FIELDS = [
+    ("hasMatrix", "matrix"),
+    ("hasColorTransform", "colorTransform"),
+    ("hasRatio", "ratio"),
+    ("hasName", "instanceName"),
+    ("hasClipDepth", "clipDepth"),
+    ("hasClipActions", "clipActions"),
+    ("hasClassName", "className"),
+    ("hasFilterList", "_surfaceFilterList"),
+    ("hasBlendMode", "blendMode"),
+    ("hasCacheAsBitmap", "bitmapCache"),
+]
+
+class DisplayList(object):
+    """
+    The placements on stage at one point of a timeline.
+
+    Placements are merged PlaceObject tags: each one has hasCharacter set,
+    hasMove cleared, and every field it has inherited from earlier moves.
+    The original tags are never modified.
+    """
+    def __init__(self, placements=None):
+        self._placements = {} if placements is None else dict(placements)
+
+    @property
+    def placements(self):
+        """ Return the dict of depths to placement tags """
+        return self._placements
+
+    def apply(self, tag):
+        """ Apply a display list tag. Returns True if the display list changed """
+        if isinstance(tag, TagPlaceObject):
+            return self.place(tag)
+        elif isinstance(tag, TagRemoveObject):
+            return self._placements.pop(tag.depth, None) is not None
+        return False
+
+    def place(self, tag):
+        """ Merge a PlaceObject tag into the placement at its depth """
+        current = self._placements.get(tag.depth)
+        if current is not None and (tag.hasMove or not tag.hasCharacter):
+            placement = copy.copy(current)
+            if tag.hasCharacter:
+                placement.characterId = tag.characterId
+            for flag, attribute in PLACEMENT_FIELDS:
+                if getattr(tag, flag):
+                    setattr(placement, flag, True)
+                    setattr(placement, attribute, getattr(tag, attribute))
+        elif tag.hasCharacter:
+            placement = copy.copy(tag)
+        else:
+            return False
+        placement.hasCharacter = True
+        placement.hasMove = False
+        self._placements[tag.depth] = placement
+        return True
+
+    def copy(self):
+        return DisplayList(self._placements)
+
+    def get_display_tags(self, z_sorted=True):
+        """ Return the placements as a list of PlaceObject tags """
+        if not z_sorted:
+            return list(self._placements.values())
+        return [self._placements[depth] for depth in sorted(self._placements)]
+
+    def __len__(self):
+        return len(self._placements)
+
+    def __contains__(self, depth):
+        return depth in self._placements
+
+    def __getitem__(self, depth):
+        return self._placements[depth]
+
+    def __str__(self):
+        return "[DisplayList] " + ", ".join(["%d: %d" % (depth, self._placements[depth].characterId) for depth in sorted(self._placements)])
+
+class Timeline(object):
+    """
+    Frame index over a list of timeline tags (a SWF's or a sprite's).
+
+    Frames are 0-based. The display list of a frame is the stage at that
+    frame's ShowFrame tag. Asking for a frame past the last ShowFrame gives
+    the state after all tags.
+
+    @param tags              the timeline's tags
+    @param snapshot_interval number of frames between DisplayList snapshots
+    """
+    def __init__(self, tags, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.tags = tags
+        self.snapshot_interval = snapshot_interval
+        self._frame_ends = []
+        self._snapshots = [DisplayList()]
+        self._placement_frames = {}
+        self._removed_depths = set()
+        display_list = DisplayList()
+        for i, tag in enumerate(tags):
+            if isinstance(tag, TagPlaceObject) and tag.hasCharacter:
+                self._placement_frames.setdefault(tag.depth, []).append(len(self._frame_ends))
+            elif isinstance(tag, TagRemoveObject):
+                self._removed_depths.add(tag.depth)
+            display_list.apply(tag)
+            if isinstance(tag, TagShowFrame):
+                self._frame_ends.append(i)
+                if len(self._frame_ends) % snapshot_interval == 0:
+                    self._snapshots.append(display_list.copy())
+
+    @property
+    def frame_count(self):
+        """ Return the number of ShowFrame tags in the timeline """
+        return len(self._frame_ends)
+
+    def _frame_start(self, frame):
+        return 0 if frame == 0 else self._frame_ends[frame - 1] + 1
+
+    def _frame_end(self, frame):
+        return self._frame_ends[frame] if frame < self.frame_count else len(self.tags)
+
+    def placement_frame(self, depth, frame):
+        """
+        Return the frame the character at a depth was placed in, as of a frame, or None.
+        Moves don't count; a new character at the depth (a new instance) does.
+        """
+        frames = self._placement_frames.get(depth)
+        if frames is None:
+            return None
+        i = bisect.bisect_right(frames, min(frame, self.frame_count)) - 1
+        return frames[i] if i >= 0 else None
+
+    def keeps_placement(self, depth):
+        """
+        Whether the character placed at a depth on the first frame stays there
+        for the whole timeline, so its instance lives on as the timeline loops.
+        """
+        return self._placement_frames.get(depth) == [0] and depth not in self._removed_depths
+
+    def frame_tags(self, frame):
+        """ Return the tags between the previous ShowFrame and this frame's ShowFrame """
+        frame = min(frame, self.frame_count)
+        return self.tags[self._frame_start(frame):self._frame_end(frame)]
+
+    def snapshot(self, frame):
+        """ Return (frame, DisplayList) for the closest snapshot at or before the start of a frame """
+        frame = min(frame, self.frame_count)
+        index = frame // self.snapshot_interval
+        return index * self.snapshot_interval, self._snapshots[index].copy()
+
+    def display_list(self, frame):
+        """ Return a new DisplayList with the stage at the given frame """
+        frame = min(frame, self.frame_count)
+        snapshot_frame, display_list = self.snapshot(frame)
+        for tag in self.tags[self._frame_start(snapshot_frame):self._frame_end(frame)]:
+            display_list.apply(tag)
+        return display_list
+
+    def frames(self, start=0, end=None, display_list=None):
+        """
+        Generator for (frame, DisplayList) from start up to (not including) end.
+
+        The same DisplayList is updated in place from frame to frame, so
+        copy() it to keep it around. Pass display_list to start from the
+        stage at the beginning of the start frame instead of seeking to it.
+        """
+        end = self.frame_count if end is None else min(end, self.frame_count)
+        if start >= end:
+            return
+        if display_list is None:
+            display_list = self.display_list(start - 1) if start > 0 else DisplayList()
+        for frame in range(start, end):
+            for tag in self.tags[self._frame_start(frame):self._frame_end(frame)]:
+                display_list.apply(tag)
+            yield frame, display_list